@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+"""
+行解码与INSERT语句生成的性能测试（见Codec.py）：
+与逐个字段调用Field.to_python()/setattr()、QuerySet.build_insert_sql()的通用实现对比，并检查两者结果一致。
+
+EntitySimulator依赖KBEngine模块，需要在KBEngine进程的python控制台（telnet）中运行：
+import runpy; runpy.run_path( "<path>/bench/bench_codec.py", run_name = "__main__" )
+"""
+import os, random, sys, timeit
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), "..", "common" ) )
+
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator import Fields
+
+
+class BenchCodecModel( EntityModel ):
+	class Meta:
+		db_table = "bench_codec"
+
+	databaseID = Fields.UINT64( db_column = "id", primary_key = True )
+	name       = Fields.UNICODE()
+	level      = Fields.INT32()
+	exp        = Fields.UINT64()
+	gold       = Fields.UINT32()
+	hp         = Fields.FLOAT()
+	data       = Fields.BLOB()
+	title      = Fields.UNICODE()
+
+
+def generic_decode( cls, attrs, row ):
+	"""
+	逐个字段转换的通用实现
+	"""
+	fields = cls._meta.fields
+	values = { k : fields[k].to_python( row[i] ) for i, k in enumerate( attrs ) }
+	return cls.from_values( values )
+
+def generic_insert( m ):
+	"""
+	"""
+	values = { k : getattr( m, k ) for k in m._meta.insert_attrs }
+	return m.objects.build_insert_sql( **values )
+
+def generated_insert( m ):
+	"""
+	"""
+	meta = m._meta
+	return b"".join( ( meta.insert_head, b"( ", meta.encoder( m ), b" )" ) )
+
+def rate( count, func, number = 5 ):
+	"""
+	@return 每秒处理的行数
+	"""
+	return count / ( timeit.timeit( func, number = number ) / number )
+
+def main( count = 10000 ):
+	rnd = random.Random( 1 )
+	rows = [ [ str( i ).encode(), ( "p%d" % i ).encode(), str( rnd.randint( 0, 99 ) ).encode() if i % 7 else None,
+		b"123456", b"0", b"1.5", b"\x00\x01" if i % 3 else None, "称号".encode() ] for i in range( count ) ]
+	attrs = list( BenchCodecModel._meta.fields )
+	decode = BenchCodecModel.get_decoder( attrs )
+
+	for row in rows[:1000]:
+		assert generic_decode( BenchCodecModel, attrs, row ).get_db_snapshot() == decode( row ).get_db_snapshot()
+	old = rate( count, lambda : [ generic_decode( BenchCodecModel, attrs, row ) for row in rows ] )
+	new = rate( count, lambda : [ decode( row ) for row in rows ] )
+	print( "decode      generic %9.0f rows/s, generated %9.0f rows/s, x%.2f" % ( old, new, new / old ) )
+
+	models = [ decode( row ) for row in rows ]
+	for m in models[:1000]:
+		assert generic_insert( m ) == generated_insert( m )
+	old = rate( count, lambda : [ generic_insert( m ) for m in models ] )
+	new = rate( count, lambda : [ generated_insert( m ) for m in models ] )
+	print( "insert sql  generic %9.0f rows/s, generated %9.0f rows/s, x%.2f" % ( old, new, new / old ) )
+
+
+if __name__ == "__main__":
+	main()
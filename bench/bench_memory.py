@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+"""
+Meta.compact的内存测试：分别解码count行数据生成普通实例和compact实例，用tracemalloc统计每个实例占用的内存
+（包括实例本身、__dict__、同步快照以及字段的值）。
+
+EntitySimulator依赖KBEngine模块，需要在KBEngine进程的python控制台（telnet）中运行：
+import runpy; runpy.run_path( "<path>/bench/bench_memory.py", run_name = "__main__" )
+"""
+import gc, os, sys, tracemalloc
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), "..", "common" ) )
+
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator import Fields
+
+
+class BenchNormalModel( EntityModel ):
+	class Meta:
+		db_table = "bench_memory"
+
+	databaseID = Fields.UINT64( db_column = "id", primary_key = True )
+	name       = Fields.UNICODE()
+	level      = Fields.INT32()
+	exp        = Fields.UINT64()
+	gold       = Fields.UINT32()
+	hp         = Fields.FLOAT()
+	data       = Fields.BLOB()
+	title      = Fields.UNICODE()
+
+
+class BenchCompactModel( EntityModel ):
+	class Meta:
+		db_table = "bench_memory"
+		compact = True
+
+	databaseID = Fields.UINT64( db_column = "id", primary_key = True )
+	name       = Fields.UNICODE()
+	level      = Fields.INT32()
+	exp        = Fields.UINT64()
+	gold       = Fields.UINT32()
+	hp         = Fields.FLOAT()
+	data       = Fields.BLOB()
+	title      = Fields.UNICODE()
+
+
+def measure( cls, rows ):
+	"""
+	@return 每个实例平均占用的字节数
+	"""
+	decode = cls.get_decoder( list( cls._meta.fields ) )
+	gc.collect()
+	tracemalloc.start()
+	models = [ decode( row ) for row in rows ]
+	current, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	assert len( models ) == len( rows )
+	return current / len( rows )
+
+def main( count = 100000 ):
+	rows = [ [ str( i ).encode(), ( "p%d" % i ).encode(), b"5", b"123456", b"0", b"1.5", b"", b"" ] for i in range( count ) ]
+	normal = measure( BenchNormalModel, rows )
+	compact = measure( BenchCompactModel, rows )
+	print( "normal  %6.0f bytes/instance" % normal )
+	print( "compact %6.0f bytes/instance, %+.0f%%" % ( compact, ( compact - normal ) * 100.0 / normal ) )
+
+
+if __name__ == "__main__":
+	main()
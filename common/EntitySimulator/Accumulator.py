@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+"""
+计数器增量累加器：
+高频的"UPDATE ... SET col = col + n"（例如击杀数、货币消耗、全服活动进度）先在内存中按（记录, 字段）累加，
+定时为每条记录发出一条"UPDATE ... SET col = col + <累加和>"，减少对热点行的锁竞争。
+写入失败时增量合并回累加器，与之后的增量一起重试，连续失败Meta.accumulate_retries次后丢弃并记录错误日志。
+注意：如果语句实际已经执行成功而只是没有收到结果（例如连接断开），重试会使增量被重复累加。
+"""
+import functools
+
+import KBEngine
+from KBEDebug import *
+
+from .utils.expressions import F
+
+
+# 所有已创建的累加器，用于服务器关闭时统一写入
+g_accumulators = []
+
+def flush_all():
+	"""
+	立即写入所有累加器中的增量，一般在服务器关闭前调用
+	"""
+	for accumulator in g_accumulators:
+		accumulator.flush()
+
+
+class DeltaAccumulator(object):
+	"""
+	某个EntityModel类的增量累加器
+	"""
+	def __init__( self, model_class ):
+		"""
+		@param model_class: EntityModel
+		"""
+		self.model = model_class
+		self.meta = model_class._meta
+		self.pending = {}  # key = 主键值; value = { 属性名 : 累加和 }
+		self.failures = {} # key = 主键值; value = 连续失败的次数
+		self.timerID = 0
+		g_accumulators.append( self )
+
+	def __len__( self ):
+		return len( self.pending )
+
+	def add( self, pk, deltas ):
+		"""
+		累加增量
+		@param pk: 主键值
+		@param deltas: dict; { 属性名 : 增量 }
+		"""
+		sums = self.pending.get( pk )
+		if sums is None:
+			sums = {}
+			self.pending[pk] = sums
+		for k, v in deltas.items():
+			assert k in self.meta.fields and k != self.meta.primary_name, "'%s' is not a valid field to accumulate" % k
+			sums[k] = sums.get( k, 0 ) + v
+
+		if len( self.pending ) >= self.meta.accumulate_max_rows:
+			self.flush()
+		elif not self.timerID:
+			self.timerID = KBEngine.addTimer( self.meta.accumulate_interval, 0, self._on_timer )
+
+	def flush( self ):
+		"""
+		立即写入所有累加的增量
+		"""
+		if self.timerID:
+			KBEngine.delTimer( self.timerID )
+			self.timerID = 0
+
+		pending = self.pending
+		self.pending = {}
+		pkName = self.meta.primary_name
+		for pk, sums in pending.items():
+			values = { k : F( k ) + v for k, v in sums.items() if v }
+			if not values:
+				continue
+			qs = self.model.objects.filter( (pkName, pk) )
+			qs.update( functools.partial( self._flush_callback, pk, sums ), **values )
+
+	def _on_timer( self, timerID ):
+		"""
+		"""
+		self.timerID = 0
+		self.flush()
+
+	def _flush_callback( self, pk, sums, success, rows ):
+		"""
+		"""
+		if success:
+			self.failures.pop( pk, None )
+			return
+
+		failures = self.failures.get( pk, 0 ) + 1
+		if failures > self.meta.accumulate_retries:
+			self.failures.pop( pk, None )
+			ERROR_MSG( "%s::_flush_callback(), %s lost deltas of %s = %s: %s" % ( self.__class__.__name__, self.meta.db_table, self.meta.primary_name, pk, sums ) )
+			return
+
+		# 合并回累加器，下次与新的增量一起写入
+		self.failures[pk] = failures
+		pending = self.pending.setdefault( pk, {} )
+		for k, v in sums.items():
+			pending[k] = pending.get( k, 0 ) + v
+		if not self.timerID:
+			self.timerID = KBEngine.addTimer( self.meta.accumulate_interval, 0, self._on_timer )
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+"""
+增量变更轮询：
+其它进程（其它baseapp、GM工具等）修改了表中的数据后，进程内缓存的数据（identity map、内存表）会过期。
+表中需要有一个每次修改时单调递增的字段（版本号或更新时间），每隔一段时间只查询该字段大于上次水位的记录，
+用查询到的记录更新进程内的缓存（以及共享内存缓存，如果本进程是写入进程），并对每条变化的记录进行回调。
+
+每一轮轮询从 col >= 水位 - overlap 开始查询（包括等于水位的记录），按 (col, pk) 排序，
+一轮之内需要分批查询时以 (col > 上一批最后的col) OR (col = 上一批最后的col AND pk > 上一批最后的主键) 继续，
+因此多条记录的col相同时也不会因为分批查询而漏掉记录。
+col是以秒为单位的更新时间等粒度较粗的值时，水位之后写入、col却与水位相同的记录会在下一轮被重新查询到；
+Meta.change_poll_overlap大于0时（只适用于数值字段）还会重新查询水位之前overlap范围内的记录，用于容忍提交较晚的事务。
+重新查询到的、与上次完全相同的记录会被忽略，不会重复回调。
+
+注意：轮询只能发现新增和修改的记录，其它进程删除的记录永远不会被查询到，进程内缓存中的这些记录不会被移除。
+删除记录时请改为设置删除标记（同时更新col），或者在删除后通知各进程调用QuerySet.reload()、IdentityMap.clear()等
+使缓存失效；通过本进程的QuerySet删除的记录不受影响。
+"""
+import functools
+
+import KBEngine
+from KBEDebug import *
+
+import MysqlUtility
+from .utils.query_utils import Q
+
+
+class ChangePoller(object):
+	"""
+	某个EntityModel类的变更轮询器
+	"""
+	def __init__( self, model_class, column, interval = 5.0, batch = 1000, overlap = 0 ):
+		"""
+		@param model_class: EntityModel
+		@param column: str; 单调递增字段的属性名
+		@param interval: 轮询间隔（秒）
+		@param batch: 每次最多查询多少条记录，查询到的记录数达到该值时立即继续查询
+		@param overlap: 每一轮重新查询水位之前多大范围内的记录（col为数值时有效）
+		"""
+		self.model = model_class
+		self.meta = model_class._meta
+		self.column = column
+		self.interval = interval
+		self.batch = batch
+		self.overlap = overlap
+		self.watermark = None     # 已经查询到的col的最大值
+		self.cursor = None        # 一轮之内分批查询的位置 -> (col的值, 主键值)，None表示新的一轮
+		self.seen = {}            # 水位附近已经处理过的记录 -> { 主键值 : (col的值, 原始数据) }，用于去重
+		self.callbacks = []
+		self.timerID = 0
+		self.polling = False
+		self.stopped = True
+		self.changes = 0          # 总共收到多少条变化的记录
+		self.duplicates = 0       # 重新查询到的、没有变化的记录数
+
+	def subscribe( self, callback ):
+		"""
+		添加变化回调，每条变化的记录回调一次
+		def callback(model):
+			pass
+		"""
+		if callback not in self.callbacks:
+			self.callbacks.append( callback )
+
+	def unsubscribe( self, callback ):
+		"""
+		"""
+		if callback in self.callbacks:
+			self.callbacks.remove( callback )
+
+	def start( self, watermark = None ):
+		"""
+		开始轮询
+		@param watermark: 初始水位（col的值），为None时先查询表中当前的最大值，只通知之后的变化
+		"""
+		self.stopped = False
+		if self.timerID or self.polling:
+			return
+		if watermark is not None:
+			self.watermark = watermark
+			self._schedule()
+			return
+
+		cmd = MysqlUtility.makeSafeSql( "SELECT MAX({}) FROM {}".format( self.meta.fields[self.column].db_column, self.meta.db_table ) )
+		self.polling = True
+		KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._start_callback, cmd ) )
+
+	def stop( self ):
+		"""
+		停止轮询；正在执行的查询返回后不会再处理结果，也不会继续轮询
+		"""
+		self.stopped = True
+		if self.timerID:
+			KBEngine.delTimer( self.timerID )
+			self.timerID = 0
+
+	def _start_callback( self, cmd, result, rows, insertid, error ):
+		"""
+		"""
+		self.polling = False
+		if self.stopped:
+			return
+		if error is not None:
+			ERROR_MSG( "%s::_start_callback(), execute raw sql '%s' fault!!!; error: %s" % ( self.__class__.__name__, cmd, error ) )
+			return
+		if result and result[0][0] is not None:
+			self.watermark = self.meta.fields[self.column].to_python( result[0][0] )
+		self._schedule()
+
+	def _schedule( self ):
+		"""
+		"""
+		if not self.timerID and not self.stopped:
+			self.timerID = KBEngine.addTimer( self.interval, 0, self._on_timer )
+
+	def _on_timer( self, timerID ):
+		"""
+		"""
+		self.timerID = 0
+		self.poll()
+
+	def low_watermark( self ):
+		"""
+		@return 新的一轮从哪个col值开始查询（包括该值）；None表示从头开始
+		"""
+		if self.watermark is None:
+			return None
+		if self.overlap and isinstance( self.watermark, ( int, float ) ):
+			return self.watermark - self.overlap
+		return self.watermark
+
+	def build_sql( self ):
+		"""
+		@return bytes; 查询水位之后变化的记录的sql语句
+		"""
+		pkName = self.meta.primary_name
+		qs = self.model.objects.order_by( self.column, pkName )
+		where = b""
+		if self.cursor is not None:
+			value, pk = self.cursor
+			where = qs.build_where_clauses( Q( **{ self.column + "__gt" : value } ) | Q( ( self.column, value ), ( pkName + "__gt", pk ) ) )
+		elif self.watermark is not None:
+			where = qs.build_where_clauses( ( self.column + "__gte", self.low_watermark() ) )
+
+		attrs = list( self.meta.fields )
+		select = "SELECT {} FROM {}".format( ", ".join( [ self.meta.fields[k].db_column for k in attrs ] ), self.meta.db_table )
+		return attrs, b"".join([
+			MysqlUtility.makeSafeSql( select ),
+			where,
+			qs.build_order_by_clauses(),
+			( " LIMIT %d" % self.batch ).encode(),
+		])
+
+	def poll( self ):
+		"""
+		立即开始新的一轮查询
+		"""
+		if self.polling:
+			return
+		self.cursor = None
+		self._query()
+
+	def _query( self ):
+		"""
+		"""
+		self.polling = True
+		attrs, cmd = self.build_sql()
+		generations = self.model.objects.cache_generations()
+		#DEBUG_MSG( "%s::poll(), %s" % (self.__class__.__name__, cmd) )
+		KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._poll_callback, cmd, attrs, generations ) )
+
+	def _poll_callback( self, cmd, attrs, generations, result, rows, insertid, error ):
+		"""
+		"""
+		self.polling = False
+		if self.stopped:
+			return
+		if error is not None:
+			ERROR_MSG( "%s::_poll_callback(), execute raw sql '%s' fault!!!; error: %s" % ( self.__class__.__name__, cmd, error ) )
+			self._schedule()
+			return
+
+		identities = self.meta.identities
+		memoryTable = self.meta.memory_table
+		sharedCache = self.meta.shared_cache
+		decode = self.model.get_decoder( attrs )
+		colIndex = attrs.index( self.column )
+		colField = self.meta.fields[self.column]
+		for row in result:
+			row = tuple( row )
+			value = colField.to_python( row[colIndex] )
+			model = decode( row )
+			pk = model.get_primary_key_value()
+			self.cursor = ( value, pk )
+			if self.watermark is None or value > self.watermark:
+				self.watermark = value
+			if self.seen.get( pk, ( None, None ) )[1] == row:
+				# 重新查询到的没有变化的记录
+				self.duplicates += 1
+				continue
+			self.seen[pk] = ( value, row )
+			self.changes += 1
+
+			if identities is not None and pk in identities:
+				model = identities.load( model, generations[1] )
+			if memoryTable is not None and memoryTable.ready:
+				memoryTable.apply( model.get_db_snapshot(), [ attrs[i] for i, v in enumerate( row ) if v is None ] )
+			if sharedCache is not None and sharedCache.writer:
+				sharedCache.put( model, generations[2] )
+			for callback in list( self.callbacks ):
+				callback( model )
+
+		if len( result ) >= self.batch:
+			self._query()
+			return
+
+		# 一轮结束，只需要记住下一轮会重新查询到的记录
+		low = self.low_watermark()
+		self.seen = { pk : v for pk, v in self.seen.items() if v[0] >= low }
+		self._schedule()
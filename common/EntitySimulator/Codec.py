@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""
+创建EntityModel类时为其生成专用的编码、解码函数：
+解码函数把数据库返回的一行原始数据直接转换为实例（不调用__init__，不计算默认值），
+编码函数把实例中需要插入的字段直接转义为sql中VALUES的内容。
+生成的代码对常用的字段类型内联了转换过程，避免逐个字段的属性查找与方法调用。
+"""
+import MysqlUtility
+
+from .Fields import FieldInteger, FieldFloat, FieldUnicode, FieldBytes
+
+
+def _decode_expr( field, src, consts ):
+	"""
+	@return str; 把原始数据src转换为python数据的表达式，与field.to_python()的结果一致
+	"""
+	cls = field.__class__
+	if cls.to_python is FieldInteger.to_python:
+		return "int(%s) if %s else 0" % ( src, src )
+	if cls.to_python is FieldFloat.to_python:
+		return "float(%s) if %s else 0" % ( src, src )
+	if cls.to_python is FieldUnicode.to_python:
+		return "%s.decode(%r) if %s else ''" % ( src, field.encoding, src )
+	if cls.to_python is FieldBytes.to_python:
+		return "%s if %s is not None else b''" % ( src, src )
+	name = "_conv%d" % len( consts )
+	consts[name] = field.to_python
+	return "%s(%s)" % ( name, src )
+
+def _compile( source, name, consts ):
+	"""
+	"""
+	namespace = dict( consts )
+	exec( compile( source, "<EntitySimulator.Codec:%s>" % name, "exec" ), namespace )
+	return namespace[name]
+
+def build_decoder( model_class, attrs, defer = False ):
+	"""
+	@param attrs: list of str; 原始数据中各列对应的属性名
+	@param defer: bool; 为True时没有读取的字段不设置值，而是标记为延迟加载（见QuerySet.defer()）
+	@return function(row) -> EntityModel; 与EntityModel.from_db()的结果一致
+	"""
+	from .EntityModel import EntityModel, UNSYNCED
+
+	fields = model_class._meta.fields
+	consts = { "_cls" : model_class, "_new" : object.__new__ }
+	lines = [ "def decode(row):" ]
+	if model_class.__init__ is EntityModel.__init__:
+		lines.append( "\tm = _new(_cls)" )
+	else:
+		# 重载了__init__的类可能在其中初始化了其它属性，不能跳过
+		lines.append( "\tm = _cls()" )
+	if attrs:
+		lines.append( "\t%s, = row" % ", ".join( [ "x%d" % i for i in range( len( attrs ) ) ] ) )
+	for i, k in enumerate( attrs ):
+		lines.append( "\tv%d = %s" % ( i, _decode_expr( fields[k], "x%d" % i, consts ) ) )
+		lines.append( "\tm.%s = v%d" % ( k, i ) )
+	missing = [ k for k in fields if k not in attrs ]
+	if defer:
+		if model_class.__init__ is not EntityModel.__init__:
+			# __init__中已经设置了默认值，需要删除，访问时才能发现字段还没有加载
+			lines.extend( [ "\tdel m.%s" % k for k in missing ] )
+		if missing:
+			consts["_deferred"] = frozenset( missing )
+			lines.append( "\tm._deferred = _deferred" )
+	elif model_class.__init__ is EntityModel.__init__:
+		for k in missing:
+			# 与__init__一致，没有读取的字段使用默认值
+			name = "_default_%s" % k
+			consts[name] = fields[k].default_value
+			lines.append( "\tm.%s = %s()" % ( k, name ) )
+	if model_class._meta.compact:
+		consts["_UNSYNCED"] = UNSYNCED
+		items = [ "v%d" % attrs.index( k ) if k in attrs else "_UNSYNCED" for k in fields ]
+		lines.append( "\tm._db_snapshot = (%s,)" % ", ".join( items ) )
+	else:
+		lines.append( "\tm._db_snapshot = {%s}" % ", ".join( [ "%r: v%d" % ( k, i ) for i, k in enumerate( attrs ) ] ) )
+	lines.append( "\treturn m" )
+	return _compile( "\n".join( lines ), "decode", consts )
+
+def build_values_decoder( model_class, attrs, kind ):
+	"""
+	@param attrs: list of str; 原始数据中各列对应的属性名
+	@param kind: str; "dict"、"tuple"或"flat"（只有一个属性，直接返回值），见QuerySet.values()、values_list()
+	@return function(row) -> dict/tuple/值; 不生成实例
+	"""
+	fields = model_class._meta.fields
+	consts = {}
+	lines = [ "def decode(row):" ]
+	lines.append( "\t%s, = row" % ", ".join( [ "x%d" % i for i in range( len( attrs ) ) ] ) )
+	exprs = [ "(%s)" % _decode_expr( fields[k], "x%d" % i, consts ) for i, k in enumerate( attrs ) ]
+	if kind == "dict":
+		lines.append( "\treturn {%s}" % ", ".join( [ "%r: %s" % ( k, e ) for k, e in zip( attrs, exprs ) ] ) )
+	elif kind == "tuple":
+		lines.append( "\treturn (%s,)" % ", ".join( exprs ) )
+	else:
+		assert len( exprs ) == 1
+		lines.append( "\treturn %s" % exprs[0] )
+	return _compile( "\n".join( lines ), "decode", consts )
+
+def build_encoder( model_class, attrs ):
+	"""
+	@param attrs: list of str; 需要编码的属性名
+	@return function(model) -> bytes; 各字段转义后以", "连接的结果，与MysqlUtility.process_params()一致
+	"""
+	fields = model_class._meta.fields
+	consts = { "_esc" : MysqlUtility.process_param, "_int" : int, "_float" : float, "_str" : str, "_bytes" : bytes }
+	consts.update( { "_esc_int" : MysqlUtility._escape_int, "_esc_float" : MysqlUtility._escape_float,
+		"_esc_str" : MysqlUtility._escape_str, "_esc_bytes" : MysqlUtility._escape_bytes } )
+	fast = { FieldInteger.to_db : ( "_int", "_esc_int" ), FieldFloat.to_db : ( "_float", "_esc_float" ),
+		FieldUnicode.to_db : ( "_str", "_esc_str" ), FieldBytes.to_db : ( "_bytes", "_esc_bytes" ) }
+
+	lines = [ "def encode(m):" ]
+	exprs = []
+	for i, k in enumerate( attrs ):
+		lines.append( "\tv%d = m.%s" % ( i, k ) )
+		# 以to_db()判断，INT8等子类型同样走快速路径
+		spec = fast.get( fields[k].__class__.to_db )
+		if spec:
+			# 值的类型与字段类型一致时（绝大多数情况）直接调用对应的转义函数
+			exprs.append( "(%s(v%d) if v%d.__class__ is %s else _esc(v%d))" % ( spec[1], i, i, spec[0], i ) )
+		else:
+			exprs.append( "_esc(v%d)" % i )
+	lines.append( "\treturn b', '.join((%s,))" % ", ".join( exprs ) if exprs else "\treturn b''" )
+	return _compile( "\n".join( lines ), "encode", consts )
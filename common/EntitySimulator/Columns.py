@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+"""
+列式查询结果（见QuerySet.select_columns()）：
+不生成实例，把数据库返回的原始结果按列转换为numpy数组，供统计、分析类的查询使用。
+
+数值字段（INT8 ~ UINT64、FLOAT、DOUBLE）按Field.dtype生成对应类型的数组，
+整列数据一次性交给numpy转换，不逐个调用int()/float()；无法转换或超出该类型范围的值抛出ValueError或OverflowError，
+不会被截断；
+其它字段（UNICODE、BLOB等）逐个使用Field.to_python()转换后保存在object数组中。
+含有NULL的列为numpy.ma.MaskedArray，NULL的位置被屏蔽（被屏蔽的位置的数据为0或Field.to_python(None)）。
+
+numpy是可选的依赖，没有安装时只是不能使用列式查询。
+"""
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+
+def to_arrays( model_class, attrs, rows ):
+	"""
+	@param attrs: list of str; 原始数据中各列对应的属性名
+	@param rows: 数据库返回的原始结果
+	@return dict; { 属性名 : numpy.ndarray }
+	"""
+	fields = model_class._meta.fields
+	arrays = {}
+	for i, k in enumerate( attrs ):
+		field = fields[k]
+		values = [ row[i] for row in rows ]
+		nulls = [ v is None for v in values ]
+		hasNull = any( nulls )
+		if field.dtype is None:
+			array = numpy.empty( len( values ), dtype = object )
+			for j, v in enumerate( values ):
+				array[j] = field.to_python( v )
+		else:
+			if hasNull:
+				values = [ b"0" if v is None else v for v in values ]
+			# 先生成字节串数组，再整列转换为数值
+			array = numpy.array( values, dtype = numpy.bytes_ ).astype( field.dtype )
+		if hasNull:
+			array = numpy.ma.masked_array( array, mask = nulls )
+		arrays[k] = array
+	return arrays
@@ -8,6 +8,51 @@ import MysqlUtility
 
 from .Fields import FieldInteger
 from .Query import QuerySet
+from .WriteBehind import WriteBehindBuffer
+from .IdentityMap import IdentityMap
+from .QueryCache import QueryCache
+from .ExistenceFilter import ExistenceFilter
+from .MemoryTable import MemoryTable
+from .ChangePoller import ChangePoller
+from . import Codec
+
+
+# 使用者可以在Meta中声明的可选参数，以及未声明时的默认值
+META_OPTIONS = {
+	"write_behind"          : False,  # 是否延迟写入（见WriteBehind.py）
+	"write_behind_interval" : 1.0,    # 延迟写入的最长时间（秒）
+	"write_behind_max_rows" : 500,    # 缓冲的记录数达到这个数量时立即写入
+	"write_behind_retries"  : 3,      # 写入失败时最多重试多少次
+	"accumulate_interval"   : 1.0,    # QuerySet.accumulate()累加的增量最长多久写入一次（秒）
+	"accumulate_max_rows"   : 1000,   # 累加的记录数达到这个数量时立即写入
+	"accumulate_retries"    : 3,      # 写入失败时最多重试多少次
+	"identity_map"          : False,  # 是否按主键缓存实例（见IdentityMap.py）
+	"identity_map_size"     : 10000,  # 最多缓存多少个实例
+	"identity_map_bytes"    : 0,      # 缓存实例占用内存（估算）的上限，0表示不限制
+	"identity_map_ttl"      : 0,      # 实例缓存多少秒后过期，0表示不过期
+	"query_cache_ttl"       : 0,      # 查询结果缓存多少秒，0表示不缓存（见QueryCache.py）
+	"query_cache_size"      : 1000,   # 最多缓存多少条查询结果
+	"single_flight"         : True,   # 相同的select语句在执行期间是否只发出一次
+	"batch_window"          : 0,      # QuerySet.get()收集多少秒内的读取后再合并查询，0表示下一个tick（见Loader.py）
+	"existence_filter"            : "",    # 为哪个主键/唯一键字段（属性名）建立存在性过滤器（见ExistenceFilter.py）
+	"existence_filter_capacity"   : 100000,# 预计的记录数量
+	"existence_filter_error_rate" : 0.01,  # 记录数量为capacity时期望的误判率
+	"existence_filter_normalize"  : None,  # 把key转换为bytes的函数，默认为ExistenceFilter.default_normalize
+	"preload"               : False,  # 是否把整个表加载到内存中查询（见MemoryTable.py）
+	"change_column"         : "",     # 每次修改时单调递增的字段（属性名），用于增量变更轮询（见ChangePoller.py）
+	"change_poll_interval"  : 5.0,    # 变更轮询间隔（秒）
+	"change_poll_batch"     : 1000,   # 每次轮询最多查询的记录数
+	"change_poll_overlap"   : 0,      # 每一轮轮询重新查询水位之前多大范围内的记录（见ChangePoller.py）
+	"apply_update_locally"  : False,  # QuerySet.update()完成后是否在本地计算新值并更新identity map和内存表中的数据
+	"compact"               : False,  # 是否使用__slots__保存字段，减少每个实例占用的内存
+	"compact_overflow"      : False,  # compact为True时，是否允许实例保存字段以外的属性（保存在按需创建的__dict__中）
+}
+
+# 实例内部使用的属性，compact为True时也需要为它们生成slot
+INSTANCE_SLOTS = ( "_db_snapshot", "_lazy", "_deferred" )
+
+# compact为True时，_db_snapshot是与Meta.fields顺序一致的tuple（比dict节省内存），还没有同步过的字段为UNSYNCED
+UNSYNCED = object()
 
 
 class ModelBase(type):
@@ -31,6 +76,18 @@ class ModelBase(type):
 		classcell = attrs.pop('__classcell__', None)
 		if classcell is not None:
 			new_attrs['__classcell__'] = classcell
+		compact_meta = attrs.get('Meta') or getattr(parents[0], 'Meta', None)
+		if getattr(compact_meta, 'compact', False):
+			# __slots__只能在创建类时指定，所以需要在处理Meta之前根据声明的字段生成
+			slots = [ k for k, v in attrs.items() if hasattr(v, 'contribute_to_class') and not inspect.isclass(v) ]
+			slots.extend( INSTANCE_SLOTS )
+			if getattr(compact_meta, 'compact_overflow', False):
+				slots.append( '__dict__' )
+			inherited = set()
+			for b in bases:
+				for c in b.__mro__:
+					inherited.update( c.__dict__.get( '__slots__', () ) )
+			new_attrs['__slots__'] = tuple( [ k for k in slots if k not in inherited ] )
 		new_class = super_new(cls, name, bases, new_attrs)
 		attr_meta = attrs.pop('Meta', None)
 		if not attr_meta:
@@ -45,6 +102,9 @@ class ModelBase(type):
 		_meta.primary_key  = ""      # 主键字段，指向Fields.Field.db_column
 		_meta.primary_name = ""      # 主键名，指向fields中的key
 		_meta.fields = {}            # 表字段声明
+		for k, v in META_OPTIONS.items():
+			if not hasattr(_meta, k):
+				setattr(_meta, k, v)
 		
 		new_class.add_to_class('_meta', _meta)
 
@@ -55,6 +115,37 @@ class ModelBase(type):
 
 		new_class._meta.concrete_model = new_class
 		new_class.objects = QuerySet(new_class)
+		if _meta.write_behind:
+			_meta.write_buffer = WriteBehindBuffer(new_class)
+		_meta.identities = None
+		if _meta.identity_map:
+			_meta.identities = IdentityMap(new_class, _meta.identity_map_size, _meta.identity_map_bytes, _meta.identity_map_ttl)
+		_meta.existence = None
+		if _meta.existence_filter:
+			_meta.existence = ExistenceFilter(new_class, _meta.existence_filter, _meta.existence_filter_capacity,
+				_meta.existence_filter_error_rate, _meta.existence_filter_normalize)
+		_meta.memory_table = None
+		if _meta.preload:
+			_meta.memory_table = MemoryTable(new_class)
+		_meta.shared_cache = None  # 运行时通过QuerySet.attach_shared_cache()设置
+		_meta.poller = None
+		if _meta.change_column:
+			_meta.poller = ChangePoller(new_class, _meta.change_column, _meta.change_poll_interval, _meta.change_poll_batch, _meta.change_poll_overlap)
+		_meta.query_cache = None
+		if _meta.query_cache_ttl:
+			_meta.query_cache = QueryCache(new_class, _meta.query_cache_ttl, _meta.query_cache_size)
+
+		# 生成专用的编码、解码函数（见Codec.py）
+		_meta.decoders = {}
+		_meta.lazy_columns = {}  # 延迟解码时各组属性对应的列（见Lazy.py）
+		_meta.values_decoders = {}  # values()、values_list()查询使用的解码函数
+		_meta.decoders[tuple(_meta.fields)] = Codec.build_decoder(new_class, list(_meta.fields))
+		_meta.field_names = tuple(_meta.fields)
+		_meta.empty_snapshot = (UNSYNCED,) * len(_meta.fields)
+		_meta.insert_attrs = [ k for k in _meta.fields if k != _meta.primary_name ]
+		_meta.insert_head = MysqlUtility.makeSafeSql( "INSERT INTO {} ( {} ) VALUES ".format( _meta.db_table,
+			", ".join( [ _meta.fields[k].db_column for k in _meta.insert_attrs ] ) ) )
+		_meta.encoder = Codec.build_encoder(new_class, _meta.insert_attrs)
 
 		return new_class
 
@@ -91,9 +182,48 @@ class EntityModel(metaclass = ModelBase):
 		# -----------------------
 		db_table = ""          # 数据库表名
 
+		# 以下为可选参数，未声明时使用META_OPTIONS中的默认值
+		write_behind = False          # 是否延迟写入：对已存在记录的writeToDB()会先在内存中合并，再定时写入
+		write_behind_interval = 1.0   # 延迟写入的最长时间（秒）
+		write_behind_max_rows = 500   # 缓冲的记录数达到这个数量时立即写入
+		write_behind_retries = 3      # 写入失败时放回缓冲区，与之后的写入合并后重试，最多重试多少次
+		accumulate_interval = 1.0     # QuerySet.accumulate()累加的增量最长多久写入一次（秒）
+		accumulate_max_rows = 1000    # 累加的记录数达到这个数量时立即写入
+		accumulate_retries = 3        # 写入失败时把增量合并回累加器，下次一起重试，最多重试多少次
+		identity_map = False          # 是否按主键缓存实例：纯主键的查询直接从缓存返回，同一条记录只有一个实例
+		identity_map_size = 10000     # 最多缓存多少个实例，超出时按LRU淘汰
+		identity_map_bytes = 0        # 缓存实例占用内存（估算）的上限，0表示不限制
+		identity_map_ttl = 0          # 实例缓存多少秒后过期，0表示不过期
+		query_cache_ttl = 0           # 查询结果缓存多少秒，0表示不缓存；对该表的任何修改都会使缓存失效
+		query_cache_size = 1000       # 最多缓存多少条查询结果，超出时按LRU淘汰
+		single_flight = True          # 相同的select语句在执行期间只发出一次，结果分发给所有调用者（各自生成实例）
+		batch_window = 0              # QuerySet.get()收集多少秒内的读取后再合并为一条pk IN (...)查询，0表示下一个tick
+		existence_filter = ""         # 为哪个主键/唯一键字段（属性名）建立存在性过滤器，按该字段查询不存在的记录时不访问数据库；
+		                              # 需要在启动时调用QuerySet.build_existence_filter()
+		existence_filter_capacity = 100000   # 预计的记录数量
+		existence_filter_error_rate = 0.01   # 记录数量为capacity时期望的误判率
+		existence_filter_normalize = None    # 把key转换为bytes的函数，默认为ExistenceFilter.default_normalize
+		preload = False               # 是否把整个表加载到内存中，在内存中完成查询（适用于策划配置表）；
+		                              # 第一次查询时自动加载，也可以调用QuerySet.reload()加载
+		change_column = ""            # 每次修改时单调递增的字段（版本号或更新时间的属性名），设置后可以调用QuerySet.watch()
+		                              # 增量轮询其它进程对表的修改，更新identity map和内存表中的数据
+		change_poll_interval = 5.0    # 变更轮询间隔（秒）
+		change_poll_batch = 1000      # 每次轮询最多查询的记录数
+		change_poll_overlap = 0       # change_column为数值时，每一轮重新查询水位之前多大范围内的记录（重复的记录会被忽略），
+		                              # 用于容忍比水位提交得晚的事务；col与水位相同的记录总是会被重新查询
+		apply_update_locally = False  # QuerySet.update()成功后，在本地计算F()等表达式的值，更新identity map和内存表中
+		                              # 满足过滤条件的数据，而不是使它们失效；无法在本地确定结果的记录仍然会失效
+		                              # （包括除法，以及对FLOAT、DOUBLE字段的赋值）
+		compact = False               # 为声明的字段生成__slots__，实例没有__dict__，适合在内存中保存大量记录；
+		                              # 此时不能为实例设置字段以外的属性
+		compact_overflow = False      # compact为True时，允许设置字段以外的属性（保存在第一次使用时才创建的__dict__中）
+
 
 	#_meta = None  # 指向Meta实例的变量，创建类型内部自动注入
 
+	# 基类不使用__dict__，这样Meta.compact为True的子类才能只使用__slots__；其它子类仍然有__dict__
+	__slots__ = ()
+
 
 
 	def __init__( self, *args, **kwargs ):
@@ -109,11 +239,81 @@ class EntityModel(metaclass = ModelBase):
 				vv = vsD.pop(k)
 				setattr( self, k, vv )
 		
-		# 把剩余的不属于字段的内容作为普通属性放入
-		self.__dict__.update(vsD)
+		# 把剩余的不属于字段的内容作为普通属性放入（Meta.compact为True且不允许overflow时会抛出AttributeError）
+		for k, v in vsD.items():
+			setattr( self, k, v )
+
+		# 最近一次与数据库同步时各字段的值，用于判断哪些字段被修改过；
+		# 新创建的实例还不知道数据库中的数据是什么，所以所有字段都视为已修改
+		self._db_snapshot = self._meta.empty_snapshot if self._meta.compact else {}
+
+	def __getattr__( self, name ):
+		"""
+		只有找不到属性时才会调用：延迟解码的实例（见QuerySet.lazy()）在字段第一次被访问时才从原始数据转换
+		"""
+		if name == "_lazy" or name == "_deferred":
+			return None
+		lazy = self._lazy
+		if lazy is not None:
+			column = lazy[0].get( name )
+			if column is not None:
+				v = column[1]( lazy[1][column[0]] )
+				setattr( self, name, v )
+				self._mark_synced( { name : v } )
+				return v
+		deferred = self._deferred
+		if deferred is not None and name in deferred:
+			raise AttributeError( "'%s' field '%s' is deferred, load it with QuerySet.load_deferred() first" % ( self.__class__.__name__, name ) )
+		raise AttributeError( "'%s' object has no attribute '%s'" % ( self.__class__.__name__, name ) )
+
+	@classmethod
+	def from_db( cls, attrs, row ):
+		"""
+		使用从数据库中读取到的一行数据创建实例
+		@param attrs: list of str; 属性名，与row中的值一一对应
+		@param row: 数据库返回的原始数据
+		"""
+		return cls.get_decoder( attrs )( row )
+
+	@classmethod
+	def get_decoder( cls, attrs, defer = False ):
+		"""
+		@param attrs: list of str; 属性名，与原始数据中的值一一对应
+		@param defer: bool; 为True时不在attrs中的字段标记为延迟加载（见QuerySet.defer()），否则使用默认值
+		@return function(row) -> EntityModel; 为这组属性生成的解码函数（见Codec.py）
+		"""
+		key = ( tuple( attrs ), "defer" ) if defer else tuple( attrs )
+		decoder = cls._meta.decoders.get( key )
+		if decoder is None:
+			decoder = Codec.build_decoder( cls, list( attrs ), defer )
+			cls._meta.decoders[key] = decoder
+		return decoder
+
+	@classmethod
+	def get_values_decoder( cls, kind, attrs ):
+		"""
+		@param kind: str; "dict"、"tuple"或"flat"
+		@return function(row) -> dict/tuple/值; 为这组属性生成的解码函数（见Codec.build_values_decoder()）
+		"""
+		key = ( kind, tuple( attrs ) )
+		decoder = cls._meta.values_decoders.get( key )
+		if decoder is None:
+			decoder = Codec.build_values_decoder( cls, list( attrs ), kind )
+			cls._meta.values_decoders[key] = decoder
+		return decoder
 
 
 
+	@classmethod
+	def from_values( cls, values ):
+		"""
+		使用已经转换好的、与数据库中一致的数据创建实例
+		@param values: dict; { 属性名 : 值 }
+		"""
+		m = cls( **values )
+		m._mark_synced( values )
+		return m
+
 	@classmethod
 	def get_field_def( cls, attrName ):
 		"""
@@ -131,16 +331,97 @@ class EntityModel(metaclass = ModelBase):
 		"""
 		return getattr( self, self._meta.primary_name )
 
+	def get_deferred_fields( self ):
+		"""
+		@return set of str; 延迟加载（见QuerySet.only()、defer()）且还没有加载或赋值的字段
+		"""
+		deferred = self._deferred
+		if not deferred:
+			return set()
+		pending = set()
+		for k in deferred:
+			try:
+				object.__getattribute__( self, k )  # 不触发__getattr__()
+			except AttributeError:
+				pending.add( k )
+		return pending
+
+	def get_dirty_fields( self ):
+		"""
+		返回自最近一次与数据库同步（读取或写入）以来被修改过的字段，不包括还没有加载的延迟加载字段
+		@return dict; { 属性名 : 当前值 }
+		"""
+		dirty = {}
+		skip = self.get_deferred_fields()
+		if self._meta.compact:
+			# 先读取所有字段（延迟解码的字段在读取时才会同步到_db_snapshot中）
+			values = [ UNSYNCED if k in skip else getattr( self, k ) for k in self._meta.field_names ]
+			for k, v, s in zip( self._meta.field_names, values, self._db_snapshot ):
+				if v is not UNSYNCED and ( s is UNSYNCED or s != v ):
+					dirty[k] = v
+			return dirty
+
+		snapshot = self._db_snapshot
+		for k in self._meta.fields:
+			if k in skip:
+				continue
+			v = getattr( self, k )
+			if k not in snapshot or snapshot[k] != v:
+				dirty[k] = v
+		return dirty
+
+	def get_db_snapshot( self ):
+		"""
+		@return dict; { 属性名 : 最近一次与数据库同步时的值 }，不包括还没有同步过的字段；调用者不能修改返回的字典
+		"""
+		if self._meta.compact:
+			return { k : s for k, s in zip( self._meta.field_names, self._db_snapshot ) if s is not UNSYNCED }
+		return self._db_snapshot
+
+	def is_dirty( self ):
+		"""
+		是否有字段被修改过
+		"""
+		return bool( self.get_dirty_fields() )
+
+	def _mark_synced( self, values ):
+		"""
+		记录已经与数据库同步了的字段值
+		@param values: dict; { 属性名 : 写入或读取到的值 }
+		"""
+		if self._meta.compact:
+			self._db_snapshot = tuple( [ values.get( k, s ) for k, s in zip( self._meta.field_names, self._db_snapshot ) ] )
+			return
+		self._db_snapshot.update( values )
+
+	def _load_deferred( self, values ):
+		"""
+		写入从数据库读取到的延迟加载字段；已经被赋值的字段保留本地的值（与读取到的值不同时仍然视为修改过）
+		@param values: dict; { 属性名 : 读取到的值 }
+		"""
+		deferred = self._deferred
+		pending = self.get_deferred_fields()
+		for k, v in values.items():
+			if k in pending:
+				setattr( self, k, v )
+		self._mark_synced( { k : v for k, v in values.items() if k in deferred } )
+		remain = deferred - set( values )
+		self._deferred = frozenset( remain ) if remain else None
+
 	def deleteFromDB( self, callback = None ):
 		"""
 		从服务器中把与自己有关的数据删除
 		"""
 		assert self._meta.primary_key, "primary key not set!"
+		if self._meta.write_behind:
+			self._meta.write_buffer.discard( self.get_primary_key_value() )
 		self.objects.delete( callback, (self._meta.primary_name, self.get_primary_key_value()) )
 
 	def writeToDB( self, callback = None, forceInsert = False ):
 		"""
-		把当前所有数据写入到数据库中。
+		把当前数据写入到数据库中。
+		更新已存在的记录时只写入被修改过的字段（见get_dirty_fields()），没有字段被修改时不会访问数据库，直接回调成功。
+		Meta.write_behind为True时，对已存在记录的更新会先放入延迟写入缓冲区，与之后的写入合并后再写入数据库。
 		注意：如果self.databaseID是无效的值，那么将会出现异常
 		@param forceInsert: 是否不管主键值存不存在都强行插入一条新数据
 		@param callback: This optional argument is a callable object that will be called when the response from the database is received. 
@@ -148,28 +429,45 @@ class EntityModel(metaclass = ModelBase):
 			def callback(success, entModel):
 				pass
 		"""
-		d = {}
-		for k, t in self._meta.fields.items():
-			d[k] = self.__dict__[k]
-		
-		d.pop(self._meta.primary_name, None)
 		if self.get_primary_key_value() and not forceInsert:  # 主键已经有值了，且不强行插入数据，则只能是更新
+			d = self.get_dirty_fields()
+			d.pop(self._meta.primary_name, None)
+			if not d:
+				if callable( callback ):
+					callback(True, self)
+				return
+			if self._meta.write_behind:
+				self._meta.write_buffer.write(self, d, callback)
+				return
+			synced = dict(d)
+			synced[self._meta.primary_name] = self.get_primary_key_value()
 			qs = self.objects.filter((self._meta.primary_name, self.get_primary_key_value()))
-			qs.update(functools.partial(self._write_to_db_update_callback, callback), **d)
+			qs._update(functools.partial(self._write_to_db_update_callback, callback, synced), list(d.items()), [self])
 		else:							 # 主键无值，直接插入新数据
-			self.objects.insert(functools.partial(self._write_to_db_insert_callback, callback), **d)
+			d = { k : getattr( self, k ) for k in self._meta.insert_attrs }
+			self.objects.insert_model(functools.partial(self._write_to_db_insert_callback, callback, d), self, d)
 
-	def _write_to_db_update_callback(self, callback, success, rows):
+	def _write_to_db_update_callback(self, callback, values, success, rows):
 		"""
 		"""
+		if success:
+			self._mark_synced( values )
+			if self._meta.identities is not None:
+				self._meta.identities.put( self )
+
 		if callable( callback ):
 			callback(success, self)
 
-	def _write_to_db_insert_callback(self, callback, success, insertid):
+	def _write_to_db_insert_callback(self, callback, values, success, insertid):
 		"""
 		"""
-		if success and isinstance(self._meta.fields[self._meta.primary_name], FieldInteger):
-			setattr( self, self._meta.primary_name, insertid )
+		if success:
+			if isinstance(self._meta.fields[self._meta.primary_name], FieldInteger):
+				setattr( self, self._meta.primary_name, insertid )
+				values[self._meta.primary_name] = insertid
+			self._mark_synced( values )
+			if self._meta.identities is not None:
+				self._meta.identities.put( self )
 
 		if callable( callback ):
 			callback(success, self)
\ No newline at end of file
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+"""
+主键/唯一键的存在性过滤器（负缓存）：
+启动时扫描整个表的某一个键字段构建Bloom filter，之后通过QuerySet插入的记录也会加入其中；
+按该字段查询时，如果过滤器判定key一定不存在，则直接在本地返回空结果，不需要访问数据库。
+
+注意：
+1.Bloom filter不支持删除，被删除的记录仍会被判定为“可能存在”（只会多查一次数据库，不会出错），
+  删除较多时可以调用build()重建；重建期间仍然使用原来的过滤器，期间插入的key同时加入新的过滤器，完成后替换；
+2.对该字段使用F()等表达式进行更新后无法再确定该字段有哪些值，过滤器会停止工作直到重新build()；
+3.mysql的字符串比较通常不区分大小写且忽略末尾空格，字符串key默认会转为小写并去掉末尾空格；
+  如果该字段的排序规则（collation）还有其它等价规则（例如忽略重音），请通过Meta.existence_filter_normalize指定转换函数。
+"""
+import functools
+
+import KBEngine
+from KBEDebug import *
+
+import MysqlUtility
+from .utils.bloom import BloomFilter
+
+
+def default_normalize( value ):
+	"""
+	把key转换为用于Bloom filter的bytes
+	"""
+	if isinstance( value, bytes ):
+		return value
+	if isinstance( value, str ):
+		return value.rstrip( " " ).lower().encode( "utf-8" )
+	return str( value ).encode( "utf-8" )
+
+
+class ExistenceFilter(object):
+	"""
+	某个EntityModel类的某个键字段的存在性过滤器
+	"""
+	def __init__( self, model_class, attrname, capacity = 100000, error_rate = 0.01, normalize = None ):
+		"""
+		@param model_class: EntityModel
+		@param attrname: 键字段的属性名，必须是主键或唯一键
+		@param capacity: 预计的记录数量
+		@param error_rate: 记录数量为capacity时期望的误判率
+		@param normalize: 把key转换为bytes的函数，默认为default_normalize
+		"""
+		self.model = model_class
+		self.meta = model_class._meta
+		self.attrname = attrname
+		self.capacity = capacity
+		self.error_rate = error_rate
+		self.normalize = normalize or default_normalize
+		self.bloom = BloomFilter( capacity, error_rate )
+		self.building = None    # 正在构建的新过滤器
+		self.ready = False      # 是否已经构建完成并可用
+		self.generation = 0     # 每次失效时加1，构建期间失效过则构建结果不可用
+
+		self.checks = 0           # 查询了多少个key
+		self.negatives = 0        # 多少个key被判定为一定不存在（节省的查询）
+		self.false_positives = 0  # 判定为可能存在，但数据库中不存在的key的数量
+		self.deletes = 0          # 通过QuerySet删除记录的次数（这些key仍在过滤器中）
+
+	def stats( self ):
+		"""
+		@return dict
+		"""
+		return {
+			"ready"                 : self.ready,
+			"keys"                  : len( self.bloom ),
+			"capacity"              : self.capacity,
+			"error_rate"            : self.error_rate,
+			"estimated_error_rate"  : self.bloom.estimated_error_rate(),
+			"memory"                : self.bloom.memory(),
+			"bits"                  : self.bloom.num_bits,
+			"hashes"                : self.bloom.num_hashes,
+			"checks"                : self.checks,
+			"negatives"             : self.negatives,
+			"false_positives"       : self.false_positives,
+			"deletes"               : self.deletes,
+		}
+
+	def add( self, value ):
+		"""
+		"""
+		key = self.normalize( value )
+		self.bloom.add( key )
+		if self.building is not None:
+			# 扫描可能已经越过了这个key
+			self.building.add( key )
+
+	def might_contain( self, value ):
+		"""
+		@return bool; False表示一定不存在
+		"""
+		self.checks += 1
+		if self.normalize( value ) in self.bloom:
+			return True
+		self.negatives += 1
+		return False
+
+	def track( self, values ):
+		"""
+		记录插入或更新时写入该字段的值
+		@param values: dict; { 属性名 : 值 }
+		"""
+		if self.attrname not in values:
+			return
+		v = values[self.attrname]
+		if hasattr( v, "resolve_expression" ):
+			self.invalidate()
+		else:
+			self.add( v )
+
+	def invalidate( self ):
+		"""
+		无法再确定该字段有哪些值，停止使用过滤器直到重新build()
+		"""
+		if self.ready:
+			WARNING_MSG( "%s::invalidate(), existence filter of %s.%s disabled until rebuilt" % ( self.__class__.__name__, self.meta.db_table, self.attrname ) )
+		self.ready = False
+		self.building = None
+		self.generation += 1
+
+	def build( self, callback = None, batch = 10000 ):
+		"""
+		按该字段分页扫描整个表（keyset pagination）构建新的过滤器，完成后替换当前的过滤器
+		def callback(success, keys):
+			pass
+		"""
+		self.generation += 1
+		self.building = BloomFilter( self.capacity, self.error_rate )
+		self._scan( callback, batch, self.generation, None, 0 )
+
+	def _scan( self, callback, batch, generation, last, total ):
+		"""
+		"""
+		column = self.meta.fields[self.attrname].db_column
+		cmd = "SELECT {0} FROM {1}".format( column, self.meta.db_table )
+		if last is None:
+			cmd = MysqlUtility.makeSafeSql( cmd )
+		else:
+			cmd = MysqlUtility.makeSafeSql( cmd + " WHERE {} > %s".format( column ), (last,) )
+		cmd += ( " ORDER BY {} LIMIT {}".format( column, batch ) ).encode()
+		KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._scan_callback, cmd, callback, batch, generation, total ) )
+
+	def _scan_callback( self, cmd, callback, batch, generation, total, result, rows, insertid, error ):
+		"""
+		"""
+		if generation != self.generation:
+			# 构建期间失效或者开始了新的构建
+			WARNING_MSG( "%s::_scan_callback(), existence filter of %s.%s invalidated while building" % ( self.__class__.__name__, self.meta.db_table, self.attrname ) )
+			if callable( callback ):
+				callback( False, total )
+			return
+		if error is not None:
+			ERROR_MSG( "%s::_scan_callback(), execute raw sql '%s' fault!!!; error: %s" % ( self.__class__.__name__, cmd, error ) )
+			self.building = None
+			if callable( callback ):
+				callback( False, total )
+			return
+
+		field = self.meta.fields[self.attrname]
+		last = None
+		for row in result:
+			last = field.to_python( row[0] )
+			self.building.add( self.normalize( last ) )
+		total += len( result )
+
+		if len( result ) >= batch:
+			self._scan( callback, batch, generation, last, total )
+			return
+
+		self.bloom = self.building
+		self.building = None
+		self.ready = True
+		if callable( callback ):
+			callback( True, total )
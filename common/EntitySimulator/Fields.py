@@ -2,7 +2,7 @@
 
 """
 """
-import functools
+import functools, math
 
 #from KBEDebug import *
 
@@ -12,6 +12,8 @@ class Field( object ):
 	"""
 	表字段定义
 	"""
+	dtype = None  # 对应的numpy数据类型，None表示以object数组保存（见Columns.py）
+
 	def __init__(self, db_column = None, primary_key = False, default = None):
 		"""
 		"""
@@ -81,6 +83,13 @@ class Field( object ):
 		"""
 		raise NotImplementedError
 
+	def coerce(self, value):
+		"""
+		把写入数据库的值（包括在本地计算的表达式的结果）转換成从数据库读取出来时的python数据，
+		无法确定数据库中的结果时抛出TypeError或ValueError
+		"""
+		raise TypeError("can not coerce value for %s" % self.__class__.__name__)
+
 
 class FieldInteger( Field ):
 	"""
@@ -104,6 +113,14 @@ class FieldInteger( Field ):
 		"""
 		return process_param(int(value))
 
+	def coerce(self, value):
+		"""
+		mysql把小数写入整数字段时四舍五入（远离0）
+		"""
+		if isinstance(value, float):
+			return int(math.floor(abs(value) + 0.5)) * (1 if value >= 0 else -1)
+		return int(value)
+
 class FieldFloat( Field ):
 	"""
 	浮点数类型
@@ -126,6 +143,13 @@ class FieldFloat( Field ):
 		"""
 		return process_param(float(value))
 
+	def coerce(self, value):
+		"""
+		mysql中FLOAT是单精度的，DOUBLE的计算（以及写入时的舍入）也不一定与python一致，
+		结果无法在本地确定
+		"""
+		raise TypeError("can not coerce value for %s" % self.__class__.__name__)
+
 class FieldUnicode( Field ):
 	"""
 	unicode类型
@@ -154,6 +178,13 @@ class FieldUnicode( Field ):
 		"""
 		return process_param(str(value))
 
+	def coerce(self, value):
+		"""
+		"""
+		if not isinstance(value, str):
+			raise TypeError(value)
+		return value
+
 class FieldBytes( Field ):
 	"""
 	bytes类型——二进制数据，也可以认为是c++中的char[]
@@ -176,6 +207,13 @@ class FieldBytes( Field ):
 		"""
 		return process_param(bytes(value))
 
+	def coerce(self, value):
+		"""
+		"""
+		if not isinstance(value, bytes):
+			raise TypeError(value)
+		return value
+
 
 class FieldFixedArray( Field ):
 	"""
@@ -252,18 +290,39 @@ class FieldFixedDict( Field ):
 
 
 
-INT8       = FieldInteger
-UINT8      = FieldInteger
-INT16      = FieldInteger
-UINT16     = FieldInteger
-INT32      = FieldInteger
-UINT32     = FieldInteger
-INT64      = FieldInteger
-UINT64     = FieldInteger
+# 与KBEngine的数据类型对应；数值类型带有各自的numpy数据类型，供列式查询使用
+class INT8( FieldInteger ):
+	dtype = "int8"
+
+class UINT8( FieldInteger ):
+	dtype = "uint8"
+
+class INT16( FieldInteger ):
+	dtype = "int16"
+
+class UINT16( FieldInteger ):
+	dtype = "uint16"
+
+class INT32( FieldInteger ):
+	dtype = "int32"
+
+class UINT32( FieldInteger ):
+	dtype = "uint32"
+
+class INT64( FieldInteger ):
+	dtype = "int64"
+
+class UINT64( FieldInteger ):
+	dtype = "uint64"
+
+class FLOAT( FieldFloat ):
+	dtype = "float32"
+
+class DOUBLE( FieldFloat ):
+	dtype = "float64"
+
 UNICODE    = FieldUnicode
 BLOB       = FieldBytes
-FLOAT      = FieldFloat
-DOUBLE     = FieldFloat
 #ARRAY      = FieldFixedArray  # un-support
 #TUPLE      = FieldFixedTuple  # un-support
 #FIXED_DICT = FieldFixedDict   # un-support
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+"""
+按主键缓存EntityModel实例的identity map：
+同一条记录在进程内只保留一个实例，纯主键的查询（pk = x、pk__in = (...)）直接从缓存返回，
+通过QuerySet进行的修改会使对应的缓存失效，以保持与数据库一致；
+修改之前发出、修改之后才返回的查询结果可能是修改之前的数据，不会放入缓存（见write_generation）。
+缓存数量与内存占用（估算）有上限，超出时按LRU淘汰；可设置过期时间。
+"""
+import collections, sys, time
+
+
+class IdentityMap(object):
+	"""
+	某个EntityModel类的identity map
+	"""
+	def __init__( self, model_class, max_entries = 10000, max_bytes = 0, ttl = 0 ):
+		"""
+		@param model_class: EntityModel
+		@param max_entries: 最多缓存多少个实例
+		@param max_bytes: 缓存实例占用内存（估算）的上限，0表示不限制
+		@param ttl: 实例放入缓存后多少秒过期，0表示不过期
+		"""
+		self.model = model_class
+		self.meta = model_class._meta
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		self.ttl = ttl
+		self.entries = collections.OrderedDict()  # key = 主键值; value = [EntityModel, 过期时间, 估算的内存占用]
+		self.bytes = 0
+		self.write_generation = 0  # 表每次被修改时加1（见QuerySet._on_write()），期间被修改过的查询结果不放入缓存
+
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.expirations = 0
+
+	def __len__( self ):
+		return len( self.entries )
+
+	def __contains__( self, pk ):
+		return pk in self.entries
+
+	def stats( self ):
+		"""
+		@return dict; 命中、未命中、淘汰、过期次数以及当前缓存的数量和内存占用
+		"""
+		return {
+			"hits"        : self.hits,
+			"misses"      : self.misses,
+			"evictions"   : self.evictions,
+			"expirations" : self.expirations,
+			"entries"     : len( self.entries ),
+			"bytes"       : self.bytes,
+		}
+
+	def estimate_size( self, model ):
+		"""
+		估算一个实例占用的内存
+		"""
+		size = sys.getsizeof( model )
+		d = getattr( model, "__dict__", None )
+		if d is not None:
+			size += sys.getsizeof( d )
+		for k in self.meta.fields:
+			size += sys.getsizeof( getattr( model, k, None ) )
+		return size
+
+	def get( self, pk ):
+		"""
+		@return EntityModel or None
+		"""
+		entry = self.entries.get( pk )
+		if entry is None:
+			self.misses += 1
+			return None
+		if entry[1] and entry[1] < time.time():
+			self.expirations += 1
+			self.misses += 1
+			self._remove( pk )
+			return None
+		self.hits += 1
+		self.entries.move_to_end( pk )
+		return entry[0]
+
+	def lookup( self, pks ):
+		"""
+		@return (list of EntityModel, list of pk); 命中的实例以及未命中的主键
+		"""
+		hits = []
+		missing = []
+		for pk in pks:
+			m = self.get( pk )
+			if m is None:
+				missing.append( pk )
+			else:
+				hits.append( m )
+		return hits, missing
+
+	def put( self, model ):
+		"""
+		放入（或替换）一个实例
+		"""
+		pk = model.get_primary_key_value()
+		if not pk:
+			return
+		self._remove( pk )
+		if model.get_deferred_fields():
+			# 没有完整加载的实例（见QuerySet.only()、defer()）不放入缓存，纯主键查询不能返回缺少字段的实例
+			return
+		size = self.estimate_size( model )
+		self.entries[pk] = [model, time.time() + self.ttl if self.ttl else 0, size]
+		self.bytes += size
+		while self.entries and (len( self.entries ) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes)):
+			oldest = next( iter( self.entries ) )
+			self._remove( oldest )
+			self.evictions += 1
+
+	def load( self, model, generation = None ):
+		"""
+		把从数据库中读取到的实例并入缓存。
+		如果缓存中已经有这条记录的实例，则把没有被本地修改过的字段更新为数据库中的值，并返回已缓存的实例，
+		以保证同一条记录只有一个实例。
+
+		@param model: EntityModel; 刚从数据库读取的实例
+		@param generation: 发出查询时的self.write_generation；之后表被修改过时，
+			查询结果可能是修改之前的数据，直接返回model，不放入缓存也不更新已缓存的实例
+		@return EntityModel
+		"""
+		if generation is not None and generation != self.write_generation:
+			return model
+		pk = model.get_primary_key_value()
+		entry = self.entries.get( pk )
+		if entry is None or (entry[1] and entry[1] < time.time()):
+			self.put( model )
+			return model
+
+		cached = entry[0]
+		dirty = cached.get_dirty_fields()
+		loaded = model.get_db_snapshot()
+		for k, v in loaded.items():
+			if k not in dirty:
+				setattr( cached, k, v )
+		cached._mark_synced( loaded )
+		self.entries.move_to_end( pk )
+		return cached
+
+	def models( self, pks = None ):
+		"""
+		@param pks: 只返回这些主键的实例，None表示所有实例
+		@return list of (主键值, EntityModel); 当前缓存的实例
+		"""
+		if pks is None:
+			return [ (pk, entry[0]) for pk, entry in self.entries.items() ]
+		entries = self.entries
+		return [ (pk, entries[pk][0]) for pk in set( pks ) if pk in entries ]
+
+	def remove( self, pks, keep = () ):
+		"""
+		使一些记录的缓存失效
+		@param keep: list of EntityModel; 发出修改的实例，它们自己的缓存不需要失效（修改完成前它们的值就是最新的）
+		"""
+		for pk in pks:
+			entry = self.entries.get( pk )
+			if entry is not None and any( entry[0] is m for m in keep ):
+				continue
+			self._remove( pk )
+
+	def clear( self ):
+		"""
+		使所有缓存失效
+		"""
+		self.entries.clear()
+		self.bytes = 0
+
+	def _remove( self, pk ):
+		"""
+		"""
+		entry = self.entries.pop( pk, None )
+		if entry is not None:
+			self.bytes -= entry[2]
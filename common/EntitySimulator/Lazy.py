@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""
+延迟解码的查询结果（见QuerySet.lazy()）：
+回调得到的是保存着数据库原始结果的序列，某一行第一次被访问时才生成实例，
+实例的某个字段第一次被访问时才从原始数据转换（见EntityModel.__getattr__()），转换后的值会被保存，
+因此查询大量记录但只使用其中少量记录、少量字段时，开销只与实际访问的数据量有关。
+
+注意：
+1.使用identity map，或者本进程是共享内存缓存的写入进程时，需要完整的数据，行仍然在第一次访问时才生成，但会一次转换所有字段；
+2.重载了__init__的EntityModel类无法跳过__init__，同样在生成实例时一次转换所有字段；
+3.get_dirty_fields()（以及writeToDB()）会转换所有还没有转换的字段。
+"""
+import collections.abc
+
+
+def get_columns( model_class, attrs ):
+	"""
+	@return dict; { 属性名 : (在原始数据中的下标, Field.to_python) }
+	"""
+	key = tuple( attrs )
+	columns = model_class._meta.lazy_columns.get( key )
+	if columns is None:
+		fields = model_class._meta.fields
+		columns = { k : ( i, fields[k].to_python ) for i, k in enumerate( attrs ) }
+		model_class._meta.lazy_columns[key] = columns
+	return columns
+
+
+class LazyDelivery(object):
+	"""
+	标记回调需要延迟解码的结果
+	"""
+	__slots__ = ( "callback", )
+
+	def __init__( self, callback ):
+		self.callback = callback
+
+	def __call__( self, success, models ):
+		if callable( self.callback ):
+			self.callback( success, models )
+
+
+class LazyResult(collections.abc.Sequence):
+	"""
+	延迟解码的查询结果，可以像list一样使用
+	"""
+	def __init__( self, model_class, attrs, rows, generations = None ):
+		"""
+		@param attrs: list of str; 原始数据中各列对应的属性名
+		@param rows: 数据库返回的原始结果
+		@param generations: 发出查询时各缓存的generation（见QuerySet.cache_generations()），None表示结果来自查询结果缓存
+		"""
+		from .EntityModel import EntityModel
+
+		self.model = model_class
+		self.meta = model_class._meta
+		self.attrs = attrs
+		self.rows = rows
+		self.generations = generations
+		self.models = [None] * len( rows )
+		# 没有查询的字段（见QuerySet.only()、defer()）标记为延迟加载
+		self.deferred = frozenset( [ k for k in self.meta.field_names if k not in attrs ] ) or None
+		self.full = self.meta.identities is not None or ( self.meta.shared_cache is not None and self.meta.shared_cache.writer ) \
+			or model_class.__init__ is not EntityModel.__init__
+		self.columns = None if self.full else get_columns( model_class, attrs )
+
+	def __len__( self ):
+		return len( self.rows )
+
+	def __getitem__( self, index ):
+		if isinstance( index, slice ):
+			return [ self[i] for i in range( *index.indices( len( self.rows ) ) ) ]
+		m = self.models[index]
+		if m is None:
+			m = self._materialize( self.rows[index] )
+			self.models[index] = m
+		return m
+
+	def __add__( self, other ):
+		return list( self ) + list( other )
+
+	def __radd__( self, other ):
+		return list( other ) + list( self )
+
+	def _materialize( self, row ):
+		"""
+		"""
+		meta = self.meta
+		if self.full:
+			m = self.model.get_decoder( self.attrs, self.deferred is not None )( row )
+			generations = self.generations
+			if meta.shared_cache is not None and meta.shared_cache.writer and generations is not None:
+				meta.shared_cache.put( m, generations[2] )
+			if meta.identities is not None:
+				m = meta.identities.load( m, generations[1] if generations is not None else None )
+			return m
+
+		m = object.__new__( self.model )
+		m._db_snapshot = meta.empty_snapshot if meta.compact else {}
+		m._lazy = ( self.columns, row )
+		if self.deferred is not None:
+			m._deferred = self.deferred
+		return m
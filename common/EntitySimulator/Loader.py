@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""
+按主键读取记录的批量加载器（类似DataLoader）：
+同一个tick（或一个很短的时间窗口）内的多次按主键读取会被合并为一条"SELECT ... WHERE pk IN (...)"，
+查询结果再按主键分发给各自的回调。
+主键值按字段类型规范化后再合并、分发（例如"5"与5是同一条记录，字符串主键按排序规则近似比较）；
+没有使用identity map时，同一条记录的每个回调都得到各自的实例。
+"""
+import copy, functools
+
+import KBEngine
+
+from .Fields import FieldUnicode
+from .utils.query_utils import collation_key
+
+
+class BatchLoader(object):
+	"""
+	某个EntityModel类的批量加载器
+	"""
+	def __init__( self, model_class, window = 0, max_keys = 1000 ):
+		"""
+		@param model_class: EntityModel
+		@param window: 收集多少秒内的读取请求后再发出查询，0表示下一个tick
+		@param max_keys: 一条语句最多查询多少个主键
+		"""
+		self.model = model_class
+		self.meta = model_class._meta
+		self.window = window
+		self.max_keys = max_keys
+		self.pending = {}  # key = 规范化后的主键值（见key()）; value = ( 主键值, [callback, ...] )
+		self.timerID = 0
+
+	def __len__( self ):
+		return len( self.pending )
+
+	def load( self, pk, callback ):
+		"""
+		读取一条记录
+		def callback(success, model):
+			pass
+		model: 记录不存在时为None
+		"""
+		key = self.key( pk )
+		entry = self.pending.get( key )
+		if entry is None:
+			entry = ( pk, [] )
+			self.pending[key] = entry
+		entry[1].append( callback )
+		if not self.timerID:
+			self.timerID = KBEngine.addTimer( self.window, 0, self._on_timer )
+
+	def key( self, pk ):
+		"""
+		把主键值转换为与数据库返回的记录的主键值相同的形式（与Field.to_python()解析数据库返回的原始数据一致）
+		"""
+		field = self.meta.fields[self.meta.primary_name]
+		try:
+			value = field.to_python( pk if isinstance( pk, bytes ) else str( pk ).encode( "utf-8" ) )
+		except (TypeError, ValueError):
+			return pk
+		if isinstance( field, FieldUnicode ):
+			return collation_key( value )
+		return value
+
+	def dispatch( self ):
+		"""
+		立即发出所有等待中的查询
+		"""
+		if self.timerID:
+			KBEngine.delTimer( self.timerID )
+			self.timerID = 0
+
+		pending = self.pending
+		self.pending = {}
+		keys = list( pending )
+		inKey = self.meta.primary_name + "__in"
+		for i in range( 0, len( keys ), self.max_keys ):
+			batch = { key : pending[key] for key in keys[i:i + self.max_keys] }
+			self.model.objects.select( functools.partial( self._select_callback, batch ), **{ inKey : [ pk for pk, callbacks in batch.values() ] } )
+
+	def _on_timer( self, timerID ):
+		"""
+		"""
+		self.timerID = 0
+		self.dispatch()
+
+	def _select_callback( self, batch, success, models ):
+		"""
+		"""
+		found = {}
+		if success:
+			for m in models:
+				found[self.key( m.get_primary_key_value() )] = m
+		shared = self.meta.identities is not None
+		for key, (pk, callbacks) in batch.items():
+			m = found.get( key )
+			ms = [m] * len( callbacks )
+			if m is not None and not shared:
+				# 每个回调使用各自的实例，互不影响；在任何回调修改实例之前复制
+				values = m.get_db_snapshot()
+				ms[1:] = [ self.model.from_values( copy.deepcopy( values ) ) for i in range( 1, len( callbacks ) ) ]
+			for callback, m in zip( callbacks, ms ):
+				if callable( callback ):
+					callback( success, m )
+
+
+class _ManyResult(object):
+	"""
+	get_many()的结果收集
+	"""
+	def __init__( self, pks, callback ):
+		self.pks = pks
+		self.callback = callback
+		self.models = {}
+		self.remain = len( set( pks ) )
+		self.success = True
+
+	def done( self, pk, success, model ):
+		"""
+		"""
+		self.success = self.success and success
+		self.models[pk] = model
+		self.remain -= 1
+		if self.remain == 0 and callable( self.callback ):
+			self.callback( self.success, [ self.models[pk] for pk in self.pks ] )
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+"""
+完全加载到内存中的表（Meta.preload = True），适用于数据量小、很少修改但查询频繁的策划配置表（物品、技能、掉落等）：
+整个表加载一次后，对equal、in类查询使用hash索引，对gt/gte/lt/lte/range使用有序索引，
+在内存中计算Q条件树（包括|、~）以及order_by、limit，不需要访问数据库。
+
+注意：
+1.结果取决于排序规则的字符串条件（只有大小写、重音或末尾空格不同的值，以及字符串的大小比较、按字符串字段排序）
+  无法在内存中确定，会直接查询数据库；
+2.isnull等无法在内存中计算的条件会直接查询数据库；加载的数据中含有NULL的字段（内存中与其它记录一样转换为0、""）
+  上的条件以及按这些字段排序也会直接查询数据库，避免把NULL当作0比较（包括~Q取反后的结果）；
+3.通过QuerySet对该表进行修改后内存中的数据不再可用，之后的查询会直接访问数据库并触发重新加载，
+  加载完成前的查询都访问数据库；也可以调用QuerySet.reload()主动重新加载。
+"""
+import bisect, functools
+
+import KBEngine
+from KBEDebug import *
+
+import MysqlUtility
+from .Fields import FieldInteger, FieldFloat, FieldUnicode
+from .utils.query_utils import Q, collation_key
+
+
+class MemoryTable(object):
+	"""
+	某个EntityModel类完全加载到内存中的数据
+	"""
+	def __init__( self, model_class ):
+		"""
+		@param model_class: EntityModel
+		"""
+		self.model = model_class
+		self.meta = model_class._meta
+		self.rows = []             # [ { 属性名 : 值 }, ... ]
+		self.hash_indexes = {}     # key = 属性名; value = { 值 : [行下标, ...] }，使用时才建立
+		self.sorted_indexes = {}   # key = 属性名; value = ([排好序的值, ...], [对应的行下标, ...])，使用时才建立
+		self.collation_indexes = {}  # 字符串字段：key = 属性名; value = { collation_key(值) : [行下标, ...] }，使用时才建立
+		self.null_attrs = set()    # 含有NULL的字段，这些字段上的条件无法在内存中计算
+		self.ready = False         # 数据是否可用
+		self.loading = False
+		self.generation = 0        # 每次表被修改时加1，加载期间被修改过则加载的数据不可用
+
+	def __len__( self ):
+		return len( self.rows )
+
+	def invalidate( self ):
+		"""
+		表被修改了，内存中的数据不再可用
+		"""
+		self.ready = False
+		self.generation += 1
+
+	def reload( self, callback = None ):
+		"""
+		重新加载整个表
+		def callback(success, rows):
+			pass
+		"""
+		attrs = list( self.meta.fields )
+		cmd = MysqlUtility.makeSafeSql( "SELECT {} FROM {}".format( ", ".join( [ self.meta.fields[k].db_column for k in attrs ] ), self.meta.db_table ) )
+		self.loading = True
+		self.generation += 1
+		KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._reload_callback, cmd, attrs, self.generation, callback ) )
+
+	def _reload_callback( self, cmd, attrs, generation, callback, result, rows, insertid, error ):
+		"""
+		"""
+		self.loading = False
+		if error is not None:
+			ERROR_MSG( "%s::_reload_callback(), execute raw sql '%s' fault!!!; error: %s" % ( self.__class__.__name__, cmd, error ) )
+			if callable( callback ):
+				callback( False, 0 )
+			return
+
+		fields = self.meta.fields
+		self.rows = [ { k : fields[k].to_python( row[i] ) for i, k in enumerate( attrs ) } for row in result ]
+		self.null_attrs = set( [ k for i, k in enumerate( attrs ) if any( row[i] is None for row in result ) ] )
+		self.reindex()
+		self.ready = generation == self.generation
+		if not self.ready:
+			WARNING_MSG( "%s::_reload_callback(), table '%s' modified while loading" % ( self.__class__.__name__, self.meta.db_table ) )
+		if callable( callback ):
+			callback( self.ready, len( self.rows ) )
+
+	def apply( self, values, nulls = () ):
+		"""
+		用一条从数据库中读取到的记录更新内存中的数据（见ChangePoller.py）
+		@param values: dict; { 属性名 : 值 }，必须包含主键
+		@param nulls: 这条记录中数据库的值为NULL的属性名
+		"""
+		self.null_attrs.update( nulls )
+		pkName = self.meta.primary_name
+		indexes = self.hash_index( pkName ).get( values[pkName] )
+		if indexes:
+			self.rows[indexes[0]] = dict( values )
+		else:
+			self.rows.append( dict( values ) )
+		self.reindex()
+
+	def reindex( self ):
+		"""
+		内存中的数据被修改后，丢弃已经建立的索引
+		"""
+		self.hash_indexes = {}
+		self.sorted_indexes = {}
+		self.collation_indexes = {}
+
+	def hash_index( self, attr ):
+		"""
+		"""
+		index = self.hash_indexes.get( attr )
+		if index is None:
+			index = {}
+			for i, row in enumerate( self.rows ):
+				index.setdefault( row[attr], [] ).append( i )
+			self.hash_indexes[attr] = index
+		return index
+
+	def sorted_index( self, attr ):
+		"""
+		"""
+		index = self.sorted_indexes.get( attr )
+		if index is None:
+			pairs = sorted( [ (row[attr], i) for i, row in enumerate( self.rows ) ] )
+			index = ( [ v for v, i in pairs ], [ i for v, i in pairs ] )
+			self.sorted_indexes[attr] = index
+		return index
+
+	def collation_index( self, attr ):
+		"""
+		"""
+		index = self.collation_indexes.get( attr )
+		if index is None:
+			index = {}
+			for i, row in enumerate( self.rows ):
+				index.setdefault( collation_key( row[attr] ), [] ).append( i )
+			self.collation_indexes[attr] = index
+		return index
+
+	def coerce( self, attr, value ):
+		"""
+		把查询条件中的值转换为可以与字段比较的数值；与mysql一致，按数值比较，不截断小数（整数字段与1.5比较时不等于1）
+		"""
+		field = self.meta.fields[attr]
+		if isinstance( field, ( FieldInteger, FieldFloat ) ):
+			if isinstance( value, ( int, float ) ):
+				return value
+			if isinstance( field, FieldInteger ):
+				try:
+					return int( value )
+				except ValueError:
+					pass
+			return float( value )
+		return value
+
+	def string_rows( self, attr, value ):
+		"""
+		字符串字段等于value的行
+		@return list of 行下标 or None（存在只有大小写、重音或末尾空格不同的值，结果取决于排序规则）
+		"""
+		if not isinstance( value, str ):
+			return None
+		rows = self.hash_index( attr ).get( value, () )
+		if len( self.collation_index( attr ).get( collation_key( value ), () ) ) != len( rows ):
+			return None
+		return rows
+
+	def evaluate_lookup( self, lookup, value ):
+		"""
+		@return set of 行下标 or None（无法在内存中计算）
+		"""
+		sv = lookup.rsplit( "__", 1 )
+		if len( sv ) == 1 or sv[1] not in Q.operators:
+			attr, op = lookup, "exact"
+		else:
+			attr, op = sv
+		if attr not in self.meta.fields or attr in self.null_attrs:
+			return None
+
+		isString = isinstance( self.meta.fields[attr], FieldUnicode )
+		if op == "exact" or op == "in":
+			r = set()
+			for v in ( value if op == "in" else ( value, ) ):
+				if isString:
+					rows = self.string_rows( attr, v )
+					if rows is None:
+						return None
+				else:
+					rows = self.hash_index( attr ).get( self.coerce( attr, v ), () )
+				r.update( rows )
+			return r
+		if op == "iexact":
+			if value is None:
+				return None
+			value = str( value )
+			if isString:
+				# LIKE不忽略末尾空格，匹配的行一定在collation_key相同的行中
+				rows = self.collation_index( attr ).get( collation_key( value ), () )
+				matched = [ i for i in rows if self.rows[i][attr].lower() == value.lower() ]
+				if len( matched ) != len( rows ):
+					return None
+				return set( matched )
+			value = value.lower()
+			return set( [ i for i, row in enumerate( self.rows ) if str( row[attr] ).lower() == value ] )
+
+		if isString:
+			# 字符串的大小关系取决于排序规则
+			return None
+		values, indexes = self.sorted_index( attr )
+		if op == "gt":
+			return set( indexes[bisect.bisect_right( values, self.coerce( attr, value ) ):] )
+		if op == "gte":
+			return set( indexes[bisect.bisect_left( values, self.coerce( attr, value ) ):] )
+		if op == "lt":
+			return set( indexes[:bisect.bisect_left( values, self.coerce( attr, value ) )] )
+		if op == "lte":
+			return set( indexes[:bisect.bisect_right( values, self.coerce( attr, value ) )] )
+		if op == "range":
+			lo = bisect.bisect_left( values, self.coerce( attr, value[0] ) )
+			hi = bisect.bisect_right( values, self.coerce( attr, value[1] ) )
+			return set( indexes[lo:hi] )
+		return None
+
+	def evaluate( self, q ):
+		"""
+		计算Q条件树
+		@return set of 行下标 or None（无法在内存中计算）
+		"""
+		if not isinstance( q, Q ):
+			return self.evaluate_lookup( *q )
+
+		result = None
+		for child in q.children:
+			r = self.evaluate( child )
+			if r is None:
+				return None
+			if result is None:
+				result = r
+			elif q.connector == Q.OR:
+				result |= r
+			else:
+				result &= r
+		if result is None:
+			result = set( range( len( self.rows ) ) )
+		if q.negated:
+			result = set( range( len( self.rows ) ) ) - result
+		return result
+
+	def query( self, filters, order_by = (), limit = () ):
+		"""
+		@param filters: list; 过滤条件，格式与QuerySet.build_where_clauses()的参数相同
+		@param order_by: tuple; 与QuerySet.order_by()的参数相同
+		@param limit: (offset, count); 与QuerySet.limit()的参数相同
+		@return list of { 属性名 : 值 } or None（无法在内存中计算）
+		"""
+		try:
+			matched = self.evaluate( Q( *filters ) )
+		except (TypeError, ValueError):
+			return None
+		if matched is None:
+			return None
+
+		indexes = sorted( matched )
+		for k in reversed( order_by ):
+			reverse = k[0] == "-"
+			if k[0] in "-+":
+				k = k[1:]
+			if isinstance( self.meta.fields[k], FieldUnicode ) or k in self.null_attrs:
+				return None
+			indexes.sort( key = lambda i : self.rows[i][k], reverse = reverse )
+		if limit:
+			indexes = indexes[limit[0]:limit[0] + limit[1]]
+		return [ self.rows[i] for i in indexes ]
@@ -8,8 +8,115 @@ import KBEngine
 from KBEDebug import *
 
 import MysqlUtility
+from .Fields import FieldInteger
+from .Accumulator import DeltaAccumulator
+from .Loader import BatchLoader, _ManyResult
+from . import QueryCache
+from .SharedCache import SharedCache
+from .QueryPlan import g_plan_cache
+from .Lazy import LazyDelivery, LazyResult
+from . import Columns
 from .utils.query_utils import Q
 
+
+# 单条sql语句允许的最大字节数，需要与mysql服务器的max_allowed_packet保持一致（mysql默认为4M）
+MAX_ALLOWED_PACKET = 4 * 1024 * 1024
+
+# 批量操作时，单条sql语句最多包含多少条记录
+BULK_BATCH_SIZE = 1000
+
+# 正在执行的select语句，相同的语句在执行期间只发出一次
+# key = 表名; value = { sql : [callback, ...] }
+g_inflight_selects = {}
+
+def _escape_limit( limit ):
+	"""
+	"""
+	return (" LIMIT %d, %d" % limit).encode()
+
+
+def split_batches( sizes, overhead, batch_size, max_packet ):
+	"""
+	根据每条记录生成的sql长度进行分批，保证每一批生成的语句不超过max_packet字节，且不超过batch_size条记录。
+	注意：单条记录本身就超过max_packet时，它会被单独分为一批，由mysql决定是否执行失败。
+
+	@param sizes: list of int; 每条记录在sql语句中占用的字节数（包括分隔符）
+	@param overhead: int; 语句中与记录无关的部分的字节数
+	@return list of (start, end)；每一批在sizes中的下标范围
+	"""
+	batches = []
+	start = 0
+	total = overhead
+	for i, size in enumerate( sizes ):
+		if i > start and (i - start >= batch_size or total + size > max_packet):
+			batches.append( (start, i) )
+			start = i
+			total = overhead
+		total += size
+	if start < len( sizes ):
+		batches.append( (start, len( sizes )) )
+	return batches
+
+
+class _BatchResult(object):
+	"""
+	把分批发出的多条sql命令的结果汇总起来，全部返回后再进行一次回调
+	"""
+	def __init__( self, count, callback ):
+		"""
+		@param count: 总共发出了多少条sql命令
+		@param callback: def callback(success, results): pass；results是每条命令的结果
+		"""
+		self.remain = count
+		self.success = True
+		self.results = [None] * count
+		self.callback = callback
+
+	def done( self, index, success, result ):
+		"""
+		第index条命令返回了结果
+		"""
+		self.success = self.success and success
+		self.results[index] = result
+		self.remain -= 1
+		if self.remain == 0 and callable( self.callback ):
+			self.callback( self.success, self.results )
+
+
+def _sum_rows_callback( callback, success, results ):
+	"""
+	把各批次影响的行数相加后回调
+	"""
+	if callable( callback ):
+		callback( success, sum( results ) )
+
+def _project_values( kind, attrs, values ):
+	"""
+	@param values: dict; { 属性名 : 值 }
+	@return 按kind取出attrs中的值，与Codec.build_values_decoder()生成的解码函数结果一致
+	"""
+	if kind == "dict":
+		return { k : values[k] for k in attrs }
+	if kind == "tuple":
+		return tuple( [ values[k] for k in attrs ] )
+	return values[attrs[0]]
+
+
+class _ValuesDelivery(object):
+	"""
+	标记回调需要的是values()、values_list()的结果，而不是实例
+	"""
+	__slots__ = ( "callback", "kind" )
+
+	def __init__( self, callback, kind ):
+		self.callback = callback
+		self.kind = kind
+
+	def __call__( self, success, values ):
+		if callable( self.callback ):
+			self.callback( success, values )
+
+
 class QuerySet(object):
 	"""
 	"""
@@ -21,6 +128,9 @@ class QuerySet(object):
 		self.filters = []
 		self.limit_opt = tuple()  # 查询上限 -> (min, max)
 		self.order_by_opt = tuple()
+		self.lazy_opt = False
+		self.values_opt = None  # values()、values_list()的结果形式 -> (kind, attrs)
+		self.defer_opt = frozenset()  # select时不查询、延迟加载的属性名
 
 		if model_class:
 			self.set_model(model_class)
@@ -45,6 +155,9 @@ class QuerySet(object):
 		obj.filters = list( self.filters )
 		obj.limit_opt = self.limit_opt
 		obj.order_by_opt = self.order_by_opt
+		obj.lazy_opt = self.lazy_opt
+		obj.values_opt = self.values_opt
+		obj.defer_opt = self.defer_opt
 		return obj
 
 	def build_where_clauses(self, *args, **kwargs):
@@ -81,6 +194,230 @@ class QuerySet(object):
 			orderby.append(metaField[k].db_column + o)
 		return (" ORDER BY " + ", ".join(orderby)).encode()
 
+	def build_set_clauses(self, kw):
+		"""
+		生成"col = value"格式的赋值语句，值可以是F()等表达式
+		@param kw: list of (attrName, value)
+		@return (list of str, list of value); 带%s占位符的赋值语句以及对应的参数
+		"""
+		paramsKey = []
+		paramsVal = []
+		for k, v in kw:
+			if hasattr(v, "resolve_expression"):
+				paramsKey.append( "{} = {}".format( self.meta.fields[k].db_column, v.resolve_expression(self.meta) ) )
+			else:
+				paramsKey.append( "{} = %s".format( self.meta.fields[k].db_column ) )
+				paramsVal.append( v )
+		return paramsKey, paramsVal
+
+	def compile_where(self, filters, parts):
+		"""
+		把过滤条件编译为查询模板，结果与build_where_clauses()一致
+		@param filters: list; 与build_where_clauses()的参数相同
+		@param parts: list; 见Q.compile()
+		"""
+		for i, v in enumerate(filters):
+			parts.append(b" AND " if i else b" WHERE ")
+			if not isinstance(v, Q):
+				v = Q(v)
+			v.compile(self.meta, parts)
+
+	def filter_shape(self, filters):
+		"""
+		@return tuple; 过滤条件的结构
+		"""
+		return tuple([ v.shape() if isinstance(v, Q) else v[0] for v in filters ])
+
+	def filter_values(self, filters, out):
+		"""
+		按compile_where()中转义函数的顺序收集过滤条件中的值
+		"""
+		for v in filters:
+			if isinstance(v, Q):
+				v.values(out)
+			else:
+				out.append(v[1])
+
+	def escape_assignment(self, v):
+		"""
+		对赋值语句中的值进行转义，值可以是F()等表达式
+		"""
+		if hasattr(v, "resolve_expression"):
+			return v.resolve_expression(self.meta).encode()
+		return MysqlUtility.process_param(v)
+
+	def build_select_sql(self, *args, **kwargs):
+		"""
+		@return bytes; 查询满足当前过滤条件及args、kwargs条件的记录的sql语句（包括order by与limit）
+		"""
+		return self._build_select_sql( self.filters + list(args) + list(kwargs.items()) )
+
+	def _build_select_sql(self, arg, attrs = None):
+		"""
+		@param arg: list; 完整的过滤条件
+		@param attrs: tuple of str; 只查询这些属性对应的字段，None表示查询所有字段
+		"""
+		key = (self.model, "select", self.filter_shape(arg), self.order_by_opt, bool(self.limit_opt), attrs)
+		template = g_plan_cache.get( key, functools.partial( self._compile_select, arg, attrs ) )
+		values = []
+		self.filter_values(arg, values)
+		if self.limit_opt:
+			values.append(self.limit_opt)
+		return template.render( values )
+
+	def _compile_select(self, arg, attrs = None):
+		"""
+		"""
+		if attrs is None:
+			attrs = self.meta.fields
+		select = "SELECT {} FROM {}".format( ", ".join( [ self.meta.fields[e].db_column for e in attrs ] ), self.meta.db_table )
+		parts = [MysqlUtility.makeSafeSql( select )]
+		self.compile_where(arg, parts)
+		parts.append(self.build_order_by_clauses())
+		if self.limit_opt:
+			parts.append(_escape_limit)
+		return parts
+
+	def build_delete_sql(self, *args, **kwargs):
+		"""
+		@return bytes; 删除满足当前过滤条件及args、kwargs条件的记录的sql语句
+		"""
+		arg = self.filters + list(args) + list(kwargs.items())
+		key = (self.model, "delete", self.filter_shape(arg))
+		template = g_plan_cache.get( key, functools.partial( self._compile_delete, arg ) )
+		values = []
+		self.filter_values(arg, values)
+		return template.render( values )
+
+	def _compile_delete(self, arg):
+		"""
+		"""
+		parts = [MysqlUtility.makeSafeSql( "DELETE FROM {}".format( self.meta.db_table ) )]
+		self.compile_where(arg, parts)
+		return parts
+
+	def build_update_sql(self, *args, **kwargs):
+		"""
+		@return bytes; 以args、kwargs更新满足当前过滤条件的记录的sql语句
+		"""
+		kw = list(args) + list(kwargs.items())
+		key = (self.model, "update", tuple([ k for k, v in kw ]), self.filter_shape(self.filters))
+		template = g_plan_cache.get( key, functools.partial( self._compile_update, kw ) )
+		values = [ v for k, v in kw ]
+		self.filter_values(self.filters, values)
+		return template.render( values )
+
+	def _compile_update(self, kw):
+		"""
+		"""
+		parts = [MysqlUtility.makeSafeSql( "UPDATE {} SET ".format( self.meta.db_table ) )]
+		for i, (k, v) in enumerate(kw):
+			if i:
+				parts.append(b", ")
+			parts.append(MysqlUtility.makeSafeSql( "{} = ".format( self.meta.fields[k].db_column ) ))
+			parts.append(self.escape_assignment)
+		self.compile_where(self.filters, parts)
+		return parts
+
+	def build_insert_sql(self, *args, **kwargs):
+		"""
+		@return bytes; 以args、kwargs插入一条记录的sql语句
+		"""
+		kw = list(args) + list(kwargs.items())
+		fieldNames = []
+		fieldValues = []
+		fieldValuesP = []
+		for k, v in kw:
+			fieldNames.append( self.meta.fields[k].db_column )
+			fieldValues.append( v )
+			fieldValuesP.append( "%s" )
+		
+		cmd = "INSERT INTO {} ( {} ) VALUES ( {} )".format( self.meta.db_table, ", ".join( fieldNames ), ", ".join( fieldValuesP ) )
+		return MysqlUtility.makeSafeSql( cmd, fieldValues )
+
+	def filter_pks(self, filters):
+		"""
+		判断过滤条件是否是纯粹的主键查询（pk = x 或 pk__in = (...)）
+		@param filters: list; 过滤条件，格式与build_where_clauses()的参数相同
+		@return list of 主键值 or None
+		"""
+		return self.filter_keys(filters, self.meta.primary_name)
+
+	def filter_keys(self, filters, attrName):
+		"""
+		判断过滤条件是否是纯粹的按某个字段的查询（attr = x 或 attr__in = (...)）
+		@return list of 值 or None
+		"""
+		if not attrName or len(filters) != 1:
+			return None
+		v = filters[0]
+		if isinstance(v, Q):
+			if v.negated or len(v.children) != 1 or isinstance(v.children[0], Q):
+				return None
+			v = v.children[0]
+		k, value = v
+		if k == attrName or k == attrName + "__exact":
+			return [value]
+		if k == attrName + "__in":
+			pks = []
+			for pk in value:
+				if pk not in pks:
+					pks.append(pk)
+			return pks
+		return None
+
+	def _on_write(self, pks = None, local = False, keep = ()):
+		"""
+		表中的数据被修改了（发出修改语句时以及语句执行完成后各通知一次），使相关的缓存失效
+		@param pks: 被修改的记录的主键值列表；为None表示无法确定修改了哪些记录，新插入的记录不需要列出
+		@param local: 修改会在本地应用到identity map和内存表中（见_apply_update_locally()），不需要使它们失效
+		@param keep: list of EntityModel; 写入自己数据的实例（writeToDB()等），identity map中的这些实例保持不变，
+			写入期间的查询仍然返回它们，保证同一条记录只有一个实例
+		"""
+		identities = self.meta.identities
+		if identities is not None:
+			# 修改之前就已经发出的查询的结果不能再放入identity map
+			identities.write_generation += 1
+		if identities is not None and not local:
+			if pks is None:
+				identities.clear()
+			else:
+				identities.remove(pks, keep)
+		sharedCache = self.meta.shared_cache
+		if sharedCache is not None:
+			sharedCache.write_generation += 1
+			if not sharedCache.writer:
+				# 只读进程在写入进程重新写入之前不能再读取这些记录
+				sharedCache.mark_stale(pks)
+			elif pks is None:
+				sharedCache.clear()
+			else:
+				sharedCache.remove(pks)
+		QueryCache.invalidate_table(self.meta.db_table)
+		if self.meta.memory_table is not None and not local:
+			self.meta.memory_table.invalidate()
+		# 修改之后发出的查询不能再使用修改之前就已经在执行的查询的结果
+		g_inflight_selects.pop(self.meta.db_table, None)
+
+	def _track_values(self, valuesList):
+		"""
+		记录插入或更新时写入的值（用于维护存在性过滤器）
+		@param valuesList: list of dict; [ { 属性名 : 值 }, ... ]
+		"""
+		existence = self.meta.existence
+		if existence is not None:
+			for values in valuesList:
+				existence.track(values)
+
+	def _track_insert_ids(self, insertid, count = 1):
+		"""
+		记录插入后得到的自增主键（用于维护存在性过滤器）
+		"""
+		existence = self.meta.existence
+		if existence is not None and insertid > 0 and existence.attrname == self.meta.primary_name:
+			for i in range(count):
+				existence.add(insertid + i)
+
 	def filter(self, *args, **kwargs):
 		"""
 		设置过滤器
@@ -106,69 +443,312 @@ class QuerySet(object):
 		obj.order_by_opt = tuple(args)
 		return obj
 
+	def lazy(self):
+		"""
+		select的结果延迟解码：回调得到的是LazyResult（可以像list一样使用），
+		某一行、某个字段第一次被访问时才从原始数据转换（见Lazy.py）
+		"""
+		obj = self.clone()
+		obj.lazy_opt = True
+		return obj
+
+	def _values_attrs(self, fields):
+		"""
+		@return tuple of str; fields为空时为所有属性
+		"""
+		for k in fields:
+			assert k in self.meta.fields, "unknown field '%s'" % k
+		return tuple( fields ) if fields else tuple( self.meta.fields )
+
+	def values(self, *fields):
+		"""
+		select只查询fields中的字段，结果不生成实例，每条记录为{ 属性名 : 值 }；fields为空时查询所有字段
+		注意：结果直接来自数据库（或内存表），不经过identity map与共享内存缓存，不包括尚未写入数据库的修改
+		"""
+		obj = self.clone()
+		obj.values_opt = ( "dict", self._values_attrs( fields ) )
+		return obj
+
+	def values_list(self, *fields, flat = False):
+		"""
+		与values()相同，但每条记录为按fields顺序排列的tuple；
+		flat为True时只能指定一个字段，结果为该字段值的列表
+		"""
+		assert not flat or len( fields ) == 1, "values_list(flat = True) requires exactly one field!"
+		obj = self.clone()
+		obj.values_opt = ( "flat" if flat else "tuple", self._values_attrs( fields ) )
+		return obj
+
+	def defer(self, *fields):
+		"""
+		select时不查询fields中的字段（例如很少使用的大BLOB字段），实例中这些字段标记为延迟加载：
+		访问时抛出AttributeError，需要先调用load_deferred()加载；writeToDB()不会写入没有加载（也没有赋值）的字段
+		注意：没有完整加载的实例不会放入identity map与共享内存缓存；多次调用时累加
+		"""
+		for k in fields:
+			assert k in self.meta.fields, "unknown field '%s'" % k
+			assert k != self.meta.primary_name, "primary key can not be deferred!"
+		obj = self.clone()
+		obj.defer_opt = self.defer_opt | frozenset( fields )
+		return obj
+
+	def only(self, *fields):
+		"""
+		与defer()相反：select时只查询fields中的字段（以及主键），其它字段延迟加载
+		"""
+		for k in fields:
+			assert k in self.meta.fields, "unknown field '%s'" % k
+		obj = self.clone()
+		obj.defer_opt = frozenset( [ k for k in self.meta.fields if k not in fields and k != self.meta.primary_name ] )
+		return obj
+
 	def select(self, callback, *args, **kwargs):
 		"""
 		def callback(success, models):
 			pass
+		使用了values()、values_list()时，models为dict、tuple或值的列表
 		"""
 		assert self.model is not None
 		arg = self.filters + list(args) + list(kwargs.items())
-		where = self.build_where_clauses(*arg)
 
-		attrs = list( self.meta.fields )
-		fields = [ self.meta.fields[e].db_column for e in attrs ]
-		queryField = ", ".join( fields )
-		select = "SELECT {} FROM {}".format( queryField, self.meta.db_table )
-		cmd = b"".join([
-			MysqlUtility.makeSafeSql( select ),
-			where,
-			self.build_order_by_clauses(),
-			self.limit_opt and (" LIMIT %d, %d" % self.limit_opt).encode() or b"",
-		])
-		
-		
+		memoryTable = self.meta.memory_table
+		if memoryTable is not None:
+			if memoryTable.ready:
+				rows = memoryTable.query( arg, self.order_by_opt, self.limit_opt )
+				if rows is not None and self.values_opt:
+					kind, attrs = self.values_opt
+					if callable( callback ):
+						callback( True, [ _project_values( kind, attrs, values ) for values in rows ] )
+					return
+				if rows is not None:
+					models = [ self.model.from_values( values ) for values in rows ]
+					if self.meta.identities is not None:
+						models = [ self.meta.identities.load( m ) for m in models ]
+					if callable( callback ):
+						callback( True, models )
+					return
+			elif not memoryTable.loading:
+				memoryTable.reload()
+
+		existence = self.meta.existence
+		if existence is not None and existence.ready:
+			keys = self.filter_keys(arg, existence.attrname)
+			if keys is not None:
+				maybe = [ k for k in keys if existence.might_contain(k) ]
+				if not maybe:
+					if callable( callback ):
+						callback( True, [] )
+					return
+				if len(maybe) < len(keys):
+					arg = [(existence.attrname + "__in", maybe)]
+				callback = functools.partial( self._existence_select_callback, len(maybe), callback )
+
+		identities = self.meta.identities
+		if identities is not None and not self.order_by_opt and not self.limit_opt and not self.values_opt:
+			pks = self.filter_pks(arg)
+			if pks is not None:
+				hits, missing = identities.lookup(pks)
+				if not missing:
+					if callable( callback ):
+						callback( True, hits )
+					return
+				if hits:
+					arg = [(self.meta.primary_name + "__in", missing)]
+					callback = functools.partial( self._identity_select_callback, hits, callback )
+
+		sharedCache = self.meta.shared_cache
+		if sharedCache is not None and not self.order_by_opt and not self.limit_opt and not self.values_opt:
+			pks = self.filter_pks(arg)
+			if pks is not None:
+				hits, missing = sharedCache.lookup(pks)
+				if identities is not None:
+					hits = [ identities.load( m ) for m in hits ]
+				if not missing:
+					if callable( callback ):
+						callback( True, hits )
+					return
+				if hits:
+					arg = [(self.meta.primary_name + "__in", missing)]
+					callback = functools.partial( self._identity_select_callback, hits, callback )
+
+		if self.values_opt:
+			kind, attrs = self.values_opt
+			cmd = self._build_select_sql(arg, attrs)
+			callback = _ValuesDelivery( callback, kind )
+		else:
+			if self.defer_opt:
+				attrs = tuple( [ k for k in self.meta.fields if k not in self.defer_opt ] )
+				cmd = self._build_select_sql(arg, attrs)
+			else:
+				attrs = list( self.meta.fields )
+				cmd = self._build_select_sql(arg)
+			if self.lazy_opt:
+				callback = LazyDelivery( callback )
+
+		queryCache = self.meta.query_cache
+		if queryCache is not None:
+			result = queryCache.get( cmd )
+			if result is not None:
+				self._deliver_rows( attrs, callback, result )
+				return
+		generations = self.cache_generations()
+
+		callbacks = [callback]
+		if self.meta.single_flight:
+			inflight = g_inflight_selects.setdefault( self.meta.db_table, {} )
+			if cmd in inflight:
+				# 相同的查询正在执行，等待它的结果即可
+				inflight[cmd].append( callback )
+				return
+			inflight[cmd] = callbacks
+
 		#DEBUG_MSG( "%s::select(), %s" % (self.__class__.__name__, cmd) )
-		KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._select_callback, cmd, attrs, callback ) )
+		KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._select_callback, cmd, attrs, generations, callbacks ) )
 
-	def _select_callback( self, cmd, fields, callback, result, rows, insertid, error ):
+	def cache_generations( self ):
+		"""
+		@return tuple; 发出查询时（查询结果缓存的generation, identity map的write_generation, 共享内存缓存的write_generation），
+			查询返回时与当前的值不同的缓存期间被修改过，查询结果不能再放入该缓存
+		"""
+		queryCache = self.meta.query_cache
+		identities = self.meta.identities
+		sharedCache = self.meta.shared_cache
+		return (
+			queryCache.generation if queryCache is not None else 0,
+			identities.write_generation if identities is not None else 0,
+			sharedCache.write_generation if sharedCache is not None else 0,
+		)
+
+	def _select_callback( self, cmd, fields, generations, callbacks, result, rows, insertid, error ):
 		"""
 		select命令回调
+		@param generations: 发出查询时各缓存的generation（见cache_generations()）
+		@param callbacks: 等待这条查询结果的所有回调
 		"""
+		inflight = g_inflight_selects.get( self.meta.db_table )
+		if inflight and inflight.get( cmd ) is callbacks:
+			del inflight[cmd]
+
 		if error is not None:
 			ERROR_MSG( "%s::_select_callback(), execute raw sql '%s' fault!!!; error: %s" % ( self.__class__.__name__, cmd, error ) )
-			if callable( callback ):
-				callback( False, None )
+			for callback in callbacks:
+				if callable( callback ):
+					callback( False, None )
 			return
 		
 		#DEBUG_MSG( "%s::_select_callback(), cmd: |%s|, result: |%s|" % ( self.__class__.__name__, cmd, result ) )
-		models = []
-		for row in result:
-			m = self.model()
-			for i, key in enumerate( fields ):
-				setattr( m, key, self.meta.fields[key].to_python(  row[i] ) )
-			models.append( m )
+		if self.meta.query_cache is not None:
+			self.meta.query_cache.put( cmd, result, generations[0] )
+
+		# 每个回调都使用各自生成的实例，互不影响
+		for callback in callbacks:
+			self._deliver_rows( fields, callback, result, generations )
+
+	def _deliver_rows( self, fields, callback, result, generations = None ):
+		"""
+		使用数据库返回的原始结果生成实例并回调
+		@param generations: 发出查询时各缓存的generation（见cache_generations()）；
+			None表示结果来自查询结果缓存，与当前数据库一致，但已经写入过共享内存缓存
+		"""
+		if isinstance( callback, LazyDelivery ):
+			callback( True, LazyResult( self.model, fields, result, generations ) )
+			return
+		if isinstance( callback, _ValuesDelivery ):
+			decode = self.model.get_values_decoder( callback.kind, fields )
+			callback( True, [ decode( row ) for row in result ] )
+			return
+
+		# 没有查询所有字段时（见defer()），其它字段标记为延迟加载
+		decode = self.model.get_decoder( fields, len( fields ) < len( self.meta.field_names ) )
+		models = [ decode( row ) for row in result ]
+		sharedCache = self.meta.shared_cache
+		if sharedCache is not None and sharedCache.writer and generations is not None:
+			for m in models:
+				sharedCache.put( m, generations[2] )
+		if self.meta.identities is not None:
+			identityGeneration = generations[1] if generations is not None else None
+			models = [ self.meta.identities.load( m, identityGeneration ) for m in models ]
 		
 		if callable( callback ):
 			callback( True, models )
 
+	def _existence_select_callback( self, maybe, callback, success, models ):
+		"""
+		经过存在性过滤器的查询的回调，用于统计误判的数量
+		"""
+		if success:
+			self.meta.existence.false_positives += max( 0, maybe - len( models ) )
+		if callable( callback ):
+			callback( success, models )
+
+	def _identity_select_callback( self, hits, callback, success, models ):
+		"""
+		部分主键在identity map（或共享内存缓存）中命中时，把命中的实例与从数据库读取的实例合并后回调
+		"""
+		if callable( callback ):
+			callback( success, hits + models if success else None )
+
+	def select_columns(self, callback, fields, *args, **kwargs):
+		"""
+		列式查询：只查询fields中的字段，结果不生成实例，而是每个字段一个numpy数组（见Columns.py）
+		查询直接发往数据库，不经过memory table、identity map、缓存等
+		@param fields: list of str; 需要查询的属性名
+		def callback(success, columns):
+			pass；columns为{ 属性名 : numpy.ndarray }
+		"""
+		assert self.model is not None
+		if Columns.numpy is None:
+			raise ImportError( "%s::select_columns(), numpy is required!" % self.__class__.__name__ )
+		attrs = tuple( fields )
+		for k in attrs:
+			assert k in self.meta.fields, "unknown field '%s'" % k
+
+		arg = self.filters + list(args) + list(kwargs.items())
+		cmd = self._build_select_sql( arg, attrs )
+		#DEBUG_MSG( "%s::select_columns(), %s" % (self.__class__.__name__, cmd) )
+		KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._select_columns_callback, cmd, attrs, callback ) )
+
+	def _select_columns_callback( self, cmd, attrs, callback, result, rows, insertid, error ):
+		"""
+		列式查询回调
+		"""
+		if error is not None:
+			ERROR_MSG( "%s::_select_columns_callback(), execute raw sql '%s' fault!!!; error: %s" % ( self.__class__.__name__, cmd, error ) )
+			if callable( callback ):
+				callback( False, None )
+			return
+
+		try:
+			columns = Columns.to_arrays( self.model, attrs, result or [] )
+		except (ValueError, OverflowError) as e:
+			# 数据库中的值无法转换为字段的类型（例如超出范围）
+			ERROR_MSG( "%s::_select_columns_callback(), convert result of '%s' fault!!!; error: %s" % ( self.__class__.__name__, cmd, e ) )
+			if callable( callback ):
+				callback( False, None )
+			return
+
+		if callable( callback ):
+			callback( True, columns )
+
 	def delete(self, callback, *args, **kwargs):
 		"""
 		def callback(success, rows):
 			pass
 		"""
 		assert self.model is not None
-		arg = self.filters + list(args) + list(kwargs.items())
-		where = self.build_where_clauses(*arg)
-		
-		cmd = "DELETE FROM {}".format( self.meta.db_table )
-		cmd = MysqlUtility.makeSafeSql( cmd ) + where
+		cmd = self.build_delete_sql(*args, **kwargs)
+		pks = self.filter_pks( self.filters + list(args) + list(kwargs.items()) )
+		self._on_write( pks )
+		if self.meta.existence is not None:
+			self.meta.existence.deletes += 1
 		#DEBUG_MSG( "%s::delete(), %s" % (self.__class__.__name__, cmd) )
-		KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._delete_callback, cmd, callback ) )
+		KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._delete_callback, cmd, pks, callback ) )
 
-	def _delete_callback( self, cmd, callback, result, rows, insertid, error ):
+	def _delete_callback( self, cmd, pks, callback, result, rows, insertid, error ):
 		"""
 		delete命令回调
 		"""
+		self._on_write( pks )
 		if error is None:
 			if callable( callback ):
 				callback( True, rows )
@@ -187,27 +767,33 @@ class QuerySet(object):
 			pass
 		"""
 		assert self.model is not None
-		where = self.build_where_clauses(*self.filters)
+		self._update( callback, list(args) + list(kwargs.items()) )
 
-		paramsKey = []
-		paramsVal = []
-		kw = list(args) + list(kwargs.items())
-		for k, v in kw:
-			if hasattr(v, "resolve_expression"):
-				paramsKey.append( "{} = {}".format( self.meta.fields[k].db_column, v.resolve_expression(self.meta) ) )
-			else:
-				paramsKey.append( "{} = %s".format( self.meta.fields[k].db_column ) )
-				paramsVal.append( v )
-		
-		cmd = "UPDATE {} SET {}".format( self.meta.db_table, ", ".join( paramsKey ) )
-		cmd = MysqlUtility.makeSafeSql( cmd, paramsVal ) + where
+	def _update( self, callback, assignments, keep = () ):
+		"""
+		@param keep: list of EntityModel; 见_on_write()
+		"""
+		cmd = self.build_update_sql(*assignments)
+		pks = self.filter_pks( self.filters )
+		local = self.meta.apply_update_locally
+		self._on_write( pks, local, keep )
+		self._track_values( [ dict( assignments ) ] )
+		memoryTable = self.meta.memory_table
+		memoryGeneration = memoryTable.generation if memoryTable is not None else 0
 		#DEBUG_MSG( "%s::update(), %s" % (self.__class__.__name__, cmd) )
-		KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._update_callback, cmd, callback ) )
+		KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._update_callback, cmd, pks, assignments if local else None, memoryGeneration, keep, callback ) )
 
-	def _update_callback( self, cmd, callback, result, rows, insertid, error ):
+	def _update_callback( self, cmd, pks, assignments, memoryGeneration, keep, callback, result, rows, insertid, error ):
 		"""
 		update命令回调
+		@param assignments: 需要在本地应用的赋值列表，None表示不在本地应用
+		@param memoryGeneration: 发出update时内存表的generation
 		"""
+		if error is None and assignments is not None:
+			self._on_write( pks, True )
+			self._apply_update_locally( assignments, pks, memoryGeneration )
+		else:
+			self._on_write( pks, False, keep )
 		if error is None:
 			if callable( callback ):
 				callback( True, rows )
@@ -216,36 +802,128 @@ class QuerySet(object):
 			if callable( callback ):
 				callback( False, rows )
 
+	def _evaluate_update( self, q, assignments, values ):
+		"""
+		在本地计算一条记录执行update之后的值
+		@param q: Q; 过滤条件
+		@param assignments: list of (属性名, 值或表达式)
+		@param values: dict; 记录在数据库中的值
+		@return dict; 被修改的字段的新值；不满足过滤条件时返回空字典，无法在本地确定时返回None
+		"""
+		matched = q.matches( values )
+		if not matched:
+			return None if matched is None else {}
+
+		fields = self.meta.fields
+		values = dict( values )
+		changed = {}
+		try:
+			# 与mysql一致，按从左到右的顺序赋值，后面的表达式使用前面赋值后的值
+			for k, v in assignments:
+				if hasattr( v, "evaluate" ):
+					v = v.evaluate( values )
+				v = fields[k].coerce( v )
+				values[k] = v
+				changed[k] = v
+		except (KeyError, TypeError, ValueError, ArithmeticError):
+			return None
+		return changed
+
+	def _apply_update_locally( self, assignments, pks = None, memoryGeneration = None ):
+		"""
+		update成功后，把修改应用到identity map和内存表中满足过滤条件的数据上，无法在本地确定结果的数据仍然失效
+		@param pks: 过滤条件限定的主键值（见filter_pks()），不为None时只需要检查这些记录
+		@param memoryGeneration: 发出update时内存表的generation；之后内存表重新加载过（或正在加载）时，
+			无法确定加载的数据是否已经包含这次修改，内存表失效
+		"""
+		q = Q( *self.filters )
+
+		identities = self.meta.identities
+		if identities is not None:
+			unknown = []
+			for pk, m in identities.models( pks ):
+				changed = self._evaluate_update( q, assignments, m.get_db_snapshot() )
+				if changed is None:
+					unknown.append( pk )
+					continue
+				dirty = m.get_dirty_fields()
+				for k, v in changed.items():
+					if k not in dirty:
+						setattr( m, k, v )
+				m._mark_synced( changed )
+			identities.remove( unknown )
+
+		memoryTable = self.meta.memory_table
+		if memoryTable is None:
+			return
+		if not memoryTable.ready or ( memoryGeneration is not None and memoryGeneration != memoryTable.generation ):
+			# 同时使正在执行的加载的结果不可用
+			memoryTable.invalidate()
+			return
+		rows = memoryTable.rows
+		if pks is not None:
+			indexes = memoryTable.evaluate_lookup( self.meta.primary_name + "__in", pks )
+			if indexes is not None:
+				rows = [ rows[i] for i in sorted( indexes ) ]
+		nulls = memoryTable.null_attrs
+		for row in rows:
+			# 含有NULL的字段不参与计算（_evaluate_update()把缺少的字段视为无法确定）
+			changed = self._evaluate_update( q, assignments, { k : v for k, v in row.items() if k not in nulls } if nulls else row )
+			if changed is None:
+				memoryTable.invalidate()
+				break
+			row.update( changed )
+		memoryTable.reindex()
+
 	def insert( self, callback, *args, **kwargs ):
 		"""
 		向数据库插入一条记录。
 		def callback(success, insertid):
 			pass
 		"""
-		kw = list(args) + list(kwargs.items())
-		fieldNames = []
-		fieldValues = []
-		fieldValuesP = []
-		for k, v in kw:
-			fieldNames.append( self.meta.fields[k].db_column )
-			fieldValues.append( v )
-			fieldValuesP.append( "%s" )
-		
-		cmd = "INSERT INTO {} ( {} ) VALUES ( {} )".format( self.meta.db_table, ", ".join( fieldNames ), ", ".join( fieldValuesP ) )
-		cmd = MysqlUtility.makeSafeSql( cmd, fieldValues )
+		cmd = self.build_insert_sql(*args, **kwargs)
+		self._on_write( [] )
+		self._track_values( [ dict( list(args) + list(kwargs.items()) ) ] )
 		#DEBUG_MSG( "%s::insert(), %s" % (self.__class__.__name__, cmd) )
 		KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._insert_callback, cmd, callback ) );
 
+	def insert_model( self, callback, model, values = None ):
+		"""
+		把一个实例插入数据库（不包括主键字段），使用创建类时生成的编码函数（见Codec.py）
+		@param values: dict; 插入的各字段的值，为None时从实例中读取
+		注意：实例不能有还没有加载的延迟加载字段（见defer()），需要先调用load_deferred()加载
+		def callback(success, insertid):
+			pass
+		"""
+		self._assert_loaded( model )
+		if values is None:
+			values = { k : getattr( model, k ) for k in self.meta.insert_attrs }
+		cmd = b"".join( ( self.meta.insert_head, b"( ", self.meta.encoder( model ), b" )" ) )
+		self._on_write( [] )
+		self._track_values( [ values ] )
+		#DEBUG_MSG( "%s::insert_model(), %s" % (self.__class__.__name__, cmd) )
+		KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._insert_callback, cmd, callback ) )
+
+	def _assert_loaded( self, model ):
+		"""
+		插入的实例必须已经加载了所有字段
+		"""
+		deferred = model.get_deferred_fields()
+		assert not deferred, "%s::insert(), %s has deferred fields %s, load them with load_deferred() first!" % \
+			( self.__class__.__name__, model.__class__.__name__, sorted( deferred ) )
+
 	def _insert_callback( self, cmd, callback, result, rows, insertid, error ):
 		"""
 		insert命令回调
 		"""
+		self._on_write( [] )
 		if error is not None:
 			ERROR_MSG( "%s::_insertToDBCallback(), execute raw sql '%s' fault!!!; error: %s" % ( self.__class__.__name__, cmd, error ) )
 			if callable( callback ):
 				callback( False, insertid )
 			return
 		
+		self._track_insert_ids( insertid )
 		if insertid <= 0:
 			# 如果primary_key所代表的字段与auto_incr所代表的字段不是同一字段时，这个情况就会发生，
 			# 所以严格来说，这个问题不一定是个错误，也许是使用者就想这么干的^_^
@@ -254,6 +932,536 @@ class QuerySet(object):
 		if callable( callback ):
 			callback( True, insertid )
 
+	def bulk_insert( self, callback, models_or_dicts, batch_size = BULK_BATCH_SIZE, max_packet = MAX_ALLOWED_PACKET ):
+		"""
+		使用"INSERT INTO ... VALUES (...), (...), ..."的方式批量插入数据，
+		每条语句最多batch_size条记录，且语句长度不超过max_packet字节。
+
+		@param models_or_dicts: list; 元素为EntityModel实例或{ 属性名 : 值 }
+		       如果包含EntityModel实例，与writeToDB()一样不写入主键字段，
+		       插入成功后，整数类型的主键会以每批的insertid为起点依次回填。
+		       注意：回填要求auto_increment_increment为1，且innodb_autoinc_lock_mode为0或1（保证同一语句的自增值连续）。
+		       字典中缺少的字段使用字段的默认值；实例不能有还没有加载的延迟加载字段（见insert_model()）。
+
+		回调格式：
+		def callback(success, batches):
+			pass
+		batches: [ (insertid, rows), ... ]；每一批语句的第一条记录的自增id以及插入的行数，失败的批次insertid为0
+		"""
+		assert self.model is not None
+		items = list( models_or_dicts )
+		if not items:
+			if callable( callback ):
+				callback( True, [] )
+			return
+
+		metaFields = self.meta.fields
+		hasModel = False
+		attrs = []
+		for item in items:
+			if isinstance( item, dict ):
+				for k in item:
+					if k not in attrs:
+						attrs.append( k )
+			else:
+				self._assert_loaded( item )
+				hasModel = True
+		if hasModel:
+			attrs = [ k for k in metaFields if k != self.meta.primary_name ]
+
+		rows = []
+		values = []
+		encode = self.meta.encoder
+		for item in items:
+			if isinstance( item, dict ):
+				vs = [ item[k] if k in item else metaFields[k].default_value() for k in attrs ]
+				rows.append( b"(" + b", ".join( MysqlUtility.process_params( vs ) ) + b")" )
+			else:
+				vs = [ getattr( item, k ) for k in attrs ]
+				rows.append( b"(" + encode( item ) + b")" )
+			values.append( vs )
+
+		head = MysqlUtility.makeSafeSql( "INSERT INTO {} ( {} ) VALUES ".format( self.meta.db_table, ", ".join( [ metaFields[k].db_column for k in attrs ] ) ) )
+		sizes = [ len( e ) + 2 for e in rows ]
+		batches = split_batches( sizes, len( head ), batch_size, max_packet )
+
+		self._on_write( [] )
+		self._track_values( [ dict( zip( attrs, vs ) ) for vs in values ] )
+		agg = _BatchResult( len( batches ), callback )
+		for index, (start, end) in enumerate( batches ):
+			cmd = head + b", ".join( rows[start:end] )
+			#DEBUG_MSG( "%s::bulk_insert(), %s" % (self.__class__.__name__, cmd) )
+			KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._bulk_insert_callback, cmd, attrs, items[start:end], values[start:end], agg, index ) )
+
+	def _bulk_insert_callback( self, cmd, attrs, items, values, agg, index, result, rows, insertid, error ):
+		"""
+		bulk_insert命令回调
+		"""
+		self._on_write( [] )
+		if error is not None:
+			ERROR_MSG( "%s::_bulk_insert_callback(), execute raw sql '%s' fault!!!; error: %s" % ( self.__class__.__name__, cmd, error ) )
+			agg.done( index, False, (0, 0) )
+			return
+
+		self._track_insert_ids( insertid, len( items ) )
+		pkName = self.meta.primary_name
+		fillPK = insertid > 0 and isinstance( self.meta.fields.get( pkName ), FieldInteger )
+		for i, item in enumerate( items ):
+			if isinstance( item, dict ):
+				continue
+			synced = dict( zip( attrs, values[i] ) )
+			if fillPK:
+				setattr( item, pkName, insertid + i )
+				synced[pkName] = insertid + i
+			item._mark_synced( synced )
+			if fillPK and self.meta.identities is not None:
+				self.meta.identities.put( item )
+
+		agg.done( index, True, (insertid, rows) )
+
+	def _build_pk_in_where( self, pkvs ):
+		"""
+		生成"WHERE ... pk IN (...)"语句，会同时带上当前的过滤条件
+		@param pkvs: list of bytes; 已经转义过的主键值
+		@return bytes
+		"""
+		where = self.build_where_clauses(*self.filters)
+		pkIn = self.meta.primary_key.encode() + b" IN (" + b", ".join( pkvs ) + b")"
+		return (where + b" AND " if where else b" WHERE ") + pkIn
+
+	def bulk_update( self, callback, models, fields = None, batch_size = BULK_BATCH_SIZE, max_packet = MAX_ALLOWED_PACKET ):
+		"""
+		把多个EntityModel实例的数据以"UPDATE ... SET col = CASE pk WHEN ... THEN ... END WHERE pk IN (...)"的方式分批更新到数据库。
+		@param models: list of EntityModel; 主键必须有值
+		@param fields: list of str; 需要更新的属性名，默认为除主键外的所有字段
+
+		回调格式（所有批次完成后回调一次）：
+		def callback(success, rows):
+			pass
+		rows: 所有批次影响的行数总和
+		"""
+		assert self.model is not None
+		assert self.meta.primary_key, "primary key not set!"
+		models = list( models )
+		if not models:
+			if callable( callback ):
+				callback( True, 0 )
+			return
+
+		metaFields = self.meta.fields
+		pkName = self.meta.primary_name
+		if fields is None:
+			# 不写入还没有加载的延迟加载字段（见defer()）
+			skip = set()
+			for m in models:
+				skip.update( m.get_deferred_fields() )
+			fields = [ k for k in metaFields if k != pkName and k not in skip ]
+		assert fields and pkName not in fields
+
+		pkvs = []
+		rows = []
+		sizes = []
+		values = []
+		for m in models:
+			pkv = MysqlUtility.process_param( m.get_primary_key_value() )
+			raw = [ getattr( m, k ) for k in fields ]
+			vs = MysqlUtility.process_params( raw )
+			# 与writeToDB()一致，写入成功后主键也记录为已同步
+			synced = dict( zip( fields, raw ) )
+			synced[pkName] = m.get_primary_key_value()
+			values.append( synced )
+			pkvs.append( pkv )
+			rows.append( vs )
+			sizes.append( sum( [ len( pkv ) + len( v ) + 12 for v in vs ] ) + len( pkv ) + 2 )  # 12 = len(b" WHEN  THEN ")
+
+		head = MysqlUtility.makeSafeSql( "UPDATE {} SET ".format( self.meta.db_table ) )
+		cases = [ "{} = CASE {}".format( metaFields[k].db_column, self.meta.primary_key ).encode() for k in fields ]
+		overhead = len( head ) + sum( [ len( e ) + 6 for e in cases ] ) + len( self._build_pk_in_where( [] ) )
+		batches = split_batches( sizes, overhead, batch_size, max_packet )
+
+		self._on_write( [ m.get_primary_key_value() for m in models ], False, models )
+		self._track_values( values )
+		agg = _BatchResult( len( batches ), functools.partial( _sum_rows_callback, callback ) )
+		for index, (start, end) in enumerate( batches ):
+			sets = []
+			for i, case in enumerate( cases ):
+				whens = [ b" WHEN " + pkvs[j] + b" THEN " + rows[j][i] for j in range( start, end ) ]
+				sets.append( case + b"".join( whens ) + b" END" )
+			cmd = head + b", ".join( sets ) + self._build_pk_in_where( pkvs[start:end] )
+			#DEBUG_MSG( "%s::bulk_update(), %s" % (self.__class__.__name__, cmd) )
+			KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._bulk_update_callback, cmd, models[start:end], values[start:end], agg, index ) )
+
+	def bulk_delete( self, callback, pks, batch_size = BULK_BATCH_SIZE, max_packet = MAX_ALLOWED_PACKET ):
+		"""
+		以"DELETE FROM ... WHERE pk IN (...)"的方式分批删除主键在pks中的记录。
+		@param pks: list; 主键值列表
+
+		回调格式（所有批次完成后回调一次）：
+		def callback(success, rows):
+			pass
+		rows: 所有批次删除的行数总和
+		"""
+		assert self.model is not None
+		assert self.meta.primary_key, "primary key not set!"
+		pks = list( pks )
+		pkvs = MysqlUtility.process_params( pks )
+		if not pkvs:
+			if callable( callback ):
+				callback( True, 0 )
+			return
+
+		head = MysqlUtility.makeSafeSql( "DELETE FROM {}".format( self.meta.db_table ) )
+		sizes = [ len( e ) + 2 for e in pkvs ]
+		batches = split_batches( sizes, len( head ) + len( self._build_pk_in_where( [] ) ), batch_size, max_packet )
+
+		self._on_write( pks )
+		if self.meta.existence is not None:
+			self.meta.existence.deletes += len( pks )
+		agg = _BatchResult( len( batches ), functools.partial( _sum_rows_callback, callback ) )
+		for index, (start, end) in enumerate( batches ):
+			cmd = head + self._build_pk_in_where( pkvs[start:end] )
+			#DEBUG_MSG( "%s::bulk_delete(), %s" % (self.__class__.__name__, cmd) )
+			KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._bulk_delete_callback, cmd, pks[start:end], agg, index ) )
+
+	def _bulk_update_callback( self, cmd, models, values, agg, index, result, rows, insertid, error ):
+		"""
+		bulk_update命令回调
+		"""
+		self._on_write( [ m.get_primary_key_value() for m in models ], False, models )
+		if error is None:
+			for i, m in enumerate( models ):
+				m._mark_synced( values[i] )
+				if self.meta.identities is not None:
+					self.meta.identities.put( m )
+		self._bulk_rows_callback( cmd, agg, index, result, rows, insertid, error )
+
+	def _bulk_delete_callback( self, cmd, pks, agg, index, result, rows, insertid, error ):
+		"""
+		bulk_delete命令回调
+		"""
+		self._on_write( pks )
+		self._bulk_rows_callback( cmd, agg, index, result, rows, insertid, error )
+
+	def _bulk_rows_callback( self, cmd, agg, index, result, rows, insertid, error ):
+		"""
+		bulk_update、bulk_delete命令回调
+		"""
+		if error is not None:
+			ERROR_MSG( "%s::_bulk_rows_callback(), execute raw sql '%s' fault!!!; error: %s" % ( self.__class__.__name__, cmd, error ) )
+			agg.done( index, False, 0 )
+			return
+		agg.done( index, True, rows )
+
+	def upsert( self, callback, *args, update = None, **kwargs ):
+		"""
+		使用"INSERT ... ON DUPLICATE KEY UPDATE ..."在一次往返中插入或更新一条记录。
+		例子：
+		xxx.upsert( cb, id = 123, count = 1, update = { "count" : F("count") + 1 } )
+
+		@param args, kwargs: 需要插入的数据，格式与insert()相同
+		@param update: dict; 记录已存在（主键或唯一键冲突）时需要更新的内容，值可以是F()等表达式；
+		       为None时使用本次插入的数据（主键除外）覆盖已存在的记录
+		回调格式：
+		def callback(success, insertid, created):
+			pass
+		insertid: 整数主键时，无论插入还是更新都是该记录的主键值
+		created: 是否插入了新记录
+		"""
+		assert self.model is not None
+		kw = list(args) + list(kwargs.items())
+		cmd, pks = self.build_upsert_sql( kw, update )
+		self._on_write( pks )
+		self._track_values( [ dict( kw ), update or {} ] )
+		#DEBUG_MSG( "%s::upsert(), %s" % (self.__class__.__name__, cmd) )
+		KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._upsert_callback, cmd, pks, callback ) )
+
+	def build_upsert_sql( self, kw, update = None ):
+		"""
+		@param kw: list; [ (属性名, 值), ... ]
+		@param update: 见upsert()
+		@return (bytes, list or None); upsert的sql语句，以及语句中指定的主键值
+		"""
+		metaFields = self.meta.fields
+		pkName = self.meta.primary_name
+
+		fieldNames = []
+		fieldValues = []
+		for k, v in kw:
+			fieldNames.append( metaFields[k].db_column )
+			fieldValues.append( v )
+
+		if update is None:
+			paramsKey = [ "{0} = VALUES({0})".format( metaFields[k].db_column ) for k, v in kw if k != pkName ]
+			paramsVal = []
+		else:
+			paramsKey, paramsVal = self.build_set_clauses( list( update.items() ) )
+
+		if pkName and isinstance( metaFields[pkName], FieldInteger ):
+			# 让更新时的insertid也能返回已存在记录的主键
+			paramsKey.append( "{0} = LAST_INSERT_ID({0})".format( self.meta.primary_key ) )
+		elif not paramsKey:
+			paramsKey.append( "{0} = {0}".format( fieldNames[0] ) )
+
+		cmd = "INSERT INTO {} ( {} ) VALUES ( {} ) ON DUPLICATE KEY UPDATE {}".format( self.meta.db_table,
+			", ".join( fieldNames ), ", ".join( ["%s"] * len( fieldValues ) ), ", ".join( paramsKey ) )
+		cmd = MysqlUtility.makeSafeSql( cmd, fieldValues + paramsVal )
+		pks = None
+		for k, v in kw:
+			if k == pkName:
+				pks = [v]
+		return cmd, pks
+
+	def _upsert_callback( self, cmd, pks, callback, result, rows, insertid, error ):
+		"""
+		upsert命令回调
+		"""
+		self._on_write( pks )
+		if error is not None:
+			ERROR_MSG( "%s::_upsert_callback(), execute raw sql '%s' fault!!!; error: %s" % ( self.__class__.__name__, cmd, error ) )
+			if callable( callback ):
+				callback( False, insertid, False )
+			return
+
+		# ON DUPLICATE KEY UPDATE: 插入新记录时影响行数为1，更新已存在的记录时为2，已存在但没有变化时为0
+		if rows == 1:
+			self._track_insert_ids( insertid )
+		if callable( callback ):
+			callback( True, insertid, rows == 1 )
+
+	def get_or_create( self, callback, defaults = None, **kwargs ):
+		"""
+		按kwargs（需要包含主键或唯一键）查找记录，不存在则使用kwargs和defaults创建一条新记录。
+		先发送"INSERT IGNORE INTO ..."，由影响行数判断是否插入了新记录（插入时为1，记录已存在时为0，
+		不受CLIENT_FOUND_ROWS影响），完成后再按kwargs读取该记录，共两次往返，不存在竞争问题。
+		注意：
+		1.INSERT IGNORE会把其它错误（例如NOT NULL字段没有给出值）也变为警告，这时记录不会被插入，回调失败；
+		2.记录已经存在时，InnoDB（innodb_autoinc_lock_mode为1或2时）仍然会分配一个AUTO_INCREMENT值，
+		  自增主键会出现空洞；大量对已存在记录调用时请先使用select()查找。
+
+		回调格式：
+		def callback(success, model, created):
+			pass
+		"""
+		assert self.model is not None
+		assert kwargs, "lookup not set!"
+		values = dict( defaults or {} )
+		values.update( kwargs )
+		kw = list( values.items() )
+		cmd = "INSERT IGNORE INTO {} ( {} ) VALUES ( {} )".format( self.meta.db_table,
+			", ".join( [ self.meta.fields[k].db_column for k, v in kw ] ), ", ".join( ["%s"] * len( kw ) ) )
+		cmd = MysqlUtility.makeSafeSql( cmd, [ v for k, v in kw ] )
+		pks = None
+		if self.meta.primary_name in values:
+			pks = [ values[self.meta.primary_name] ]
+		self._on_write( pks )
+		self._track_values( [ values ] )
+		#DEBUG_MSG( "%s::get_or_create(), %s" % (self.__class__.__name__, cmd) )
+		KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._get_or_create_insert_callback, cmd, pks, kwargs, callback ) )
+
+	def _get_or_create_insert_callback( self, cmd, pks, lookup, callback, result, rows, insertid, error ):
+		"""
+		get_or_create插入命令回调，接着读取该记录
+		"""
+		self._on_write( pks )
+		if error is not None:
+			ERROR_MSG( "%s::_get_or_create_insert_callback(), execute raw sql '%s' fault!!!; error: %s" % ( self.__class__.__name__, cmd, error ) )
+			if callable( callback ):
+				callback( False, None, False )
+			return
+
+		created = rows == 1
+		if created:
+			self._track_insert_ids( insertid )
+		attrs = list( self.meta.fields )
+		select = "SELECT {} FROM {}".format( ", ".join( [ self.meta.fields[k].db_column for k in attrs ] ), self.meta.db_table )
+		cmd = MysqlUtility.makeSafeSql( select ) + self.build_where_clauses( *lookup.items() )
+		KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._get_or_create_callback, cmd, attrs, self.cache_generations(), created, callback ) )
+
+	def _get_or_create_callback( self, cmd, attrs, generations, created, callback, result, rows, insertid, error ):
+		"""
+		get_or_create读取命令回调
+		@param generations: 发出查询时各缓存的generation（见cache_generations()）
+		"""
+		if error is not None:
+			ERROR_MSG( "%s::_get_or_create_callback(), execute raw sql '%s' fault!!!; error: %s" % ( self.__class__.__name__, cmd, error ) )
+			if callable( callback ):
+				callback( False, None, False )
+			return
+		if not result:
+			# 查找条件中没有主键或唯一键，或者记录在两次往返之间被删除
+			ERROR_MSG( "%s::_get_or_create_callback(), row not found by '%s'!!!" % ( self.__class__.__name__, cmd ) )
+			if callable( callback ):
+				callback( False, None, False )
+			return
+
+		m = self.model.get_decoder( attrs )( result[0] )
+		sharedCache = self.meta.shared_cache
+		if sharedCache is not None and sharedCache.writer:
+			sharedCache.put( m, generations[2] )
+		if self.meta.identities is not None:
+			m = self.meta.identities.load( m, generations[1] )
+		if callable( callback ):
+			callback( True, m, created )
+
+	def accumulate( self, pk, **deltas ):
+		"""
+		把对某条记录的数值字段的增量先在内存中累加，之后合并为一条"UPDATE ... SET col = col + <累加和>"写入，
+		最长延迟Meta.accumulate_interval秒；服务器关闭前请调用Accumulator.flush_all()。
+		例子：
+		xxx.accumulate( 123, kills = 1, gold = -50 )
+		"""
+		assert self.model is not None
+		assert self.meta.primary_key, "primary key not set!"
+		accumulator = getattr( self.meta, "accumulator", None )
+		if accumulator is None:
+			accumulator = DeltaAccumulator( self.model )
+			self.meta.accumulator = accumulator
+		accumulator.add( pk, deltas )
+
+	def get( self, callback, pk ):
+		"""
+		按主键读取一条记录。同一个tick（或Meta.batch_window秒）内的所有get()会合并为一条"WHERE pk IN (...)"查询。
+		def callback(success, model):
+			pass
+		model: 记录不存在时为None
+		"""
+		assert self.model is not None
+		assert self.meta.primary_key, "primary key not set!"
+		loader = getattr( self.meta, "loader", None )
+		if loader is None:
+			loader = BatchLoader( self.model, self.meta.batch_window )
+			self.meta.loader = loader
+		loader.load( pk, callback )
+
+	def get_many( self, callback, pks ):
+		"""
+		按主键读取多条记录，与get()一样会和同一时间的其它读取合并查询。
+		def callback(success, models):
+			pass
+		models: 与pks一一对应，记录不存在时为None
+		"""
+		pks = list( pks )
+		if not pks:
+			if callable( callback ):
+				callback( True, [] )
+			return
+		result = _ManyResult( pks, callback )
+		for pk in set( pks ):
+			self.get( functools.partial( result.done, pk ), pk )
+
+	def load_deferred( self, callback, models, fields = None, batch_size = BULK_BATCH_SIZE, max_packet = MAX_ALLOWED_PACKET ):
+		"""
+		以"SELECT pk, ... FROM ... WHERE pk IN (...)"的方式分批加载models中延迟加载的字段（见defer()、only()）。
+		已经被赋值的字段保留本地的值；记录已经不存在的实例仍然保持延迟加载状态。
+		@param models: list of EntityModel; 没有延迟加载字段的实例会被忽略
+		@param fields: list of str; 需要加载的属性名，默认为这些实例所有延迟加载的字段
 
+		回调格式（所有批次完成后回调一次）：
+		def callback(success, models):
+			pass
+		"""
+		assert self.model is not None
+		assert self.meta.primary_key, "primary key not set!"
+		models = list( models )
+		pending = [ m for m in models if m._deferred ]
+		if fields is None:
+			names = set()
+			for m in pending:
+				names.update( m._deferred )
+		else:
+			names = set( fields )
+			for k in names:
+				assert k in self.meta.fields, "unknown field '%s'" % k
+		pkName = self.meta.primary_name
+		attrs = [ k for k in self.meta.fields if k in names and k != pkName ]
+		if not pending or not attrs:
+			if callable( callback ):
+				callback( True, models )
+			return
 
+		byPk = {}
+		for m in pending:
+			byPk.setdefault( m.get_primary_key_value(), [] ).append( m )
+		pks = list( byPk )
+		pkvs = MysqlUtility.process_params( pks )
+		attrs.insert( 0, pkName )
+		head = MysqlUtility.makeSafeSql( "SELECT {} FROM {}".format( ", ".join( [ self.meta.fields[k].db_column for k in attrs ] ), self.meta.db_table ) )
+		sizes = [ len( e ) + 2 for e in pkvs ]
+		batches = split_batches( sizes, len( head ) + len( self._build_pk_in_where( [] ) ), batch_size, max_packet )
 
+		agg = _BatchResult( len( batches ), functools.partial( self._load_deferred_done, models, callback ) )
+		for index, (start, end) in enumerate( batches ):
+			cmd = head + self._build_pk_in_where( pkvs[start:end] )
+			#DEBUG_MSG( "%s::load_deferred(), %s" % (self.__class__.__name__, cmd) )
+			KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._load_deferred_callback, cmd, attrs, byPk, agg, index ) )
+
+	def _load_deferred_callback( self, cmd, attrs, byPk, agg, index, result, rows, insertid, error ):
+		"""
+		load_deferred命令回调
+		"""
+		if error is not None:
+			ERROR_MSG( "%s::_load_deferred_callback(), execute raw sql '%s' fault!!!; error: %s" % ( self.__class__.__name__, cmd, error ) )
+			agg.done( index, False, None )
+			return
+
+		decode = self.model.get_values_decoder( "dict", attrs )
+		for row in result:
+			values = decode( row )
+			for m in byPk.get( values.pop( self.meta.primary_name ), () ):
+				m._load_deferred( values )
+		agg.done( index, True, None )
+
+	def _load_deferred_done( self, models, callback, success, results ):
+		"""
+		load_deferred所有批次完成
+		"""
+		if callable( callback ):
+			callback( success, models )
+
+	def build_existence_filter( self, callback = None, batch = 10000 ):
+		"""
+		扫描整个表构建Meta.existence_filter所声明字段的存在性过滤器（一般在服务器启动时调用）
+		def callback(success, keys):
+			pass
+		"""
+		assert self.meta.existence is not None, "Meta.existence_filter not set!"
+		self.meta.existence.build( callback, batch )
+
+	def reload( self, callback = None ):
+		"""
+		重新把整个表加载到内存中（Meta.preload为True时有效）
+		def callback(success, rows):
+			pass
+		"""
+		assert self.meta.memory_table is not None, "Meta.preload not set!"
+		self.meta.memory_table.reload( callback )
+
+	def watch( self, callback = None, watermark = None ):
+		"""
+		开始增量轮询表的变化（Meta.change_column不为空时有效）
+		def callback(model):
+			pass
+		@param watermark: 初始水位，为None时只通知开始轮询之后的变化
+		"""
+		poller = self.meta.poller
+		assert poller is not None, "Meta.change_column not set!"
+		if callable( callback ):
+			poller.subscribe( callback )
+		poller.start( watermark )
+
+	def attach_shared_cache( self, path, writer = False, slots = 65536, slot_size = 256 ):
+		"""
+		使用同一台机器上多个进程共享的内存缓存（见SharedCache.py），纯主键的查询先从共享缓存中读取。
+		一般由一个进程以writer = True创建并写入，其它进程以writer = False只读。
+		@param path: 内存映射文件的路径，例如"/dev/shm/item_cache"
+		@return bool; 是否成功
+		"""
+		try:
+			cache = SharedCache( self.model, path, writer, slots, slot_size )
+		except (OSError, ValueError) as e:
+			ERROR_MSG( "%s::attach_shared_cache(), attach '%s' fault!!!; error: %s" % ( self.__class__.__name__, path, e ) )
+			return False
+		if self.meta.shared_cache is not None:
+			self.meta.shared_cache.close()
+		self.meta.shared_cache = cache
+		return True
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""
+查询结果缓存：
+以最终生成的SELECT语句（bytes）为key缓存数据库返回的原始结果，命中时重新生成EntityModel实例，
+各个调用者拿到的实例互不影响。
+通过QuerySet对某个表进行的任何修改（update/delete/insert等）都会使该表的所有缓存失效。
+"""
+import collections, time
+
+
+# key = 表名; value = [QueryCache, ...]
+g_table_caches = {}
+
+def invalidate_table( db_table ):
+	"""
+	使某个表的所有查询缓存失效
+	"""
+	for cache in g_table_caches.get( db_table, () ):
+		cache.clear()
+
+
+class QueryCache(object):
+	"""
+	某个EntityModel类的查询结果缓存
+	"""
+	def __init__( self, model_class, ttl, max_entries = 1000 ):
+		"""
+		@param model_class: EntityModel
+		@param ttl: 查询结果缓存多少秒
+		@param max_entries: 最多缓存多少条查询结果，超出时按LRU淘汰
+		"""
+		self.model = model_class
+		self.ttl = ttl
+		self.max_entries = max_entries
+		self.entries = collections.OrderedDict()  # key = sql; value = (过期时间, 数据库返回的原始结果)
+		self.generation = 0  # 每次失效时加1，用于丢弃失效前发出的查询的结果
+
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.invalidations = 0
+
+		g_table_caches.setdefault( model_class._meta.db_table, [] ).append( self )
+
+	def __len__( self ):
+		return len( self.entries )
+
+	def stats( self ):
+		"""
+		@return dict
+		"""
+		return {
+			"hits"          : self.hits,
+			"misses"        : self.misses,
+			"evictions"     : self.evictions,
+			"invalidations" : self.invalidations,
+			"entries"       : len( self.entries ),
+		}
+
+	def get( self, cmd ):
+		"""
+		@return 数据库返回的原始结果 or None
+		"""
+		entry = self.entries.get( cmd )
+		if entry is None or entry[0] < time.time():
+			if entry is not None:
+				del self.entries[cmd]
+			self.misses += 1
+			return None
+		self.hits += 1
+		self.entries.move_to_end( cmd )
+		return entry[1]
+
+	def put( self, cmd, result, generation ):
+		"""
+		@param generation: 发出查询时的self.generation，期间缓存失效过则不缓存该结果
+		"""
+		if generation != self.generation:
+			return
+		self.entries[cmd] = (time.time() + self.ttl, tuple( result ))
+		self.entries.move_to_end( cmd )
+		while len( self.entries ) > self.max_entries:
+			self.entries.popitem( last = False )
+			self.evictions += 1
+
+	def clear( self ):
+		"""
+		"""
+		self.generation += 1
+		self.invalidations += 1
+		self.entries.clear()
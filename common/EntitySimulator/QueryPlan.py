@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+查询计划缓存：
+实际运行中的查询只有少数几种结构（过滤条件的字段与运算符、排序、是否limit、更新的字段），只是值不同。
+每种结构只生成一次拆分好的sql模板，之后相同结构的查询只需要对值进行转义并拼接。
+"""
+import collections
+
+
+class Template(object):
+	"""
+	拆分好的sql模板：literals[0] + escapes[0](values[0]) + literals[1] + ... + literals[n]
+	"""
+	__slots__ = ("literals", "escapes")
+
+	def __init__( self, parts ):
+		"""
+		@param parts: list; bytes以及对值进行转义的函数，相邻的bytes会被合并
+		"""
+		literals = [b""]
+		escapes = []
+		for p in parts:
+			if isinstance( p, bytes ):
+				literals[-1] += p
+			else:
+				escapes.append( p )
+				literals.append( b"" )
+		self.literals = literals
+		self.escapes = escapes
+
+	def render( self, values ):
+		"""
+		@param values: list; 与转义函数一一对应的值
+		@return bytes
+		"""
+		literals = self.literals
+		r = [literals[0]]
+		i = 1
+		for escape, value in zip( self.escapes, values ):
+			r.append( escape( value ) )
+			r.append( literals[i] )
+			i += 1
+		return b"".join( r )
+
+
+class PlanCache(object):
+	"""
+	以查询结构为key的模板缓存，超出数量上限时按LRU淘汰
+	"""
+	def __init__( self, max_entries = 1024 ):
+		"""
+		@param max_entries: 最多缓存多少个模板
+		"""
+		self.max_entries = max_entries
+		self.templates = collections.OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def __len__( self ):
+		return len( self.templates )
+
+	def stats( self ):
+		"""
+		@return dict; 命中、未命中、淘汰次数，命中率以及当前缓存的模板数量
+		"""
+		total = self.hits + self.misses
+		return {
+			"hits"      : self.hits,
+			"misses"    : self.misses,
+			"hit_rate"  : self.hits / total if total else 0.0,
+			"evictions" : self.evictions,
+			"entries"   : len( self.templates ),
+		}
+
+	def get( self, key, compile ):
+		"""
+		@param key: 查询结构
+		@param compile: 未命中时调用，返回生成模板用的parts（见Template）
+		@return Template
+		"""
+		template = self.templates.get( key )
+		if template is not None:
+			self.hits += 1
+			self.templates.move_to_end( key )
+			return template
+
+		self.misses += 1
+		template = Template( compile() )
+		self.templates[key] = template
+		while len( self.templates ) > self.max_entries:
+			self.templates.popitem( last = False )
+			self.evictions += 1
+		return template
+
+	def clear( self ):
+		"""
+		"""
+		self.templates.clear()
+
+
+g_plan_cache = PlanCache()
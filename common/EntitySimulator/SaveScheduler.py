@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+"""
+存档平滑调度器：
+把需要定期存档的EntityModel实例按主键的hash值分散到存档周期内的各个时间槽中，
+每个tick只存档一个时间槽里的实例，并限制每个tick最多发出的语句数，避免所有实例在同一时刻写入数据库。
+
+例子：
+scheduler = SaveScheduler( period = 300.0, tick = 1.0, budget = 50 )
+scheduler.start()
+scheduler.register( playerModel )    # 玩家上线
+scheduler.unregister( playerModel )  # 玩家下线（下线时的存档由使用者自己调用writeToDB()）
+
+# 服务器关闭：在10秒内把所有实例写完
+scheduler.flush_all( cb, within = 10.0 )
+"""
+import collections, functools, math
+
+import KBEngine
+from KBEDebug import *
+
+from . import WriteBehind, Accumulator
+
+
+class SaveScheduler(object):
+	"""
+	"""
+	def __init__( self, period = 300.0, tick = 1.0, budget = 100 ):
+		"""
+		@param period: 每个实例的存档周期（秒）
+		@param tick: 调度间隔（秒）
+		@param budget: 每个tick最多发出的存档语句数，超出的部分顺延到下一个tick
+		"""
+		self.tick = tick
+		self.budget = budget
+		self.slots = [ dict() for i in range( max( 1, int( round( period / tick ) ) ) ) ]  # 时间槽; { key : EntityModel }
+		self.slotOf = {}          # key = (EntityModel类, 主键值)，还没有主键的实例为(EntityModel类, None, id(EntityModel)); value = 时间槽下标
+		self.keyOf = {}           # id(EntityModel) -> 注册时的key；还没有主键的实例保存后主键会改变，不能重新计算key
+		self.cursor = 0           # 下一个tick处理的时间槽
+		self.backlog = collections.deque()  # 等待存档的实例
+		self.queued = set()       # 在backlog中的key
+		self.inflight = set()     # 已经发出存档但还没有回调的key
+		self.timerID = 0
+		self.writing = 0          # 已经发出但还没有回调的存档数量
+		self.emergency = None     # 紧急存档时为 [[callback, ...], 每个tick的语句数, 成功与否, 存档数量, 紧急存档前是否已经在定期存档]
+
+	def __len__( self ):
+		return len( self.slotOf )
+
+	@staticmethod
+	def key_of( model ):
+		"""
+		"""
+		pk = model.get_primary_key_value()
+		if pk:
+			return (model.__class__, pk)
+		return (model.__class__, None, id( model ))
+
+	@staticmethod
+	def slot_hash( key ):
+		"""
+		还没有主键的实例以id()作为key：id()是对象地址，低4位总是0，相邻创建的实例地址的间隔也基本固定，
+		直接取模会集中在少数几个时间槽中；去掉低4位后乘以一个奇数常数（Fibonacci hashing）再取高位
+		"""
+		if len( key ) == 3:
+			return ( ( key[2] >> 4 ) * 0x9E3779B97F4A7C15 & 0xFFFFFFFFFFFFFFFF ) >> 32
+		return hash( key[1] )
+
+	def register( self, model ):
+		"""
+		加入定期存档
+		"""
+		key = self.keyOf.get( id( model ) )
+		if key is None:
+			key = self.key_of( model )
+		if key in self.slotOf:
+			self.keyOf[id( model )] = key
+			self.slots[self.slotOf[key]][key] = model
+			return
+		index = self.slot_hash( key ) % len( self.slots )
+		self.keyOf[id( model )] = key
+		self.slotOf[key] = index
+		self.slots[index][key] = model
+
+	def unregister( self, model ):
+		"""
+		退出定期存档
+		"""
+		key = self.keyOf.pop( id( model ), None )
+		if key is None:
+			key = self.key_of( model )
+		index = self.slotOf.pop( key, None )
+		if index is not None:
+			self.slots[index].pop( key, None )
+
+	def start( self ):
+		"""
+		"""
+		if not self.timerID:
+			self.timerID = KBEngine.addTimer( self.tick, self.tick, self._on_tick )
+
+	def stop( self ):
+		"""
+		"""
+		if self.timerID:
+			KBEngine.delTimer( self.timerID )
+			self.timerID = 0
+
+	def flush_all( self, callback = None, within = 10.0 ):
+		"""
+		紧急存档（例如服务器关闭）：在within秒内把所有实例写入数据库，之后写入延迟写入缓冲区和累加器中的数据。
+		回调格式：
+		def callback(success, count):
+			pass
+		count: 发出的存档数量
+		正在存档的实例不会重复写入，存档返回后如果又有修改会再写一次；
+		紧急存档完成后恢复调用之前的状态（之前已经start()的继续定期存档）。
+		紧急存档期间再次调用时合并到正在进行的紧急存档中，完成后所有的callback都会被回调。
+		"""
+		for slot in self.slots:
+			for key, model in slot.items():
+				if key not in self.queued and key not in self.inflight:
+					self.queued.add( key )
+					self.backlog.append( (key, model) )
+
+		ticks = max( 1, int( within / self.tick ) )
+		budget = max( self.budget, int( math.ceil( len( self.backlog ) / ticks ) ) )
+		if self.emergency is None:
+			self.emergency = [[callback], budget, True, 0, bool( self.timerID )]
+		else:
+			self.emergency[0].append( callback )
+			self.emergency[1] = max( self.emergency[1], budget )
+		self.start()
+		self._on_tick( self.timerID )
+
+	def _on_tick( self, timerID ):
+		"""
+		"""
+		if self.emergency is None:
+			slot = self.slots[self.cursor]
+			self.cursor = (self.cursor + 1) % len( self.slots )
+			for key, model in slot.items():
+				if key not in self.queued and key not in self.inflight:
+					self.queued.add( key )
+					self.backlog.append( (key, model) )
+			budget = self.budget
+		else:
+			budget = self.emergency[1]
+
+		while self.backlog and budget > 0:
+			key, model = self.backlog.popleft()
+			self.queued.discard( key )
+			if model.get_primary_key_value() and not model.is_dirty():
+				continue
+			budget -= 1
+			self.writing += 1
+			self.inflight.add( key )
+			if self.emergency is not None:
+				self.emergency[3] += 1
+			model.writeToDB( functools.partial( self._save_callback, key ) )
+
+		if self.emergency is not None and not self.backlog:
+			WriteBehind.flush_all()
+			Accumulator.flush_all()
+			self._check_emergency_finished()
+
+	def _save_callback( self, key, success, model ):
+		"""
+		"""
+		self.writing -= 1
+		self.inflight.discard( key )
+		if not success:
+			ERROR_MSG( "%s::_save_callback(), save %s(%s) fault!!!" % ( self.__class__.__name__, model.__class__.__name__, model.get_primary_key_value() ) )
+			if self.emergency is not None:
+				self.emergency[2] = False
+		elif self.emergency is not None and key in self.slotOf and model.is_dirty() and key not in self.queued:
+			# 存档期间又有修改，紧急存档时需要再写一次
+			self.queued.add( key )
+			self.backlog.append( (key, model) )
+
+		if self.emergency is not None and not self.backlog:
+			self._check_emergency_finished()
+
+	def _check_emergency_finished( self ):
+		"""
+		"""
+		if self.writing > 0:
+			return
+		callbacks, budget, success, count, periodic = self.emergency
+		self.emergency = None
+		if not periodic:
+			self.stop()
+		for callback in callbacks:
+			if callable( callback ):
+				callback( success, count )
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+
+"""
+同一台机器上多个进程共享的EntityModel记录缓存：
+记录以紧凑的格式（marshal）保存在内存映射文件（例如/dev/shm下的文件）中，一个进程负责写入，其它进程只读，
+读取时不需要访问数据库，也不需要在每个进程中保存一份数据。
+
+文件格式：
+	文件头：magic(4s) 槽数量(I) 槽大小(I) 字段列表的crc32(I) generation(I) epoch(I)
+	槽：版本号(I) 数据长度(I) 数据；数据为marshal.dumps( (主键值, (字段值, ...)) )
+按主键的crc32开放寻址（线性探测）。
+写入方在修改槽之前把版本号加1（变为奇数），修改完成后再加1（变为偶数）；
+读取方读取前后的版本号不一致或为奇数时重新读取（seqlock），因此不需要进程间的锁。
+
+写入进程不会修改只读进程正在使用的文件的大小（否则只读进程访问时会收到SIGBUS）：
+写入进程总是创建一个新文件，以os.replace()替换旧文件后，再把旧文件头中的generation加1；
+只读进程每次读取前检查自己映射的文件的generation，发生变化时重新打开并映射新文件。
+清空缓存时写入进程把文件头中的epoch加1。
+
+只读进程对表的修改需要由写入进程通过其它方式（例如ChangePoller）更新到共享缓存中，
+在此之前只读进程不会从共享缓存中读取自己修改过的记录（见mark_stale()），因此适用于很少修改的表。
+写入进程只写入发出查询之后表没有被修改过的查询结果（见write_generation），以免把修改之前的数据写回共享缓存。
+"""
+import marshal, mmap, os, struct, zlib
+
+from KBEDebug import *
+
+
+
+MAGIC = b"ESSC"
+HEADER = struct.Struct( "<4sIIIII" )
+GENERATION_OFFSET = 16
+EPOCH_OFFSET = 20
+SLOT_HEADER = struct.Struct( "<II" )
+
+EMPTY = 0               # 数据长度为0表示空槽
+TOMBSTONE = 0xFFFFFFFF  # 被删除的槽，查找时需要继续探测
+MAX_PROBES = 16         # 最多探测多少个槽
+MAX_RETRIES = 8         # 读取时遇到正在写入的槽，最多重试多少次
+
+
+class SharedCache(object):
+	"""
+	某个EntityModel类的共享内存缓存
+	"""
+	def __init__( self, model_class, path, writer = False, slots = 65536, slot_size = 256 ):
+		"""
+		@param model_class: EntityModel
+		@param path: 内存映射文件的路径
+		@param writer: 是否为写入进程；写入进程会创建新文件替换旧文件
+		@param slots: 槽的数量（仅写入进程有效）
+		@param slot_size: 每个槽的大小，数据超过该大小的记录不会被缓存（仅写入进程有效）
+		"""
+		self.model = model_class
+		self.meta = model_class._meta
+		self.path = path
+		self.writer = writer
+		self.attrs = list( self.meta.fields )
+		self.schema = zlib.crc32( ",".join( self.attrs ).encode() )
+		self.file = None
+		self.mm = None
+		self.stale = {}         # 只读进程修改过、写入进程还没有重新写入的记录 -> { 主键值 : (槽偏移, 版本号) or None }
+		self.stale_all = None   # 只读进程修改了无法确定主键的记录时的epoch，epoch变化之前不使用共享缓存
+		self.hits = 0
+		self.misses = 0
+		self.retries = 0
+		self.oversized = 0
+		self.remaps = 0
+		self.write_generation = 0  # 本进程每次修改表时加1（见QuerySet._on_write()），期间被修改过的查询结果不写入
+
+		if writer:
+			self._create( slots, slot_size )
+		else:
+			self._open()
+
+	def _create( self, slots, slot_size ):
+		"""
+		写入进程：创建新文件并替换旧文件，只读进程映射着的旧文件不会被截断
+		"""
+		size = HEADER.size + slots * slot_size
+		tmp = "%s.%d.tmp" % ( self.path, os.getpid() )
+		with open( tmp, "wb" ) as f:
+			f.truncate( size )
+		self.file = open( tmp, "r+b" )
+		self.mm = mmap.mmap( self.file.fileno(), size )
+
+		old = None
+		generation = 0
+		try:
+			old = open( self.path, "r+b" )
+			header = old.read( HEADER.size )
+			if len( header ) == HEADER.size and header[:4] == MAGIC:
+				generation = HEADER.unpack( header )[4]
+			else:
+				old.close()
+				old = None
+		except OSError:
+			old = None
+
+		generation = ( generation + 1 ) & 0xFFFFFFFF
+		self.mm[:HEADER.size] = HEADER.pack( MAGIC, slots, slot_size, self.schema, generation, 0 )
+		os.replace( tmp, self.path )
+		if old is not None:
+			# 通知映射着旧文件的只读进程重新映射
+			old.seek( GENERATION_OFFSET )
+			old.write( struct.pack( "<I", generation ) )
+			old.close()
+
+		self.generation = generation
+		self.slots = slots
+		self.slot_size = slot_size
+
+	def _open( self ):
+		"""
+		只读进程：映射当前的文件
+		"""
+		self.file = open( self.path, "rb" )
+		self.mm = mmap.mmap( self.file.fileno(), 0, access = mmap.ACCESS_READ )
+		if len( self.mm ) < HEADER.size:
+			self.close()
+			raise ValueError( "shared cache '%s' is not ready" % self.path )
+		magic, slots, slot_size, fileSchema, generation, epoch = HEADER.unpack_from( self.mm, 0 )
+		if magic != MAGIC or fileSchema != self.schema or len( self.mm ) < HEADER.size + slots * slot_size:
+			self.close()
+			raise ValueError( "shared cache '%s' does not match model '%s'" % ( self.path, self.model.__name__ ) )
+		self.generation = generation
+		self.slots = slots
+		self.slot_size = slot_size
+
+	def _attached( self ):
+		"""
+		只读进程每次读取前检查映射的文件是否已经被写入进程替换，是则重新映射
+		@return bool; 是否可以读取
+		"""
+		if self.mm is not None and struct.unpack_from( "<I", self.mm, GENERATION_OFFSET )[0] == self.generation:
+			return True
+		self.close()
+		self.stale.clear()
+		self.stale_all = None
+		try:
+			self._open()
+		except (OSError, ValueError) as e:
+			ERROR_MSG( "%s::_attached(), remap '%s' fault!!!; error: %s" % ( self.__class__.__name__, self.path, e ) )
+			return False
+		self.remaps += 1
+		return True
+
+	def close( self ):
+		"""
+		"""
+		if self.mm is not None:
+			self.mm.close()
+			self.mm = None
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+	def stats( self ):
+		"""
+		@return dict; 命中、未命中、读取重试、因为太大而没有缓存的次数
+		"""
+		return {
+			"hits"      : self.hits,
+			"misses"    : self.misses,
+			"retries"   : self.retries,
+			"oversized" : self.oversized,
+			"remaps"    : self.remaps,
+			"stale"     : len( self.stale ),
+		}
+
+	def _probe( self, pk ):
+		"""
+		@return 依次需要探测的槽的偏移
+		"""
+		start = zlib.crc32( marshal.dumps( pk ) ) % self.slots
+		for i in range( min( MAX_PROBES, self.slots ) ):
+			yield HEADER.size + ( ( start + i ) % self.slots ) * self.slot_size
+
+	def _read_slot( self, offset ):
+		"""
+		@return (版本号, 长度, 数据) or None（槽正在被写入）
+		"""
+		mm = self.mm
+		for i in range( MAX_RETRIES ):
+			seq, length = SLOT_HEADER.unpack_from( mm, offset )
+			if seq & 1:
+				self.retries += 1
+				continue
+			data = b""
+			if length != EMPTY and length != TOMBSTONE:
+				data = mm[offset + SLOT_HEADER.size : offset + SLOT_HEADER.size + length]
+			if SLOT_HEADER.unpack_from( mm, offset )[0] == seq:
+				return seq, length, data
+			self.retries += 1
+		return None
+
+	def _write_slot( self, offset, length, data = b"" ):
+		"""
+		"""
+		mm = self.mm
+		seq = SLOT_HEADER.unpack_from( mm, offset )[0]
+		struct.pack_into( "<I", mm, offset, ( seq + 1 ) & 0xFFFFFFFF )
+		if data:
+			mm[offset + SLOT_HEADER.size : offset + SLOT_HEADER.size + len( data )] = data
+		SLOT_HEADER.pack_into( mm, offset, ( seq + 2 ) & 0xFFFFFFFF, length )
+
+	def _locate( self, pk ):
+		"""
+		@return (槽偏移, 版本号, 字段值tuple) or None
+		"""
+		for offset in self._probe( pk ):
+			slot = self._read_slot( offset )
+			if slot is None:
+				break
+			seq, length, data = slot
+			if length == EMPTY:
+				break
+			if length == TOMBSTONE:
+				continue
+			key, values = marshal.loads( data )
+			if key == pk:
+				return offset, seq, values
+		return None
+
+	def get_values( self, pk ):
+		"""
+		@return dict; { 属性名 : 值 } or None
+		"""
+		found = None
+		if self.writer or self._attached():
+			if self.stale_all is not None:
+				if struct.unpack_from( "<I", self.mm, EPOCH_OFFSET )[0] != self.stale_all:
+					# 写入进程清空过缓存，之后写入的数据都是新的
+					self.stale_all = None
+					self.stale.clear()
+			if self.stale_all is None:
+				found = self._locate( pk )
+				if pk in self.stale:
+					if found is None or self.stale[pk] != found[:2]:
+						# 写入进程重新写入（或删除）了这条记录
+						del self.stale[pk]
+					else:
+						found = None
+		if found is None:
+			self.misses += 1
+			return None
+		self.hits += 1
+		return dict( zip( self.attrs, found[2] ) )
+
+	def mark_stale( self, pks ):
+		"""
+		只读进程修改了记录：在写入进程重新写入这些记录之前，不从共享缓存中读取它们
+		@param pks: list; 被修改的记录的主键值；None表示无法确定，此时在写入进程清空缓存之前不使用共享缓存
+		"""
+		if not self._attached():
+			return
+		if pks is None:
+			self.stale_all = struct.unpack_from( "<I", self.mm, EPOCH_OFFSET )[0]
+			return
+		for pk in pks:
+			found = self._locate( pk )
+			self.stale[pk] = found[:2] if found is not None else None
+
+	def lookup( self, pks ):
+		"""
+		@return (hits, missing); hits为从共享缓存中读取到的实例列表，missing为未命中的主键值列表
+		"""
+		hits = []
+		missing = []
+		for pk in pks:
+			values = self.get_values( pk )
+			if values is None:
+				missing.append( pk )
+			else:
+				hits.append( self.model.from_values( values ) )
+		return hits, missing
+
+	def _find( self, pk ):
+		"""
+		写入进程查找主键所在的槽以及可以写入的空槽
+		@return (主键所在槽的偏移 or None, 第一个空槽的偏移 or None)
+		"""
+		free = None
+		for offset in self._probe( pk ):
+			seq, length = SLOT_HEADER.unpack_from( self.mm, offset )
+			if length == EMPTY:
+				return None, free if free is not None else offset
+			if length == TOMBSTONE:
+				if free is None:
+					free = offset
+				continue
+			data = self.mm[offset + SLOT_HEADER.size : offset + SLOT_HEADER.size + length]
+			if marshal.loads( data )[0] == pk:
+				return offset, free
+		return None, free
+
+	def put( self, model, generation = None ):
+		"""
+		把一个与数据库一致的实例写入共享缓存（仅写入进程）
+		@param generation: 发出查询时的self.write_generation；之后表被修改过时查询结果可能是修改之前的数据，不写入
+		@return bool; 是否写入成功
+		"""
+		assert self.writer
+		if generation is not None and generation != self.write_generation:
+			return False
+		pk = model.get_primary_key_value()
+		if model.get_deferred_fields():
+			# 缺少延迟加载的字段（见QuerySet.only()、defer()），不写入不完整的数据
+			return False
+		snapshot = model.get_db_snapshot()
+		try:
+			data = marshal.dumps( ( pk, tuple( [ snapshot.get( k ) for k in self.attrs ] ) ) )
+		except ValueError:
+			return False
+		current, free = self._find( pk )
+		if len( data ) > self.slot_size - SLOT_HEADER.size:
+			self.oversized += 1
+			if current is not None:
+				self._write_slot( current, TOMBSTONE )
+			return False
+		offset = current if current is not None else free
+		if offset is None:
+			return False
+		self._write_slot( offset, len( data ), data )
+		return True
+
+	def remove( self, pks ):
+		"""
+		从共享缓存中删除记录（仅写入进程）
+		"""
+		assert self.writer
+		for pk in pks:
+			current, free = self._find( pk )
+			if current is not None:
+				self._write_slot( current, TOMBSTONE )
+
+	def clear( self ):
+		"""
+		清空共享缓存（仅写入进程）
+		"""
+		assert self.writer
+		for i in range( self.slots ):
+			offset = HEADER.size + i * self.slot_size
+			if SLOT_HEADER.unpack_from( self.mm, offset )[1] != EMPTY:
+				self._write_slot( offset, EMPTY )
+		epoch = struct.unpack_from( "<I", self.mm, EPOCH_OFFSET )[0]
+		struct.pack_into( "<I", self.mm, EPOCH_OFFSET, ( epoch + 1 ) & 0xFFFFFFFF )
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+"""
+工作单元（unit of work）：
+把对多个EntityModel（可以是不同的表）的插入、更新、删除收集起来，
+以"ROLLBACK; START TRANSACTION; ...; COMMIT"的方式作为一个事务一次发送给数据库，只回调一次。
+
+例子（一次交易）：
+with UnitOfWork( cb ) as uow:
+	uow.save( seller )
+	uow.save( buyer )
+	uow.insert( TradeLog, seller = seller.databaseID, buyer = buyer.databaseID, gold = 100 )
+
+注意：
+1.需要dbmgr连接mysql时开启CLIENT_MULTI_STATEMENTS；
+2.某条语句执行失败时mysql不再执行之后的语句，事务仍然是打开的，回调中会在同一个dbmgr线程（threadID）上发送ROLLBACK；
+  在此之前同一个连接上执行的其它命令会被并入这个事务并一起回滚，所以最好让工作单元使用一个单独的dbmgr线程；
+  每个事务开头的ROLLBACK保证之前失败的事务不会被START TRANSACTION隐式提交；
+3.每条语句的结果（insertid或影响行数）保存在会话变量中，由提交后的一条SELECT语句返回。
+"""
+import functools
+
+import KBEngine
+from KBEDebug import *
+
+from .Fields import FieldInteger
+
+
+# 默认使用的dbmgr线程
+DEFAULT_THREAD_ID = 0
+
+# 操作类型
+OP_INSERT = 0
+OP_UPDATE = 1
+OP_DELETE = 2
+
+# 保存每条语句结果的会话变量
+RESULT_VAR = "@es_uow_%d"
+
+
+class UnitOfWork(object):
+	"""
+	"""
+	def __init__( self, callback = None, threadID = DEFAULT_THREAD_ID ):
+		"""
+		@param callback: 事务执行完成后的回调
+			def callback(success, results):
+				pass
+			results: list; 与添加操作的顺序一一对应，插入为insertid，更新和删除为影响的行数，无法获取时为None
+		@param threadID: 执行事务的dbmgr线程
+		"""
+		self.callback = callback
+		self.threadID = threadID
+		self.ops = []  # [ (操作类型, EntityModel类, EntityModel实例 or None, 主键值, { 属性名 : 值 }, sql, 受影响的主键列表 or None), ... ]
+		self.callbacks = []  # [ (callback, EntityModel), ... ]; 被合并进来的延迟写入回调
+		self.committed = False
+
+	def __enter__( self ):
+		return self
+
+	def __exit__( self, exc_type, exc_value, traceback ):
+		if exc_type is None:
+			self.commit()
+		return False
+
+	def __len__( self ):
+		return len( self.ops )
+
+	def save( self, model, forceInsert = False ):
+		"""
+		与EntityModel.writeToDB()相同：主键无值（或forceInsert为True）时插入，否则更新被修改过的字段；
+		没有字段被修改时不产生任何语句。
+		"""
+		meta = model._meta
+		pkName = meta.primary_name
+		pk = model.get_primary_key_value()
+		if pk and not forceInsert:
+			values = {}
+			if meta.write_behind:
+				# 合并延迟写入缓冲区中还未写入的数据，避免之后被旧数据覆盖
+				entry = meta.write_buffer.take( pk )
+				if entry is not None:
+					values.update( entry[1] )
+					self.callbacks.extend( [ (cb, entry[0]) for cb in entry[2] ] )
+			values.update( model.get_dirty_fields() )
+			values.pop( pkName, None )
+			if not values:
+				return
+			model.objects._track_values( [values] )
+			sql = model.objects.filter( (pkName, pk) ).build_update_sql( **values )
+			self.ops.append( (OP_UPDATE, model.__class__, model, pk, values, sql, [pk]) )
+		else:
+			values = { k : getattr( model, k ) for k in meta.fields if k != pkName }
+			model.objects._track_values( [values] )
+			sql = model.objects.build_insert_sql( **values )
+			self.ops.append( (OP_INSERT, model.__class__, model, None, values, sql, []) )
+
+	def insert( self, model_class, *args, **kwargs ):
+		"""
+		不需要创建实例的插入，例如写日志表；参数与QuerySet.insert()相同
+		"""
+		sql = model_class.objects.build_insert_sql( *args, **kwargs )
+		model_class.objects._track_values( [ dict( list(args) + list(kwargs.items()) ) ] )
+		self.ops.append( (OP_INSERT, model_class, None, None, None, sql, []) )
+
+	def update( self, queryset, *args, **kwargs ):
+		"""
+		按过滤条件更新；参数与QuerySet.update()相同
+		例子：uow.update( TestTable.objects.filter( databaseID = 123 ), i1 = F("i1") + 1 )
+		"""
+		sql = queryset.build_update_sql( *args, **kwargs )
+		queryset._track_values( [ dict( list(args) + list(kwargs.items()) ) ] )
+		self.ops.append( (OP_UPDATE, queryset.model, None, None, None, sql, queryset.filter_pks( queryset.filters )) )
+
+	def delete( self, model ):
+		"""
+		删除实例对应的记录
+		"""
+		meta = model._meta
+		assert meta.primary_key, "primary key not set!"
+		pk = model.get_primary_key_value()
+		if meta.write_behind:
+			meta.write_buffer.discard( pk )
+		sql = model.objects.build_delete_sql( (meta.primary_name, pk) )
+		self.ops.append( (OP_DELETE, model.__class__, model, pk, None, sql, [pk]) )
+
+	def ordered( self ):
+		"""
+		按执行顺序排列的操作下标：保持添加的顺序（例如先删除唯一键为K的记录再插入K，不能改变先后），
+		只有连续的按主键更新（或连续的按主键删除）在这一段之内按表名、主键排序，
+		使并发的事务以相同的顺序加锁，减少死锁。
+		"""
+		order = []
+		run = []
+		for i, (op, model_class, model, pk, values, sql, pks) in enumerate( self.ops ):
+			if op == OP_INSERT or pk is None or ( run and self.ops[run[0]][0] != op ):
+				order.extend( sorted( run, key = self._lock_key ) )
+				run = []
+			if op == OP_INSERT or pk is None:
+				order.append( i )
+			else:
+				run.append( i )
+		order.extend( sorted( run, key = self._lock_key ) )
+		return order
+
+	def _lock_key( self, i ):
+		"""
+		"""
+		op, model_class, model, pk, values, sql, pks = self.ops[i]
+		return ( model_class._meta.db_table, str( pk ) )
+
+	def build_sql( self, order ):
+		"""
+		@return bytes; 整个事务的sql语句：
+			"ROLLBACK; START TRANSACTION; <语句>; SET @es_uow_0 = ROW_COUNT(); ...; COMMIT; SELECT @es_uow_0, ..."
+		"""
+		stmts = [ b"ROLLBACK", b"START TRANSACTION" ]
+		for n, i in enumerate( order ):
+			stmts.append( self.ops[i][5] )
+			# 插入的结果为LAST_INSERT_ID()，更新、删除的结果为ROW_COUNT()
+			func = "LAST_INSERT_ID()" if self.ops[i][0] == OP_INSERT else "ROW_COUNT()"
+			stmts.append( ( "SET %s = %s" % ( RESULT_VAR % n, func ) ).encode() )
+		stmts.append( b"COMMIT" )
+		stmts.append( ( "SELECT " + ", ".join( [ RESULT_VAR % n for n in range( len( order ) ) ] ) ).encode() )
+		return b"; ".join( stmts )
+
+	def commit( self ):
+		"""
+		提交事务
+		"""
+		assert not self.committed, "unit of work already committed!"
+		self.committed = True
+		if not self.ops:
+			self._on_finished( True, [] )
+			return
+
+		order = self.ordered()
+		cmd = self.build_sql( order )
+		self._notify_writes()
+		#DEBUG_MSG( "%s::commit(), %s" % (self.__class__.__name__, cmd) )
+		KBEngine.executeRawDatabaseCommand( cmd, functools.partial( self._commit_callback, cmd, order ), self.threadID )
+
+	def _notify_writes( self ):
+		"""
+		通知各个EntityModel类的缓存：事务中的记录被修改了
+		"""
+		for op, model_class, model, pk, values, sql, pks in self.ops:
+			model_class.objects._on_write( pks, False, [model] if model is not None and op != OP_DELETE else () )
+
+	def _commit_callback( self, cmd, order, result, rows, insertid, error ):
+		"""
+		事务执行回调
+		"""
+		self._notify_writes()
+		if error is not None:
+			# 失败的语句之后的语句（包括COMMIT）都没有执行，事务仍然打开着
+			ERROR_MSG( "%s::_commit_callback(), execute raw sql '%s' fault!!!; error: %s" % ( self.__class__.__name__, cmd, error ) )
+			KBEngine.executeRawDatabaseCommand( b"ROLLBACK", None, self.threadID )
+			self._on_finished( False, [None] * len( self.ops ) )
+			return
+
+		results = [None] * len( self.ops )
+		counts = result[0] if result and len( result[0] ) == len( order ) else None
+		if counts is not None:
+			for n, i in enumerate( order ):
+				if counts[n] is not None:
+					results[i] = int( counts[n] )
+		else:
+			WARNING_MSG( "%s::_commit_callback(), no per-statement results returned by '%s'" % ( self.__class__.__name__, cmd ) )
+
+		for i, (op, model_class, model, pk, values, sql, pks) in enumerate( self.ops ):
+			if op == OP_INSERT and results[i]:
+				model_class.objects._track_insert_ids( results[i] )
+			if model is None or op == OP_DELETE:
+				continue
+			meta = model_class._meta
+			values = dict( values )
+			if op == OP_INSERT:
+				if not results[i] or not isinstance( meta.fields[meta.primary_name], FieldInteger ):
+					continue
+				setattr( model, meta.primary_name, results[i] )
+				values[meta.primary_name] = results[i]
+			else:
+				values[meta.primary_name] = pk
+			model._mark_synced( values )
+			if meta.identities is not None:
+				meta.identities.put( model )
+
+		self._on_finished( True, results )
+
+	def _on_finished( self, success, results ):
+		"""
+		"""
+		for cb, model in self.callbacks:
+			cb( success, model )
+		if callable( self.callback ):
+			self.callback( success, results )
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""
+延迟写入（write-behind）缓冲区：
+对同一条记录（主键）的多次writeToDB()先在内存中合并，后写入的值覆盖先写入的值，
+到达时间间隔或缓冲的记录数达到上限时，每条记录只发出一条合并后的UPDATE语句。
+写入失败时数据放回缓冲区（期间的新写入覆盖失败的值），下次写入时重试，
+重试Meta.write_behind_retries次仍然失败才回调失败。
+"""
+import functools
+
+import KBEngine
+from KBEDebug import *
+
+
+# 所有已创建的缓冲区，用于服务器关闭时统一写入
+g_buffers = []
+
+def flush_all():
+	"""
+	立即写入所有缓冲区中的数据，一般在服务器关闭前调用
+	"""
+	for buffer in g_buffers:
+		buffer.flush()
+
+
+class WriteBehindBuffer(object):
+	"""
+	某个EntityModel类的延迟写入缓冲区
+	"""
+	def __init__( self, model_class ):
+		"""
+		@param model_class: EntityModel
+		"""
+		self.model = model_class
+		self.meta = model_class._meta
+		self.pending = {}  # key = 主键值; value = [EntityModel, { 属性名 : 值 }, [callback, ...], 已经失败的次数]
+		self.timerID = 0
+		g_buffers.append( self )
+
+	def __len__( self ):
+		return len( self.pending )
+
+	def write( self, model, values, callback = None ):
+		"""
+		缓冲一次对已存在记录的更新
+		@param model: EntityModel; 主键必须有值
+		@param values: dict; { 属性名 : 值 }
+		@param callback: 与EntityModel.writeToDB()的回调相同，在合并后的语句执行完成后回调
+		"""
+		pk = model.get_primary_key_value()
+		entry = self.pending.get( pk )
+		if entry is None:
+			entry = [model, {}, [], 0]
+			self.pending[pk] = entry
+		entry[0] = model
+		entry[1].update( values )
+		if callable( callback ):
+			entry[2].append( callback )
+
+		if len( self.pending ) >= self.meta.write_behind_max_rows:
+			self.flush()
+		elif not self.timerID:
+			self.timerID = KBEngine.addTimer( self.meta.write_behind_interval, 0, self._on_timer )
+
+	def take( self, pk ):
+		"""
+		取出某条记录还未写入的数据，由调用者负责写入并回调
+		@return [EntityModel, { 属性名 : 值 }, [callback, ...], 已经失败的次数] or None
+		"""
+		return self.pending.pop( pk, None )
+
+	def discard( self, pk ):
+		"""
+		放弃某条记录还未写入的数据（例如该记录将被删除），等待中的回调会收到失败通知
+		"""
+		entry = self.take( pk )
+		if entry is None:
+			return
+		model, values, callbacks, failures = entry
+		for callback in callbacks:
+			callback( False, model )
+
+	def flush( self ):
+		"""
+		立即写入缓冲区中的所有数据
+		"""
+		if self.timerID:
+			KBEngine.delTimer( self.timerID )
+			self.timerID = 0
+
+		pending = self.pending
+		self.pending = {}
+		pkName = self.meta.primary_name
+		for pk, (model, values, callbacks, failures) in pending.items():
+			values.pop( pkName, None )
+			synced = dict( values )
+			synced[pkName] = pk
+			qs = self.model.objects.filter( (pkName, pk) )
+			qs._update( functools.partial( self._flush_callback, model, synced, callbacks, failures ), list( values.items() ), [model] )
+
+	def _on_timer( self, timerID ):
+		"""
+		"""
+		self.timerID = 0
+		self.flush()
+
+	def _flush_callback( self, model, values, callbacks, failures, success, rows ):
+		"""
+		合并后的UPDATE语句回调
+		"""
+		if success:
+			model._mark_synced( values )
+			if self.meta.identities is not None:
+				self.meta.identities.put( model )
+		elif failures < self.meta.write_behind_retries:
+			self._requeue( model, values, callbacks, failures + 1 )
+			return
+		else:
+			ERROR_MSG( "%s::_flush_callback(), write %s(%s) fault after %d retries, values dropped: %s" % ( self.__class__.__name__,
+				self.meta.db_table, model.get_primary_key_value(), failures, values ) )
+		for callback in callbacks:
+			callback( success, model )
+
+	def _requeue( self, model, values, callbacks, failures ):
+		"""
+		把写入失败的数据放回缓冲区，之后的写入中已经包含的字段以之后的值为准
+		"""
+		pk = values[self.meta.primary_name]
+		values = dict( values )
+		values.pop( self.meta.primary_name )
+		entry = self.pending.get( pk )
+		if entry is None:
+			self.pending[pk] = [model, values, list( callbacks ), failures]
+		else:
+			values.update( entry[1] )
+			entry[1] = values
+			entry[2][:0] = callbacks
+			entry[3] = max( entry[3], failures )
+		if not self.timerID:
+			self.timerID = KBEngine.addTimer( self.meta.write_behind_interval, 0, self._on_timer )
@@ -65,7 +65,7 @@ TestTable.objects.select(cb, i1__in = (1,3,7))
 # 在范围 1 - 10 之间
 TestTable.objects.select(cb, i1__range = (1, 10))
 
-# xxx ILIKE 'yyy'
+# xxx LIKE 'yyy'
 TestTable.objects.select(cb, sm_s1__iexact = "abc")
 TestTable.objects.select(cb, sm_s1__iexact = None)
 
@@ -85,10 +85,134 @@ m = TestTable(i1 = 12, i2 = 34.0, sm_s1 = "abc", sm_s2 = b"gggtttvvv")
 m.writeToDB(cb)
 m.databaseID
 
+# 再次写入时只更新被修改过的字段：update custom_TestTable set sm_i1 = 13 where id = xxx
+m.i1 = 13
+m.get_dirty_fields()
+m.writeToDB(cb)
+
+# 延迟写入：同一条记录在write_behind_interval秒内的多次writeToDB()只会产生一条update语句
+class TestPlayer( EntityModel ):
+    class Meta:
+        db_table = "custom_TestPlayer"
+        write_behind = True
+        write_behind_interval = 5.0
+
+    databaseID = Fields.INT32( db_column = "id", primary_key = True )
+    gold       = Fields.INT32()
+
+# 服务器关闭前写入所有缓冲区中的数据
+from EntitySimulator import WriteBehind
+WriteBehind.flush_all()
+
+# 事务：rollback; start transaction; ...; commit; select <每条语句的结果>
+from EntitySimulator.UnitOfWork import UnitOfWork
+with UnitOfWork(cb) as uow:
+    uow.save(m)
+    uow.update(TestTable.objects.filter(databaseID = 123), i1 = F("i1") - 10)
+    uow.insert(TestTable, i1 = 10, sm_s1 = "log")
+
+# 计数器：多次累加后合并为一条 update custom_TestTable set sm_i1 = sm_i1 + 3 where id = 123
+TestTable.objects.accumulate(123, i1 = 1)
+TestTable.objects.accumulate(123, i1 = 2)
+from EntitySimulator import Accumulator
+Accumulator.flush_all()
+
+# 定期存档：每个实例每300秒存档一次，存档时间按主键分散在整个周期内，每秒最多50条语句
+from EntitySimulator.SaveScheduler import SaveScheduler
+scheduler = SaveScheduler(period = 300.0, tick = 1.0, budget = 50)
+scheduler.start()
+scheduler.register(m)
+scheduler.flush_all(cb, within = 10.0)  # 服务器关闭时在10秒内写完所有实例
+
+# identity map：在Meta中声明 identity_map = True 后，纯主键的查询直接从缓存返回
+TestPlayer.objects.select(cb, databaseID = 100)
+TestPlayer.objects.select(cb, databaseID__in = (100, 101, 102))
+TestPlayer._meta.identities.stats()  # { "hits" : ..., "misses" : ..., "evictions" : ..., ... }
+
+# 查询结果缓存：在Meta中声明 query_cache_ttl = 60 后，相同的select语句60秒内直接使用缓存的结果，
+# 通过本工具对该表的任何修改都会使缓存失效
+TestTable._meta.query_cache.stats()
+
+# 按主键读取：同一个tick内的所有get()合并为一条 select ... where id in (...)
+def cb2(success, model): g_result.append((success, model))
+TestTable.objects.get(cb2, 100)
+TestTable.objects.get(cb2, 101)
+TestTable.objects.get_many(cb, [100, 102, 103])
+
+# 存在性过滤器：在Meta中声明 existence_filter = "sm_s1" 后，启动时构建过滤器，
+# 之后按sm_s1查询一定不存在的记录时直接返回空结果
+TestTable.objects.build_existence_filter(cb)
+TestTable.objects.select(cb, sm_s1 = "name not exists")
+TestTable._meta.existence.stats()
+
+# 内存表：在Meta中声明 preload = True 后，整个表只加载一次，之后的查询都在内存中完成
+TestTable.objects.reload(cb)
+TestTable.objects.order_by("-i1").limit(0, 10).select(cb, Q(i1__in = (1, 2, 3)) | ~Q(i2__range = (1, 10)))
+
+# 增量变更轮询：在Meta中声明 change_column = "version"（每次修改时递增的字段）后，
+# 定时查询其它进程修改过的记录，更新identity map和内存表，并对每条记录回调
+def onChanged(model):
+	print(model.databaseID, model.version)
+
+TestTable.objects.watch(onChanged)
+
+# 共享内存缓存：同一台机器上一个进程负责写入，其它进程只读，按主键查询时直接从共享内存中读取
+TestTable.objects.attach_shared_cache("/dev/shm/test_table", writer = True)   # 写入进程
+TestTable.objects.attach_shared_cache("/dev/shm/test_table")                  # 其它进程
+TestTable.objects.select(cb, databaseID__in = (1, 2, 3))
+
+# 在Meta中声明 apply_update_locally = True 后，update()成功时在本地计算新值，
+# identity map和内存表中满足过滤条件的实例会被更新，不需要重新查询
+TestTable.objects.filter(i2__gt = 10).update(cb, i1 = (F("i1") + 110) * 2)
+
+# 查询计划缓存：相同结构的查询只生成一次sql模板，之后只对值进行转义并拼接
+from EntitySimulator.QueryPlan import g_plan_cache
+g_plan_cache.stats()   # {"hits" : ..., "misses" : ..., "hit_rate" : ..., "evictions" : ..., "entries" : ...}
+
+# 延迟解码：回调得到的结果在访问某一行、某个字段时才从原始数据转换
+def cbLazy(success, models):
+	print(len(models), models[0].i1)   # 只转换了第一行的i1字段
+
+TestTable.objects.lazy().select(cbLazy, i1__gt = 0)
+
+# 列式查询（需要numpy）：只查询指定的字段，每个字段得到一个numpy数组，数值字段的数组类型由字段类型决定
+def cbColumns(success, columns):
+	print(columns["i1"].sum(), columns["i2"].mean())
+
+TestTable.objects.filter(i1__gt = 0).select_columns(cbColumns, ["i1", "i2"])
+
+# 只查询部分字段，结果不生成实例：select databaseID, sm_s1 from ...
+TestTable.objects.values("databaseID", "sm_s1").select(cb, i1__gt = 0)              # [{"databaseID" : 1, "sm_s1" : "abc"}, ...]
+TestTable.objects.values_list("databaseID", "sm_s1").select(cb, i1__gt = 0)         # [(1, "abc"), ...]
+TestTable.objects.values_list("databaseID", flat = True).select(cb, i1__gt = 0)     # [1, 2, ...]
+
+# 延迟加载：select时不查询很少使用的大字段，需要时再分批加载；writeToDB()不会写入没有加载的字段
+def cbDeferred(success, models):
+	models[0].i1 = 10
+	models[0].writeToDB()                                   # update ... set sm_i1 = 10 where id = ...
+	TestTable.objects.load_deferred(cb, models)             # select id, sm_s1 from ... where id in (...)
+
+TestTable.objects.defer("sm_s1").select(cbDeferred, i1__gt = 0)
+TestTable.objects.only("i1").select(cbDeferred, i1__gt = 0)
+
 TestTable.objects.filter(databaseID = m.id).update(cb, i1 = 1111, sm_s1 = "cba")
 TestTable.objects.filter(databaseID = m.id).update(cb, i1 = F("i1") + 110, sm_s1 = "cba")
 
 # update custom_TestTable set sm_i1 = 220 + sm_i1 + sm_i2 + 110, sm_s1 = "cha" where id = xxx
 TestTable.objects.filter(databaseID = m.id).update(cb, i1 = 220 + F("i1") + F("i2") + 110, sm_s1 = "cba")
 
+# 批量插入：insert into custom_TestTable (...) values (...), (...), ...
+ms = [TestTable(i1 = i, sm_s1 = "abc") for i in range(100)]
+TestTable.objects.bulk_insert(cb, ms)
+TestTable.objects.bulk_insert(cb, [{"i1" : 1, "sm_s1" : "a"}, {"i1" : 2, "sm_s1" : "b"}], batch_size = 500)
+
+# 批量更新与删除：update ... set sm_i1 = case id when ... end where id in (...)
+TestTable.objects.bulk_update(cb, ms, fields = ["i1", "sm_s1"])
+TestTable.objects.bulk_delete(cb, [m.databaseID for m in ms])
+
+# 插入或更新：insert into ... values (...) on duplicate key update sm_i1 = sm_i1 + 1
+def cb3(success, insertid, created): g_result.append((success, insertid, created))
+TestTable.objects.upsert(cb3, databaseID = 100, i1 = 1, update = {"i1" : F("i1") + 1})
+TestTable.objects.get_or_create(cb3, defaults = {"sm_s1" : "abc"}, databaseID = 100)
+
 """
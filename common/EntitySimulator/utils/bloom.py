@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+"""
+Bloom filter：判断一个key“一定不存在”或“可能存在”。
+"""
+import hashlib, math
+
+
+class BloomFilter(object):
+	"""
+	"""
+	def __init__(self, capacity, error_rate = 0.01):
+		"""
+		@param capacity: 预计放入的key的数量
+		@param error_rate: 放入capacity个key时期望的误判率
+		"""
+		assert capacity > 0 and 0 < error_rate < 1
+		self.capacity = capacity
+		self.error_rate = error_rate
+		self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+		self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+		self.bits = bytearray((self.num_bits + 7) // 8)
+		self.count = 0
+
+	def __len__(self):
+		return self.count
+
+	def __contains__(self, key):
+		bits = self.bits
+		for i in self._indexes(key):
+			if not bits[i >> 3] & (1 << (i & 7)):
+				return False
+		return True
+
+	def _indexes(self, key):
+		"""
+		double hashing: h1 + i * h2
+		@param key: bytes
+		"""
+		digest = hashlib.md5(key).digest()
+		h1 = int.from_bytes(digest[:8], "little")
+		h2 = int.from_bytes(digest[8:], "little") | 1
+		m = self.num_bits
+		return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+	def add(self, key):
+		"""
+		@param key: bytes
+		"""
+		bits = self.bits
+		for i in self._indexes(key):
+			bits[i >> 3] |= 1 << (i & 7)
+		self.count += 1
+
+	def memory(self):
+		"""
+		@return int; 位数组占用的字节数
+		"""
+		return len(self.bits)
+
+	def estimated_error_rate(self):
+		"""
+		按当前放入的key的数量估算的误判率
+		"""
+		return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-import datetime
+import datetime, math
 
 from MysqlUtility import process_param
 
@@ -119,6 +119,38 @@ class Expression(Combinable):
 		"""
 		raise NotImplementedError("")
 
+	def evaluate(self, values):
+		"""
+		在本地计算表达式的值，结果与mysql的计算结果一致
+		@param values: dict; { 属性名 : 数据库中的值 }
+		"""
+		raise NotImplementedError("")
+
+
+def _mysql_mod(lhs, rhs):
+	"""
+	mysql的MOD：结果的符号与被除数相同
+	"""
+	r = math.fmod(lhs, rhs) if isinstance(lhs, float) or isinstance(rhs, float) else abs(lhs) % abs(rhs) * (1 if lhs >= 0 else -1)
+	return r
+
+def _mysql_bitop(op):
+	"""
+	mysql的位运算是64位无符号整数运算，负数无法在本地得到相同的结果
+	"""
+	def f(lhs, rhs):
+		if not isinstance(lhs, int) or not isinstance(rhs, int) or lhs < 0 or rhs < 0:
+			raise ValueError("unsupported bit operation: %r, %r" % (lhs, rhs))
+		return op(lhs, rhs)
+	return f
+
+def _mysql_div(lhs, rhs):
+	"""
+	mysql中整数相除的结果是按div_precision_increment舍入的DECIMAL（7 / 3 = 2.3333），除以0的结果为NULL，
+	都不能在本地计算
+	"""
+	raise ValueError("division can not be evaluated locally: %r / %r" % (lhs, rhs))
+
 
 class CombinedExpression(Expression):
 
@@ -140,10 +172,32 @@ class CombinedExpression(Expression):
 	def set_source_expressions(self, exprs):
 		self.lhs, self.rhs = exprs
 
+	# 注意：mysql中的"^"是按位异或
+	operators = {
+		Combinable.ADD    : lambda lhs, rhs : lhs + rhs,
+		Combinable.SUB    : lambda lhs, rhs : lhs - rhs,
+		Combinable.MUL    : lambda lhs, rhs : lhs * rhs,
+		Combinable.DIV    : _mysql_div,
+		Combinable.MOD    : _mysql_mod,
+		Combinable.POW    : _mysql_bitop(lambda lhs, rhs : lhs ^ rhs),
+		Combinable.BITAND : _mysql_bitop(lambda lhs, rhs : lhs & rhs),
+		Combinable.BITOR  : _mysql_bitop(lambda lhs, rhs : lhs | rhs),
+	}
+
 	def resolve_expression(self, metaClass):
+		# 加上括号，使sql中的计算顺序与表达式树一致
 		lhs = self.lhs.resolve_expression(metaClass)
+		if isinstance(self.lhs, CombinedExpression):
+			lhs = "(" + lhs + ")"
 		rhs = self.rhs.resolve_expression(metaClass)
-		return " ".join((lhs, self.connector, rhs))
+		if isinstance(self.rhs, CombinedExpression):
+			rhs = "(" + rhs + ")"
+		# 生成的语句中"%%"不会被还原为"%"，取模使用MOD运算符
+		connector = "MOD" if self.connector == Combinable.MOD else self.connector
+		return " ".join((lhs, connector, rhs))
+
+	def evaluate(self, values):
+		return self.operators[self.connector](self.lhs.evaluate(values), self.rhs.evaluate(values))
 
 
 class F(Combinable):
@@ -163,6 +217,8 @@ class F(Combinable):
 	def resolve_expression(self, metaClass):
 		return metaClass.fields[self.name].db_column
 
+	def evaluate(self, values):
+		return values[self.name]
 
 
 class Value(Expression):
@@ -184,4 +240,7 @@ class Value(Expression):
 	def resolve_expression(self, metaClass):
 		return process_param(self.value).decode()
 
+	def evaluate(self, values):
+		return self.value
+
 
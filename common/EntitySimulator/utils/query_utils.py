@@ -3,10 +3,48 @@
 """
 Various data structures used in query construction.
 """
+import unicodedata
+
 from .tree import Node
 
 from MysqlUtility import process_param
 
+
+def collation_key(value):
+	"""
+	近似mysql默认的_ci排序规则下字符串的比较键：忽略大小写、重音（以及全角半角等兼容字符的差异）和末尾空格；
+	比较键相同而字符串不同时，结果取决于实际使用的排序规则
+	"""
+	value = unicodedata.normalize("NFKD", value.rstrip(" "))
+	return "".join([c for c in value if not unicodedata.combining(c)]).casefold()
+
+def _equals(lv, rv):
+	"""
+	按mysql的规则比较两个值是否相等
+	@return True/False，无法确定（例如字符串只有大小写、重音或末尾空格不同，结果取决于排序规则）时返回None
+	"""
+	if isinstance(lv, str) and isinstance(rv, str):
+		if lv == rv:
+			return True
+		if collation_key(lv) == collation_key(rv):
+			return None
+		return False
+	if isinstance(lv, (int, float)) and isinstance(rv, (int, float)):
+		return lv == rv
+	if isinstance(lv, bytes) and isinstance(rv, bytes):
+		return lv == rv
+	return None
+
+def _compare(lv, rv):
+	"""
+	按mysql的规则比较两个值的大小
+	@return -1/0/1，无法确定（例如字符串的大小取决于排序规则）时返回None
+	"""
+	if isinstance(lv, (int, float)) and isinstance(rv, (int, float)) or isinstance(lv, bytes) and isinstance(rv, bytes):
+		return (lv > rv) - (lv < rv)
+	return None
+
+
 class ExpressionBase(object):
 	"""
 	sql表达式生成器
@@ -14,31 +52,90 @@ class ExpressionBase(object):
 	OPT = b""
 	
 	def __call__(self, lh, rh):
-		return b" ".join((lh, self.OPT, process_param(rh)))
+		prefix, escape = self.split(lh)
+		return prefix + escape(rh)
+
+	def split(self, lh):
+		"""
+		把表达式拆分为与值无关的前缀和对值进行转义的函数，用于生成查询模板（见QueryPlan.py）
+		@return (bytes, function); prefix + escape(rh)即为完整的表达式
+		"""
+		return b" ".join((lh, self.OPT, b"")), self.escape
+
+	def escape(self, rh):
+		"""
+		"""
+		return process_param(rh)
+
+	def compare(self, c):
+		"""
+		"""
+		raise NotImplementedError
+
+	def match(self, lv, rv):
+		"""
+		在本地计算条件是否成立
+		@param lv: 字段在数据库中的值
+		@param rv: 条件中的值
+		@return True/False，无法确定时返回None
+		"""
+		c = _compare(lv, rv)
+		if c is None:
+			return None
+		return self.compare(c)
 
 class Expression_exact(ExpressionBase):
 	OPT = b"="
 
+	def match(self, lv, rv):
+		return _equals(lv, rv)
+
 class Expression_gt(ExpressionBase):
 	OPT = b">"
 
+	def compare(self, c):
+		return c > 0
+
 class Expression_gte(ExpressionBase):
 	OPT = b">="
 
+	def compare(self, c):
+		return c >= 0
+
 class Expression_lt(ExpressionBase):
 	OPT = b"<"
 
+	def compare(self, c):
+		return c < 0
+
 class Expression_lte(ExpressionBase):
 	OPT = b"<="
 
+	def compare(self, c):
+		return c <= 0
+
 
 class Expression_iexact(ExpressionBase):
-	OPT = b"ILIKE"
+	"""
+	xxx LIKE 'yyy'（不区分大小写取决于字段的排序规则）/xxx IS NULL
+	mysql不支持ILIKE；值中的%、_按普通字符匹配
+	"""
+	OPT = b"LIKE"
 
-	def __call__(self, lh, rh):
+	def split(self, lh):
+		return lh + b" ", self.escape
+
+	def escape(self, rh):
 		if rh is None:
-			return b" ".join((lh, "IS NULL"))
-		return b" ".join((lh, self.OPT, process_param(rh)))
+			return b"IS NULL"
+		if isinstance(rh, str):
+			rh = rh.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+		return self.OPT + b" " + process_param(rh)
+
+	def match(self, lv, rv):
+		if isinstance(lv, str) and isinstance(rv, str):
+			return lv.rstrip(" ").lower() == rv.rstrip(" ").lower()
+		return None
 
 class Expression_in(ExpressionBase):
 	"""
@@ -46,10 +143,19 @@ class Expression_in(ExpressionBase):
 	"""
 	OPT = b"IN"
 
-	def __call__(self, lh, rh):
+	def escape(self, rh):
 		vs = [ process_param(ve) for ve in rh ]
-		rhV = b'(' + b", ".join( vs ) + b')'
-		return b" ".join((lh, self.OPT, rhV))
+		return b'(' + b", ".join( vs ) + b')'
+
+	def match(self, lv, rv):
+		result = False
+		for v in rv:
+			r = _equals(lv, v)
+			if r:
+				return True
+			if r is None:
+				result = None
+		return result
 
 class Expression_isnull(ExpressionBase):
 	"""
@@ -57,19 +163,31 @@ class Expression_isnull(ExpressionBase):
 	"""
 	OPT = (b'IS NOT NULL', b'IS NULL')
 
-	def __call__(self, lh, rh):
-		return b" ".join((lh, self.OPT[int(bool(rh))]))
+	def split(self, lh):
+		return lh + b" ", self.escape
+
+	def escape(self, rh):
+		return self.OPT[int(bool(rh))]
+
+	def match(self, lv, rv):
+		# 从数据库读取到的NULL已经被转换为默认值，无法在本地判断
+		return None
 
 class Expression_range(ExpressionBase):
 	"""
 	xxx BETWEEN 1 AND 10
 	"""
-	OPT = (b'BETWEEN %s AND %s')
+	OPT = b"BETWEEN"
 
-	def __call__(self, lh, rh):
-		f = process_param(rh[0])
-		s = process_param(rh[1])
-		return b" ".join((lh, b"BETWEEN", f, b"AND", s))
+	def escape(self, rh):
+		return process_param(rh[0]) + b" AND " + process_param(rh[1])
+
+	def match(self, lv, rv):
+		lo = _compare(lv, rv[0])
+		hi = _compare(lv, rv[1])
+		if lo is None or hi is None:
+			return None
+		return lo >= 0 and hi <= 0
 
 
 class Q(Node):
@@ -126,6 +244,17 @@ class Q(Node):
 		obj.negate()
 		return obj
 
+	def split_lookup(self, k):
+		"""
+		@return (属性名, ExpressionBase)
+		"""
+		sv = k.rsplit("__", 1)
+		if len(sv) == 1:
+			ops = "exact"
+		else:
+			ops = sv[1]
+		return sv[0], self.operators[ops]
+
 	def as_sql(self, metaClass):
 		"""
 		@return: bytes
@@ -133,16 +262,10 @@ class Q(Node):
 		r = []
 		for q in self.children:
 			if isinstance(q, Q):
-				r.append(q.metaClass(metaClass))
+				r.append(q.as_sql(metaClass))
 			else:
 				k, v = q
-				sv = k.rsplit("__", 1)
-				if len(sv) == 1:
-					ops = "exact"
-				else:
-					ops = sv[1]
-				lh = sv[0]
-				op = self.operators[ops]
+				lh, op = self.split_lookup(k)
 				r.append(op(metaClass.fields[lh].db_column.encode(), v))
 		
 		c = " %s " % self.connector
@@ -154,6 +277,79 @@ class Q(Node):
 			neg = b""
 		return neg + b" ( " + result + b" )"
 
+	def shape(self):
+		"""
+		@return tuple; 条件的结构（不包括值），结构相同的条件生成的sql只有值不同
+		"""
+		return (self.connector, self.negated, tuple([ q.shape() if isinstance(q, Q) else q[0] for q in self.children ]))
+
+	def compile(self, metaClass, parts):
+		"""
+		把条件编译为查询模板，结果与as_sql()一致
+		@param parts: list; 依次追加bytes以及对值进行转义的函数，转义函数的顺序与values()的顺序一致
+		"""
+		parts.append((b"NOT" if self.negated else b"") + b" ( ")
+		c = (" %s " % self.connector).encode()
+		for i, q in enumerate(self.children):
+			if i:
+				parts.append(c)
+			if isinstance(q, Q):
+				q.compile(metaClass, parts)
+			else:
+				lh, op = self.split_lookup(q[0])
+				prefix, escape = op.split(metaClass.fields[lh].db_column.encode())
+				parts.append(prefix)
+				parts.append(escape)
+		parts.append(b" )")
+
+	def values(self, out):
+		"""
+		按compile()中转义函数的顺序收集条件中的值
+		"""
+		for q in self.children:
+			if isinstance(q, Q):
+				q.values(out)
+			else:
+				out.append(q[1])
+
+	def matches(self, values):
+		"""
+		在本地计算条件是否成立，与as_sql()生成的条件在数据库中的结果一致
+		@param values: dict; { 属性名 : 数据库中的值 }
+		@return True/False，无法确定时返回None
+		"""
+		result = self.connector == self.AND
+		for q in self.children:
+			if isinstance(q, Q):
+				r = q.matches(values)
+			else:
+				k, v = q
+				sv = k.rsplit("__", 1)
+				if len(sv) == 1 or sv[1] not in self.operators:
+					ops, lh = "exact", k
+				else:
+					ops, lh = sv[1], sv[0]
+				if lh not in values:
+					return None
+				r = self.operators[ops].match(values[lh], v)
+
+			if self.connector == self.AND:
+				if r is False:
+					result = False
+					break
+				if r is None:
+					result = None
+			else:
+				if r:
+					result = True
+					break
+				if r is None:
+					result = None
+
+		if self.negated and result is not None:
+			result = not result
+		return result
+
 
 
 
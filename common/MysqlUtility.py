@@ -5,64 +5,130 @@
 # MySQL Connector/Python - MySQL driver written in Python.
 # Copyright (c) 2009, 2013, Oracle and/or its affiliates. All rights reserved.
 
+参数的转义按类型直接生成带引号的结果（一次完成MySQLConverter的to_mysql、escape、quote三个步骤），
+结果与MySQLConverter逐字节一致；不常用的类型仍然交给MySQLConverter处理。
+不同版本的mysql-connector对部分值的处理不同（例如2.1.x把nan转换为nan，8.0以后转换为NULL），
+这些值总是交给MySQLConverter处理；模块加载时还会用一组样本值与已安装的MySQLConverter对比（见_verify_escapers()），
+结果不一致的类型也交给MySQLConverter处理。
 """
-import re
+import datetime, decimal
 
 from mysql.connector.conversion import (MySQLConverterBase, MySQLConverter)
 
-RE_PY_PARAM = re.compile(b'(%s)')
-
 g_converter = MySQLConverter( "utf8", True )
 
 
+def _escape_bytes( value ):
+	"""
+	与MySQLConverter.escape()转义的字符相同；bytes.replace()在没有需要转义的字符时几乎没有开销
+	"""
+	value = value.replace( b"\\", b"\\\\" ).replace( b"\n", b"\\n" ).replace( b"\r", b"\\r" )
+	value = value.replace( b"'", b"\\'" ).replace( b'"', b'\\"' ).replace( b"\032", b"\\\032" )
+	return b"'" + value + b"'"
+
+def _escape_str( value ):
+	return _escape_bytes( value.encode( "utf-8" ) )
+
+def _escape_int( value ):
+	return str( value ).encode( "ascii" )
+
+def _escape_bool( value ):
+	return b"1" if value else b"0"
+
+def _escape_float( value ):
+	if value != value:  # nan：不同版本的结果不同
+		return _escape_other( value )
+	return str( value ).encode( "ascii" )
+
+def _escape_none( value ):
+	return b"NULL"
+
+def _escape_decimal( value ):
+	return b"'" + str( value ).encode( "ascii" ) + b"'"
 
-class _ParamSubstitutor(object):
+def _escape_datetime( value ):
+	if value.year < 1000:  # 不同版本的年份是否补0不同
+		return _escape_other( value )
+	if value.microsecond:
+		s = "'%04d-%02d-%02d %02d:%02d:%02d.%06d'" % ( value.year, value.month, value.day, value.hour, value.minute, value.second, value.microsecond )
+	else:
+		s = "'%04d-%02d-%02d %02d:%02d:%02d'" % ( value.year, value.month, value.day, value.hour, value.minute, value.second )
+	return s.encode( "ascii" )
+
+def _escape_date( value ):
+	if value.year < 1000:
+		return _escape_other( value )
+	return ( "'%04d-%02d-%02d'" % ( value.year, value.month, value.day ) ).encode( "ascii" )
+
+def _escape_other( value ):
+	"""
+	其它类型（time、timedelta等）仍然使用MySQLConverter
+	"""
+	res = g_converter.to_mysql( value )
+	res = g_converter.escape( res )
+	res = g_converter.quote( res )
+	return bytes( res )
+
+# 按类型（不包括子类，与MySQLConverter按类名转换一致）直接生成带引号的结果
+_ESCAPERS = {
+	str                : _escape_str,
+	bytes              : _escape_bytes,
+	bytearray          : _escape_bytes,
+	int                : _escape_int,
+	bool               : _escape_bool,
+	float              : _escape_float,
+	type( None )       : _escape_none,
+	decimal.Decimal    : _escape_decimal,
+	datetime.datetime  : _escape_datetime,
+	datetime.date      : _escape_date,
+}
+
+# 与已安装的MySQLConverter对比的样本值
+_SAMPLES = {
+	str                : [ "", "abc", "\\\n\r'\"\032\x00\t%s", "中文é" ],
+	bytes              : [ b"", b"abc", b"\\\n\r'\"\032\x00\t%s", bytes( range( 256 ) ) ],
+	bytearray          : [ bytearray( b"a'b\\" ) ],
+	int                : [ 0, -1, 2**63 - 1, -2**63, 2**70 ],
+	bool               : [ True, False ],
+	float              : [ 0.0, -0.0, 1.5, -1e20, 1e-7, 1.0 / 3, float( "inf" ), float( "-inf" ) ],
+	type( None )       : [ None ],
+	decimal.Decimal    : [ decimal.Decimal( "1.50" ), decimal.Decimal( "-1E+3" ), decimal.Decimal( "0.000001" ) ],
+	datetime.datetime  : [ datetime.datetime( 2020, 1, 2, 3, 4, 5 ), datetime.datetime( 2020, 1, 2, 3, 4, 5, 6 ) ],
+	datetime.date      : [ datetime.date( 2021, 12, 31 ) ],
+}
+
+def _verify_escapers():
 	"""
-	Substitutes parameters into SQL statement.
+	结果与已安装的MySQLConverter不一致的类型不再使用快速转义
 	"""
-	def __init__(self, params):
-		self.params = params
-		self.index = 0
+	for t, samples in _SAMPLES.items():
+		for value in samples:
+			try:
+				same = _ESCAPERS[t]( value ) == _escape_other( value )
+			except Exception:
+				same = False
+			if not same:
+				del _ESCAPERS[t]
+				break
 
-	def __call__(self, matchobj):
-		index = self.index
-		self.index += 1
-		return self.params[index]
+_verify_escapers()
 
-	@property
-	def remaining(self):
-		"""Returns number of parameters remaining to be substituted"""
-		return len(self.params) - self.index
 
 def process_params_dict( params ):
 	"""Process query parameters given as dictionary"""
 	res = {}
 	for key, value in list(params.items()):
-		conv = value
-		conv = g_converter.to_mysql(conv)
-		conv = g_converter.escape(conv)
-		conv = g_converter.quote(conv)
-		res["%({})s".format(key).encode()] = conv
+		res["%({})s".format(key).encode()] = process_param( value )
 	return res
 
 def process_params( params ):
 	"""Process query parameters."""
-	res = params
-
-	res = [g_converter.to_mysql(i) for i in res]
-	res = [g_converter.escape(i) for i in res]
-	res = [g_converter.quote(i) for i in res]
-	return tuple(res)
+	get = _ESCAPERS.get
+	return tuple([ get( p.__class__, _escape_other )( p ) for p in params ])
 
 def process_param( param ):
 	"""Process query parameter."""
-	res = param
-
-	res = g_converter.to_mysql(res)
-	res = g_converter.escape(res)
-	res = g_converter.quote(res)
-	return res
-
+	return _ESCAPERS.get( param.__class__, _escape_other )( param )
 
 def makeSafeSql(operation, params = None):
 	"""convert the given operation and parames to safe sql command.
@@ -87,9 +153,13 @@ def makeSafeSql(operation, params = None):
 			for key, value in process_params_dict(params).items():
 				stmt = stmt.replace(key, value, 1)
 		elif isinstance(params, (list, tuple)):
-			psub = _ParamSubstitutor(process_params(params))
-			stmt = RE_PY_PARAM.sub(psub, stmt)
-			if psub.remaining != 0:
+			parts = stmt.split(b"%s")
+			if len(parts) - 1 != len(params):
 				raise Exception("Not all parameters were used in the SQL statement")
+			r = [parts[0]]
+			for value, part in zip(process_params(params), parts[1:]):
+				r.append(value)
+				r.append(part)
+			stmt = b"".join(r)
 
 	return stmt
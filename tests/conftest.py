@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+"""
+测试在KBEngine进程之外运行：common目录加入sys.path，KBEngine、KBEDebug使用tests/stubs中的测试替身。
+EntitySimulator依赖mysql-connector-python（MysqlUtility.py），没有安装时跳过所有测试。
+"""
+import os, sys
+
+import pytest
+
+HERE = os.path.dirname( os.path.abspath( __file__ ) )
+sys.path.insert( 0, os.path.join( HERE, "stubs" ) )
+sys.path.insert( 0, os.path.join( HERE, "..", "common" ) )
+
+try:
+	import mysql.connector
+except ImportError:
+	collect_ignore_glob = [ "test_*.py" ]
+
+
+@pytest.fixture( autouse = True )
+def kbengine():
+	"""
+	每个测试开始前丢弃上一个测试留下的命令、定时器、日志以及正在执行的查询
+	"""
+	import KBEngine, KBEDebug
+	from EntitySimulator import Query
+	KBEngine.reset()
+	del KBEDebug.messages[:]
+	Query.g_inflight_selects.clear()
+	yield KBEngine
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+
+"""
+测试用的KBEDebug模块：日志保存在messages中，便于测试检查错误是否被记录
+"""
+
+messages = []  # [ (级别, 内容), ... ]
+
+
+def DEBUG_MSG( msg ):
+	messages.append( ( "DEBUG", msg ) )
+
+def INFO_MSG( msg ):
+	messages.append( ( "INFO", msg ) )
+
+def WARNING_MSG( msg ):
+	messages.append( ( "WARNING", msg ) )
+
+def ERROR_MSG( msg ):
+	messages.append( ( "ERROR", msg ) )
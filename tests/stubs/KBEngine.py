@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+"""
+测试用的KBEngine模块：数据库命令和定时器只是被记录下来，由测试决定何时、以什么结果回调。
+"""
+
+commands = []  # [ (sql, callback, threadID), ... ]; 已发出但还没有回调的数据库命令
+timers = {}    # key = timerID; value = (initialOffset, repeatOffset, callback)
+_nextTimerID = [0]
+
+
+def executeRawDatabaseCommand( cmd, callback = None, threadID = -1 ):
+	commands.append( ( cmd, callback, threadID ) )
+
+def addTimer( initialOffset, repeatOffset, callback ):
+	_nextTimerID[0] += 1
+	timers[_nextTimerID[0]] = ( initialOffset, repeatOffset, callback )
+	return _nextTimerID[0]
+
+def delTimer( timerID ):
+	timers.pop( timerID, None )
+
+
+def reset():
+	"""
+	丢弃所有命令和定时器
+	"""
+	del commands[:]
+	timers.clear()
+
+def reply( index = 0, result = (), rows = 0, insertid = 0, error = None ):
+	"""
+	让第index条等待中的命令返回
+	@param result: list of list of bytes; 与dbmgr返回的格式相同
+	@return bytes; 该命令的sql语句
+	"""
+	cmd, callback, threadID = commands.pop( index )
+	if callable( callback ):
+		callback( [ list( row ) for row in result ], rows, insertid, error )
+	return cmd
+
+def fire_timers():
+	"""
+	触发当前所有的定时器（一次性的定时器触发后删除）
+	"""
+	for timerID, ( initialOffset, repeatOffset, callback ) in list( timers.items() ):
+		if not repeatOffset:
+			timers.pop( timerID, None )
+		callback( timerID )
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+"""
+DeltaAccumulator：合并增量、写入失败时增量合并回累加器、超过重试次数后丢弃
+"""
+import unittest
+
+import KBEngine
+import KBEDebug
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator import Fields
+
+
+class CounterItem( EntityModel ):
+	class Meta:
+		db_table = "test_counter_item"
+		accumulate_retries = 1
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	kills      = Fields.INT32()
+	gold       = Fields.INT32()
+
+
+class AccumulatorTest(unittest.TestCase):
+	"""
+	"""
+	def setUp( self ):
+		accumulator = getattr( CounterItem._meta, "accumulator", None )
+		if accumulator is not None:
+			accumulator.pending.clear()
+			accumulator.failures.clear()
+			accumulator.timerID = 0
+
+	def test_merged( self ):
+		CounterItem.objects.accumulate( 1, kills = 1 )
+		CounterItem.objects.accumulate( 1, kills = 2, gold = -5 )
+		KBEngine.fire_timers()
+		cmd = KBEngine.reply( rows = 1 )
+		self.assertIn( b"kills = kills + 3", cmd )
+		self.assertIn( b"gold = gold + -5", cmd )
+
+	def test_merged_back_on_failure( self ):
+		CounterItem.objects.accumulate( 1, kills = 1 )
+		KBEngine.fire_timers()
+		CounterItem.objects.accumulate( 1, kills = 2 )
+		KBEngine.reply( error = "Lock wait timeout" )
+		KBEngine.fire_timers()
+		cmd = KBEngine.reply( rows = 1 )
+		self.assertIn( b"kills = kills + 3", cmd )
+		self.assertEqual( CounterItem._meta.accumulator.failures, {} )
+
+	def test_dropped_after_retries( self ):
+		CounterItem.objects.accumulate( 1, kills = 1 )
+		for i in range( 2 ):
+			KBEngine.fire_timers()
+			KBEngine.reply( error = "Lock wait timeout" )
+		self.assertEqual( len( CounterItem._meta.accumulator ), 0 )
+		self.assertEqual( KBEngine.timers, {} )
+		self.assertTrue( any( "lost deltas" in msg for level, msg in KBEDebug.messages ) )
+
+
+if __name__ == "__main__":
+	unittest.main()
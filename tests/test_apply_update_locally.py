@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""
+Meta.apply_update_locally：update()成功后在本地计算新值，更新identity map和内存表，无法在本地确定结果时使它们失效
+"""
+import unittest
+
+import KBEngine
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator.utils.expressions import F
+from EntitySimulator import Fields
+
+
+class LocalItem( EntityModel ):
+	class Meta:
+		db_table = "test_local_item"
+		identity_map = True
+		preload = True
+		apply_update_locally = True
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	i1         = Fields.INT32( db_column = "sm_i1" )
+	f1         = Fields.FLOAT( db_column = "sm_f1" )
+
+
+def row( pk, i1, f1 = 0.5 ):
+	return [ str( pk ).encode(), str( i1 ).encode(), str( f1 ).encode() ]
+
+
+class ApplyUpdateLocallyTest(unittest.TestCase):
+	"""
+	"""
+	def setUp( self ):
+		self.table = LocalItem._meta.memory_table
+		self.identities = LocalItem._meta.identities
+		self.identities.clear()
+		self.table.invalidate()
+
+	def load( self, rows ):
+		self.table.reload()
+		KBEngine.reply( result = rows )
+		self.assertTrue( self.table.ready )
+		for values in self.table.rows:
+			self.identities.put( LocalItem.from_values( values ) )
+
+	def update( self, qs, **kwargs ):
+		results = []
+		qs.update( lambda success, rows : results.append( success ), **kwargs )
+		KBEngine.reply( len( KBEngine.commands ) - 1, rows = 1 )
+		self.assertEqual( results, [True] )
+
+	def test_apply_to_filtered_keys( self ):
+		self.load( [ row( 1, 5 ), row( 2, 6 ) ] )
+		self.update( LocalItem.objects.filter( databaseID = 1 ), i1 = F( "i1" ) + 2 )
+		self.assertTrue( self.table.ready )
+		self.assertEqual( [ r["i1"] for r in self.table.rows ], [7, 6] )
+		self.assertEqual( self.identities.get( 1 ).i1, 7 )
+		self.assertFalse( self.identities.get( 1 ).is_dirty() )
+
+	def test_apply_by_filter( self ):
+		self.load( [ row( 1, 5 ), row( 2, 6 ) ] )
+		self.update( LocalItem.objects.filter( i1__gte = 6 ), i1 = 0 )
+		self.assertEqual( [ r["i1"] for r in self.table.rows ], [5, 0] )
+		self.assertEqual( self.identities.get( 2 ).i1, 0 )
+
+	def test_update_while_reloading( self ):
+		self.table.reload()
+		self.update( LocalItem.objects.filter( databaseID = 1 ), i1 = 9 )
+		# 修改之前发出的加载在修改完成之后才返回
+		KBEngine.reply( result = [ row( 1, 5 ) ] )
+		self.assertFalse( self.table.ready )
+
+	def test_reload_during_update( self ):
+		self.load( [ row( 1, 5 ) ] )
+		LocalItem.objects.filter( databaseID = 1 ).update( None, i1 = F( "i1" ) + 1 )
+		# 修改期间重新加载，加载的数据可能已经包含这次修改
+		self.table.reload()
+		KBEngine.reply( 1, result = [ row( 1, 6 ) ] )
+		KBEngine.reply( 0, rows = 1 )
+		self.assertFalse( self.table.ready )
+
+	def test_division_not_applied( self ):
+		self.load( [ row( 1, 7 ) ] )
+		self.update( LocalItem.objects.filter( databaseID = 1 ), i1 = F( "i1" ) / 3 )
+		# mysql的结果取决于div_precision_increment，只能使缓存失效
+		self.assertFalse( self.table.ready )
+		self.assertNotIn( 1, self.identities )
+
+	def test_float_target_not_applied( self ):
+		self.load( [ row( 1, 7 ) ] )
+		self.update( LocalItem.objects.filter( databaseID = 1 ), f1 = F( "f1" ) + 0.1 )
+		self.assertFalse( self.table.ready )
+		self.assertNotIn( 1, self.identities )
+
+	def test_integer_arithmetic_applied( self ):
+		self.load( [ row( 1, -7 ) ] )
+		self.update( LocalItem.objects.filter( databaseID = 1 ), i1 = F( "i1" ) % 3 * 2 )
+		self.assertTrue( self.table.ready )
+		self.assertEqual( self.table.rows[0]["i1"], -2 )
+		self.assertEqual( self.identities.get( 1 ).i1, -2 )
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+"""
+bulk_update：写入成功后实例（包括主键）与数据库同步
+"""
+import unittest
+
+import KBEngine
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator import Fields
+
+
+class BulkItem( EntityModel ):
+	class Meta:
+		db_table = "test_bulk_item"
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	level      = Fields.INT32()
+
+
+class BulkUpdateTest(unittest.TestCase):
+	"""
+	"""
+	def test_synced_after_update( self ):
+		ms = [ BulkItem( databaseID = 1, level = 5 ), BulkItem( databaseID = 2, level = 6 ) ]
+		self.assertTrue( ms[0].is_dirty() )
+		results = []
+		BulkItem.objects.bulk_update( lambda *args : results.append( args ), ms )
+		cmd = KBEngine.reply( rows = 2 )
+		self.assertIn( b"CASE id WHEN 1 THEN 5 WHEN 2 THEN 6 END", cmd )
+		self.assertEqual( results, [ ( True, 2 ) ] )
+		for m in ms:
+			self.assertFalse( m.is_dirty() )
+
+	def test_failed_update_stays_dirty( self ):
+		m = BulkItem( databaseID = 1, level = 5 )
+		BulkItem.objects.bulk_update( None, [ m ] )
+		KBEngine.reply( error = "Lock wait timeout" )
+		self.assertEqual( m.get_dirty_fields(), { "databaseID" : 1, "level" : 5 } )
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""
+Codec：生成的解码函数与逐个字段调用Field.to_python()的结果一致，编码函数与MysqlUtility.process_params()的结果一致
+"""
+import unittest
+
+import KBEngine
+import MysqlUtility
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator import Fields
+
+
+class UpperUnicode( Fields.UNICODE ):
+	def to_python( self, value ):
+		return super( UpperUnicode, self ).to_python( value ).upper()
+
+
+class CodecItem( EntityModel ):
+	class Meta:
+		db_table = "test_codec_item"
+
+	databaseID = Fields.UINT64( db_column = "id", primary_key = True )
+	name       = Fields.UNICODE()
+	level      = Fields.INT8()
+	hp         = Fields.FLOAT()
+	data       = Fields.BLOB()
+	tag        = UpperUnicode()
+
+
+class InitItem( EntityModel ):
+	class Meta:
+		db_table = "test_codec_init"
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	level      = Fields.INT32()
+
+	def __init__( self, **kwargs ):
+		super( InitItem, self ).__init__( **kwargs )
+		self.buffs = []
+
+
+ATTRS = [ "databaseID", "name", "level", "hp", "data", "tag" ]
+
+ROWS = [
+	[ b"1", "名字".encode( "utf-8" ), b"-3", b"1.5", b"\x00\xff", b"vip" ],
+	[ b"18446744073709551615", b"", b"0", b"-0.25", b"", b"" ],
+	[ None, None, None, None, None, None ],
+]
+
+
+def generic_decode( cls, attrs, row ):
+	fields = cls._meta.fields
+	return { k : fields[k].to_python( row[i] ) for i, k in enumerate( attrs ) }
+
+def generic_encode( m ):
+	return b", ".join( MysqlUtility.process_params( [ getattr( m, k ) for k in m._meta.insert_attrs ] ) )
+
+
+class CodecTest(unittest.TestCase):
+	"""
+	"""
+	def test_decoder_matches_to_python( self ):
+		for row in ROWS:
+			m = CodecItem.from_db( ATTRS, row )
+			expected = generic_decode( CodecItem, ATTRS, row )
+			self.assertEqual( { k : getattr( m, k ) for k in ATTRS }, expected )
+			self.assertEqual( { k : type( getattr( m, k ) ) for k in ATTRS }, { k : type( v ) for k, v in expected.items() } )
+			self.assertFalse( m.is_dirty() )
+
+	def test_missing_fields_use_default( self ):
+		m = CodecItem.from_db( [ "databaseID", "level" ], [ b"2", b"7" ] )
+		fields = CodecItem._meta.fields
+		for k in ( "name", "hp", "data", "tag" ):
+			self.assertEqual( getattr( m, k ), fields[k].default_value() )
+		self.assertEqual( m.get_db_snapshot(), { "databaseID" : 2, "level" : 7 } )
+
+	def test_overridden_init_called( self ):
+		m = InitItem.from_db( [ "databaseID", "level" ], [ b"3", b"4" ] )
+		self.assertEqual( m.buffs, [] )
+		self.assertEqual( ( m.databaseID, m.level ), ( 3, 4 ) )
+		self.assertFalse( m.is_dirty() )
+
+	def test_encoder_matches_process_params( self ):
+		models = [ CodecItem.from_db( ATTRS, row ) for row in ROWS ]
+		# 值的类型与字段类型不一致时走通用的转义
+		models.append( CodecItem( name = "it's \\ %", level = True, hp = 2, data = bytearray( b"'" ), tag = None ) )
+		for m in models:
+			self.assertEqual( CodecItem._meta.encoder( m ), generic_encode( m ) )
+
+	def test_insert_model_sql( self ):
+		m = CodecItem( name = "a'b", level = 5, hp = 0.5, data = b"x", tag = "T" )
+		CodecItem.objects.insert_model( None, m )
+		cmd = KBEngine.reply( insertid = 1 )
+		self.assertTrue( cmd.startswith( CodecItem._meta.insert_head ) )
+		self.assertTrue( cmd.endswith( b"( " + generic_encode( m ) + b" )" ) )
+		self.assertEqual( CodecItem._meta.insert_head, b"INSERT INTO test_codec_item ( name, level, hp, data, tag ) VALUES " )
+
+
+if __name__ == "__main__":
+	unittest.main()
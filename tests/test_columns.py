@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+"""
+select_columns：按列转换为numpy数组、NULL被屏蔽、无法转换的值使查询失败
+"""
+import unittest
+
+import KBEngine
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator import Columns, Fields
+
+
+class ColumnItem( EntityModel ):
+	class Meta:
+		db_table = "test_column_item"
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	level      = Fields.INT8()
+	score      = Fields.DOUBLE()
+	name       = Fields.UNICODE()
+
+
+@unittest.skipIf( Columns.numpy is None, "numpy is not installed" )
+class ColumnsTest(unittest.TestCase):
+	"""
+	"""
+	def select( self, rows ):
+		results = []
+		ColumnItem.objects.select_columns( lambda *args : results.append( args ), [ "level", "score", "name" ] )
+		KBEngine.reply( result = rows )
+		return results[0]
+
+	def test_arrays( self ):
+		success, columns = self.select( [ [ b"1", b"1.5", b"a" ], [ b"-2", b"-2e3", b"b" ] ] )
+		self.assertTrue( success )
+		self.assertEqual( columns["level"].dtype, Columns.numpy.int8 )
+		self.assertEqual( columns["level"].tolist(), [1, -2] )
+		self.assertEqual( columns["score"].tolist(), [1.5, -2000.0] )
+		self.assertEqual( columns["name"].tolist(), [ "a", "b" ] )
+		self.assertNotIsInstance( columns["level"], Columns.numpy.ma.MaskedArray )
+
+	def test_empty( self ):
+		success, columns = self.select( [] )
+		self.assertTrue( success )
+		self.assertEqual( len( columns["score"] ), 0 )
+
+	def test_null_masked( self ):
+		success, columns = self.select( [ [ None, b"1.5", None ], [ b"3", None, b"b" ] ] )
+		self.assertTrue( success )
+		self.assertEqual( columns["level"].mask.tolist(), [True, False] )
+		self.assertEqual( columns["level"].sum(), 3 )
+		self.assertEqual( columns["score"].mask.tolist(), [False, True] )
+		self.assertEqual( columns["name"].mask.tolist(), [True, False] )
+
+	def test_out_of_range( self ):
+		# 不截断，查询失败
+		self.assertEqual( self.select( [ [ b"300", b"1", b"a" ] ] ), ( False, None ) )
+		self.assertEqual( self.select( [ [ b"1", b"abc", b"a" ] ] ), ( False, None ) )
+
+
+if __name__ == "__main__":
+	unittest.main()
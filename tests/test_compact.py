@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""
+Meta.compact：字段保存在__slots__中，_db_snapshot为tuple；读取、修改、写入、插入的行为与普通实例一致
+"""
+import unittest
+
+import KBEngine
+from EntitySimulator.EntityModel import EntityModel, UNSYNCED
+from EntitySimulator import Fields
+
+
+class CompactItem( EntityModel ):
+	class Meta:
+		db_table = "test_compact_item"
+		compact = True
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	level      = Fields.INT32()
+	name       = Fields.UNICODE()
+
+
+class OverflowItem( EntityModel ):
+	class Meta:
+		db_table = "test_compact_overflow"
+		compact = True
+		compact_overflow = True
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	level      = Fields.INT32()
+
+
+def row( pk, level, name ):
+	return [ str( pk ).encode(), str( level ).encode(), name.encode( "utf-8" ) ]
+
+
+class Results(object):
+	"""
+	"""
+	def __init__( self ):
+		self.calls = []
+
+	def __call__( self, *args ):
+		self.calls.append( args )
+
+
+class CompactTest(unittest.TestCase):
+	"""
+	"""
+	def test_slots( self ):
+		m = CompactItem( level = 1 )
+		self.assertFalse( hasattr( m, "__dict__" ) )
+		self.assertEqual( ( m.databaseID, m.level, m.name ), ( 0, 1, "" ) )
+		with self.assertRaises( AttributeError ):
+			m.buffs = []
+		with self.assertRaises( AttributeError ):
+			CompactItem( buffs = [] )
+
+	def test_overflow( self ):
+		m = OverflowItem( level = 1, buffs = [] )
+		self.assertEqual( m.buffs, [] )
+		self.assertIn( "level", OverflowItem.__slots__ )
+
+	def test_new_instance_all_dirty( self ):
+		m = CompactItem( level = 1 )
+		self.assertIs( m._db_snapshot, CompactItem._meta.empty_snapshot )
+		self.assertEqual( m.get_dirty_fields(), { "databaseID" : 0, "level" : 1, "name" : "" } )
+
+	def test_select( self ):
+		cb = Results()
+		CompactItem.objects.select( cb, level__gte = 0 )
+		KBEngine.reply( result = [ row( 1, 5, "a" ), row( 2, 6, "b" ) ] )
+		success, models = cb.calls[0]
+		self.assertTrue( success )
+		self.assertEqual( [ ( m.databaseID, m.level, m.name ) for m in models ], [ ( 1, 5, "a" ), ( 2, 6, "b" ) ] )
+		self.assertEqual( models[0]._db_snapshot, ( 1, 5, "a" ) )
+		self.assertFalse( any( m.is_dirty() for m in models ) )
+
+	def test_update_writes_dirty_fields_only( self ):
+		m = CompactItem.from_db( [ "databaseID", "level", "name" ], row( 1, 5, "a" ) )
+		m.level = 6
+		self.assertEqual( m.get_dirty_fields(), { "level" : 6 } )
+		cb = Results()
+		m.writeToDB( cb )
+		cmd = KBEngine.reply( rows = 1 )
+		self.assertIn( b"level = 6", cmd )
+		self.assertNotIn( b"name", cmd )
+		self.assertEqual( cb.calls, [ ( True, m ) ] )
+		self.assertFalse( m.is_dirty() )
+		self.assertIsInstance( m._db_snapshot, tuple )
+
+	def test_partial_read( self ):
+		m = CompactItem.from_db( [ "databaseID", "level" ], [ b"1", b"5" ] )
+		self.assertEqual( m._db_snapshot, ( 1, 5, UNSYNCED ) )
+		self.assertEqual( m.get_db_snapshot(), { "databaseID" : 1, "level" : 5 } )
+		# 没有读取的字段使用默认值，视为修改过
+		self.assertEqual( m.get_dirty_fields(), { "name" : "" } )
+
+	def test_insert( self ):
+		m = CompactItem( level = 3, name = "c" )
+		cb = Results()
+		m.writeToDB( cb )
+		cmd = KBEngine.reply( insertid = 9 )
+		self.assertTrue( cmd.startswith( b"INSERT INTO test_compact_item ( level, name ) VALUES " ) )
+		self.assertEqual( cb.calls, [ ( True, m ) ] )
+		self.assertEqual( m.databaseID, 9 )
+		self.assertEqual( m._db_snapshot, ( 9, 3, "c" ) )
+		self.assertFalse( m.is_dirty() )
+
+
+if __name__ == "__main__":
+	unittest.main()
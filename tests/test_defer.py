@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""
+QuerySet.only()、defer()：延迟加载的字段不出现在SELECT中，访问时抛出AttributeError，
+load_deferred()加载后恢复正常；writeToDB()不写入没有加载的字段
+"""
+import unittest
+
+import KBEngine
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator import Fields
+
+
+class DeferItem( EntityModel ):
+	class Meta:
+		db_table = "test_defer_item"
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	level      = Fields.INT32()
+	data       = Fields.BLOB()
+
+
+class Results(object):
+	"""
+	"""
+	def __init__( self ):
+		self.calls = []
+
+	def __call__( self, *args ):
+		self.calls.append( args )
+
+
+class DeferTest(unittest.TestCase):
+	"""
+	"""
+	def select( self, qs, rows ):
+		cb = Results()
+		qs.select( cb, level__gte = 0 )
+		cmd = KBEngine.reply( result = rows )
+		self.assertTrue( cb.calls[0][0] )
+		return cmd, cb.calls[0][1]
+
+	def test_defer_omits_column( self ):
+		cmd, models = self.select( DeferItem.objects.defer( "data" ), [ [ b"1", b"5" ] ] )
+		self.assertTrue( cmd.startswith( b"SELECT id, level FROM" ) )
+		m = models[0]
+		self.assertEqual( m.level, 5 )
+		self.assertEqual( m.get_deferred_fields(), { "data" } )
+		with self.assertRaises( AttributeError ):
+			m.data
+		self.assertFalse( m.is_dirty() )
+
+	def test_only_keeps_primary_key( self ):
+		cmd, models = self.select( DeferItem.objects.only( "data" ), [ [ b"1", b"x" ] ] )
+		self.assertTrue( cmd.startswith( b"SELECT id, data FROM" ) )
+		self.assertEqual( ( models[0].databaseID, models[0].data ), ( 1, b"x" ) )
+		self.assertEqual( models[0].get_deferred_fields(), { "level" } )
+
+	def test_load_deferred( self ):
+		cmd, models = self.select( DeferItem.objects.defer( "data" ), [ [ b"1", b"5" ], [ b"2", b"6" ] ] )
+		models[1].data = b"local"
+		cb = Results()
+		DeferItem.objects.load_deferred( cb, models )
+		cmd = KBEngine.reply( result = [ [ b"1", b"a" ], [ b"2", b"b" ] ] )
+		self.assertTrue( cmd.startswith( b"SELECT id, data FROM test_defer_item" ) )
+		self.assertEqual( cb.calls, [ ( True, models ) ] )
+		self.assertEqual( models[0].data, b"a" )
+		self.assertFalse( models[0].is_dirty() )
+		# 已经赋值的字段保留本地的值，仍然视为修改过
+		self.assertEqual( models[1].data, b"local" )
+		self.assertEqual( models[1].get_dirty_fields(), { "data" : b"local" } )
+		self.assertEqual( [ m._deferred for m in models ], [ None, None ] )
+
+	def test_write_skips_deferred( self ):
+		cmd, models = self.select( DeferItem.objects.defer( "data" ), [ [ b"1", b"5" ] ] )
+		m = models[0]
+		m.level = 6
+		cb = Results()
+		m.writeToDB( cb )
+		cmd = KBEngine.reply( rows = 1 )
+		self.assertIn( b"level = 6", cmd )
+		self.assertNotIn( b"data", cmd )
+		self.assertEqual( cb.calls, [ ( True, m ) ] )
+		self.assertEqual( m.get_deferred_fields(), { "data" } )
+
+	def test_write_assigned_deferred( self ):
+		cmd, models = self.select( DeferItem.objects.defer( "data" ), [ [ b"1", b"5" ] ] )
+		m = models[0]
+		m.data = b"new"
+		m.writeToDB( None )
+		cmd = KBEngine.reply( rows = 1 )
+		self.assertIn( b"data = 'new'", cmd )
+		self.assertFalse( m.is_dirty() )
+
+	def test_insert_rejects_deferred( self ):
+		cmd, models = self.select( DeferItem.objects.defer( "data" ), [ [ b"1", b"5" ] ] )
+		with self.assertRaises( AssertionError ):
+			DeferItem.objects.insert_model( None, models[0] )
+		with self.assertRaises( AssertionError ):
+			DeferItem.objects.bulk_insert( None, [ DeferItem( level = 1 ), models[0] ] )
+		self.assertEqual( KBEngine.commands, [] )
+		# 加载之后可以插入
+		DeferItem.objects.load_deferred( None, models )
+		KBEngine.reply( result = [ [ b"1", b"a" ] ] )
+		DeferItem.objects.insert_model( None, models[0] )
+		self.assertIn( b"( 5, 'a' )", KBEngine.reply( insertid = 2 ) )
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""
+MysqlUtility的参数转义与mysql-connector的MySQLConverter（to_mysql -> escape -> quote）逐字节对比。
+运行（需要安装mysql-connector-python）：
+python -m pytest tests
+"""
+import datetime, decimal, enum, os, random, re, sys, unittest
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), "..", "common" ) )
+
+try:
+	from mysql.connector.conversion import MySQLConverter
+	import MysqlUtility
+except ImportError:
+	MySQLConverter = None
+
+
+SPECIAL_CHARS = "\\\n\r'\"\032\x00abc%s中文é\t"
+
+FIXED_VALUES = [
+	0, -1, 2**70, -2**63, True, False, None,
+	1.5, -0.0, 1e20, 1e-7, float( "inf" ), float( "nan" ),
+	decimal.Decimal( "1.50" ), decimal.Decimal( "-1E+3" ), decimal.Decimal( "NaN" ),
+	datetime.datetime( 2020, 1, 2, 3, 4, 5 ), datetime.datetime( 999, 1, 2, 3, 4, 5, 6 ),
+	datetime.date( 2021, 12, 31 ), datetime.time( 1, 2, 3, 4 ),
+	datetime.timedelta( days = -1, seconds = 5, microseconds = 3 ),
+	"", b"", bytearray( b"a'b\\" ),
+]
+
+
+class IntEnum(enum.IntEnum):
+	A = 1
+
+
+def random_values( rnd, count ):
+	"""
+	"""
+	values = []
+	for i in range( count ):
+		values.append( "".join( rnd.choice( SPECIAL_CHARS ) for j in range( rnd.randint( 0, 12 ) ) ) )
+		values.append( bytes( rnd.randrange( 256 ) for j in range( rnd.randint( 0, 16 ) ) ) )
+		values.append( rnd.random() * 10 ** rnd.randint( -20, 20 ) )
+		values.append( rnd.randint( -2**64, 2**64 ) )
+	return values
+
+
+@unittest.skipIf( MySQLConverter is None, "mysql-connector-python is not installed" )
+class EscapeTest(unittest.TestCase):
+	"""
+	"""
+	def setUp( self ):
+		self.converter = MySQLConverter( "utf8", True )
+		self.values = FIXED_VALUES + random_values( random.Random( 3 ), 2000 )
+
+	def reference( self, value ):
+		c = self.converter
+		return bytes( c.quote( c.escape( c.to_mysql( value ) ) ) )
+
+	def test_process_param( self ):
+		for v in self.values:
+			self.assertEqual( MysqlUtility.process_param( v ), self.reference( v ), repr( v ) )
+
+	def test_process_params( self ):
+		self.assertEqual( MysqlUtility.process_params( self.values ), tuple( [ self.reference( v ) for v in self.values ] ) )
+
+	def test_process_params_dict( self ):
+		r = MysqlUtility.process_params_dict( { "a" : "x'y", "b" : 1 } )
+		self.assertEqual( r, { b"%(a)s" : self.reference( "x'y" ), b"%(b)s" : b"1" } )
+
+	def outcome( self, fn, value ):
+		try:
+			return fn( value )
+		except Exception as e:
+			return type( e )
+
+	def test_unsupported_types( self ):
+		# 子类和不常用的类型的结果（或抛出的异常）与已安装的MySQLConverter相同
+		for v in ( IntEnum.A, [1], object() ):
+			self.assertEqual( self.outcome( MysqlUtility.process_param, v ), self.outcome( self.reference, v ), repr( v ) )
+
+	def test_make_safe_sql( self ):
+		pattern = re.compile( b"(%s)" )
+		rnd = random.Random( 5 )
+		for i in range( 500 ):
+			n = rnd.randint( 0, 5 )
+			op = "UPDATE t SET " + ", ".join( "c%d = %%s" % j for j in range( n ) ) + " WHERE x = 'a'"
+			params = [ rnd.choice( self.values ) for j in range( n ) ]
+			it = iter( [ self.reference( p ) for p in params ] )
+			expected = pattern.sub( lambda m : next( it ), op.encode() )
+			self.assertEqual( MysqlUtility.makeSafeSql( op, params ), expected )
+
+	def test_make_safe_sql_param_count( self ):
+		self.assertRaises( Exception, MysqlUtility.makeSafeSql, "a = %s", [] )
+		self.assertRaises( Exception, MysqlUtility.makeSafeSql, "a = 1", [1] )
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""
+ExistenceFilter：构建、构建期间插入的key、重建期间继续使用原来的过滤器、构建期间失效
+"""
+import unittest
+
+import KBEngine
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator.utils.expressions import F
+from EntitySimulator import Fields
+
+
+class ExistItem( EntityModel ):
+	class Meta:
+		db_table = "test_exist_item"
+		existence_filter = "code"
+		existence_filter_capacity = 1000
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	code       = Fields.UNICODE()
+
+
+class ExistenceFilterTest(unittest.TestCase):
+	"""
+	"""
+	def setUp( self ):
+		self.existence = ExistItem._meta.existence
+		self.existence.invalidate()
+
+	def build( self, pages, batch = 2 ):
+		results = []
+		ExistItem.objects.build_existence_filter( lambda *args : results.append( args ), batch )
+		for page in pages:
+			KBEngine.reply( result = [ [ k.encode() ] for k in page ] )
+		return results
+
+	def test_build( self ):
+		self.assertEqual( self.build( [ [ "a", "b" ], [ "c" ] ] ), [ ( True, 3 ) ] )
+		self.assertTrue( self.existence.ready )
+		self.assertTrue( self.existence.might_contain( "B " ) )
+		self.assertFalse( self.existence.might_contain( "zzz" ) )
+
+	def test_insert_during_build( self ):
+		results = []
+		ExistItem.objects.build_existence_filter( lambda *args : results.append( args ), 2 )
+		KBEngine.reply( result = [ [ b"a" ], [ b"m" ] ] )
+		# 扫描已经越过的key
+		ExistItem.objects.insert( None, code = "b" )
+		KBEngine.reply( 1, insertid = 10 )
+		KBEngine.reply( result = [ [ b"x" ] ] )
+		self.assertEqual( results, [ ( True, 3 ) ] )
+		self.assertTrue( self.existence.might_contain( "b" ) )
+
+	def test_old_filter_used_while_rebuilding( self ):
+		self.build( [ [ "a" ] ] )
+		ExistItem.objects.build_existence_filter( None, 2 )
+		self.assertTrue( self.existence.ready )
+		self.assertFalse( self.existence.might_contain( "zzz" ) )
+		KBEngine.reply( result = [ [ b"zzz" ] ] )
+		self.assertTrue( self.existence.might_contain( "zzz" ) )
+		self.assertFalse( self.existence.might_contain( "a" ) )
+
+	def test_invalidated_while_building( self ):
+		results = []
+		ExistItem.objects.build_existence_filter( lambda *args : results.append( args ), 2 )
+		ExistItem.objects.filter( databaseID = 1 ).update( None, code = F( "code" ) )
+		KBEngine.reply( 0, result = [ [ b"a" ] ] )
+		self.assertEqual( results, [ ( False, 0 ) ] )
+		self.assertFalse( self.existence.ready )
+
+
+if __name__ == "__main__":
+	unittest.main()
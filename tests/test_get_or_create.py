@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+"""
+get_or_create：先插入（INSERT IGNORE），由影响行数判断是否创建了新记录，再读取该记录
+"""
+import unittest
+
+import KBEngine
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator import Fields
+
+
+class GocItem( EntityModel ):
+	class Meta:
+		db_table = "test_goc_item"
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	name       = Fields.UNICODE()
+	level      = Fields.INT32()
+
+
+class GetOrCreateTest(unittest.TestCase):
+	"""
+	"""
+	def run_get_or_create( self, insertRows, row ):
+		results = []
+		GocItem.objects.get_or_create( lambda *args : results.append( args ), defaults = { "level" : 1 }, name = "a" )
+		cmd = KBEngine.reply( rows = insertRows, insertid = 5 if insertRows else 0 )
+		self.assertTrue( cmd.startswith( b"INSERT IGNORE INTO test_goc_item" ) )
+		self.assertNotIn( b";", cmd )
+		self.assertEqual( results, [] )
+		cmd = KBEngine.reply( result = [ row ] )
+		self.assertTrue( cmd.startswith( b"SELECT " ) )
+		self.assertIn( b"name = 'a'", cmd )
+		return results
+
+	def test_created( self ):
+		results = self.run_get_or_create( 1, [ b"5", b"a", b"1" ] )
+		success, m, created = results[0]
+		self.assertTrue( success )
+		self.assertTrue( created )
+		self.assertEqual( ( m.databaseID, m.level ), ( 5, 1 ) )
+
+	def test_existing( self ):
+		results = self.run_get_or_create( 0, [ b"3", b"a", b"7" ] )
+		success, m, created = results[0]
+		self.assertTrue( success )
+		self.assertFalse( created )
+		self.assertEqual( ( m.databaseID, m.level ), ( 3, 7 ) )
+
+	def test_insert_error( self ):
+		results = []
+		GocItem.objects.get_or_create( lambda *args : results.append( args ), name = "a" )
+		KBEngine.reply( error = "Table doesn't exist" )
+		self.assertEqual( results, [ ( False, None, False ) ] )
+		self.assertEqual( KBEngine.commands, [] )
+
+
+if __name__ == "__main__":
+	unittest.main()
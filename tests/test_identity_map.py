@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+"""
+IdentityMap以及QuerySet对它的维护：命中/淘汰、写入期间保留实例、写入之前发出的查询的结果不放入缓存、脏字段跟踪
+"""
+import unittest
+
+import KBEngine
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator import Fields
+
+
+class IdentityPlayer( EntityModel ):
+	class Meta:
+		db_table = "test_identity_player"
+		identity_map = True
+		identity_map_size = 3
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	i1         = Fields.INT32( db_column = "sm_i1" )
+	name       = Fields.UNICODE()
+
+
+def row( pk, i1, name = "p" ):
+	return [ str( pk ).encode(), str( i1 ).encode(), name.encode() ]
+
+
+class Results(object):
+	"""
+	收集回调参数
+	"""
+	def __init__( self ):
+		self.calls = []
+
+	def __call__( self, *args ):
+		self.calls.append( args )
+
+	@property
+	def last( self ):
+		return self.calls[-1]
+
+
+class IdentityMapTest(unittest.TestCase):
+	"""
+	"""
+	def setUp( self ):
+		self.identities = IdentityPlayer._meta.identities
+		self.identities.clear()
+		self.identities.hits = self.identities.misses = self.identities.evictions = 0
+
+	def select( self, rows, **kwargs ):
+		cb = Results()
+		pending = len( KBEngine.commands )
+		IdentityPlayer.objects.select( cb, **kwargs )
+		if len( KBEngine.commands ) > pending:
+			KBEngine.reply( pending, result = rows )
+		self.assertTrue( cb.last[0] )
+		return cb.last[1]
+
+	def test_hit_and_miss( self ):
+		a = self.select( [ row( 1, 5 ) ], databaseID = 1 )[0]
+		self.assertEqual( self.identities.stats()["misses"], 1 )
+
+		# 纯主键查询直接从缓存返回同一个实例，不访问数据库
+		cb = Results()
+		IdentityPlayer.objects.select( cb, databaseID = 1 )
+		self.assertEqual( KBEngine.commands, [] )
+		self.assertIs( cb.last[1][0], a )
+		self.assertEqual( self.identities.stats()["hits"], 1 )
+
+		# 部分命中时只查询未命中的主键
+		cb = Results()
+		IdentityPlayer.objects.select( cb, databaseID__in = [1, 2] )
+		self.assertIn( b"id IN (2)", KBEngine.commands[0][0] )
+		KBEngine.reply( result = [ row( 2, 6 ) ] )
+		self.assertEqual( sorted( m.databaseID for m in cb.last[1] ), [1, 2] )
+
+	def test_same_instance_for_same_row( self ):
+		a = self.select( [ row( 1, 5 ) ], i1 = 5 )[0]
+		b = self.select( [ row( 1, 5 ) ], i1__gte = 0 )[0]
+		self.assertIs( a, b )
+
+	def test_lru_eviction( self ):
+		for pk in ( 1, 2, 3 ):
+			self.select( [ row( pk, pk ) ], databaseID = pk )
+		self.identities.get( 1 )  # 1变为最近使用
+		self.select( [ row( 4, 4 ) ], databaseID = 4 )
+		self.assertEqual( len( self.identities ), 3 )
+		self.assertNotIn( 2, self.identities )
+		self.assertIn( 1, self.identities )
+		self.assertEqual( self.identities.stats()["evictions"], 1 )
+
+	def test_load_keeps_local_changes( self ):
+		a = self.select( [ row( 1, 5, "old" ) ], databaseID = 1 )[0]
+		a.i1 = 7
+		b = self.select( [ row( 1, 6, "new" ) ], i1__gte = 0 )[0]
+		self.assertIs( a, b )
+		self.assertEqual( ( a.i1, a.name ), ( 7, "new" ) )
+		self.assertEqual( a.get_dirty_fields(), { "i1" : 7 } )
+
+	def test_dirty_tracking_and_write( self ):
+		a = self.select( [ row( 1, 5 ) ], databaseID = 1 )[0]
+		self.assertFalse( a.is_dirty() )
+		cb = Results()
+		a.writeToDB( cb )
+		self.assertEqual( KBEngine.commands, [] )  # 没有修改时不访问数据库
+		self.assertEqual( cb.last, ( True, a ) )
+
+		a.i1 = 7
+		self.assertTrue( a.is_dirty() )
+		a.writeToDB( cb )
+		cmd = KBEngine.reply( rows = 1 )
+		self.assertIn( b"sm_i1 = 7", cmd )
+		self.assertNotIn( b"name", cmd )
+		self.assertEqual( cb.last, ( True, a ) )
+		self.assertFalse( a.is_dirty() )
+
+	def test_keep_instance_while_write_in_flight( self ):
+		a = self.select( [ row( 1, 5 ) ], databaseID = 1 )[0]
+		a.i1 = 7
+		a.writeToDB()
+		# 写入还没有完成时，按主键查询仍然返回同一个实例
+		b = self.select( [], databaseID = 1 )[0]
+		self.assertIs( a, b )
+		KBEngine.reply( rows = 1 )
+		self.assertIs( self.identities.get( 1 ), a )
+		self.assertEqual( a.i1, 7 )
+
+	def test_other_instances_invalidated_by_update( self ):
+		self.select( [ row( 1, 5 ) ], databaseID = 1 )
+		IdentityPlayer.objects.filter( databaseID = 1 ).update( None, i1 = 9 )
+		self.assertNotIn( 1, self.identities )
+
+	def test_stale_select_after_update( self ):
+		stale = Results()
+		IdentityPlayer.objects.select( stale, i1__gte = 0 )
+
+		IdentityPlayer.objects.filter( databaseID = 1 ).update( None, i1 = 9 )
+		KBEngine.reply( 1, rows = 1 )
+		# 修改之前发出的查询在修改完成后才返回
+		KBEngine.reply( 0, result = [ row( 1, 5 ) ] )
+		self.assertEqual( stale.last[1][0].i1, 5 )
+		self.assertNotIn( 1, self.identities )
+
+		# 之后的查询必须访问数据库
+		cb = Results()
+		IdentityPlayer.objects.select( cb, databaseID = 1 )
+		self.assertEqual( len( KBEngine.commands ), 1 )
+		KBEngine.reply( result = [ row( 1, 9 ) ] )
+		self.assertEqual( cb.last[1][0].i1, 9 )
+
+	def test_stale_select_does_not_revert_written_instance( self ):
+		a = self.select( [ row( 1, 5 ) ], databaseID = 1 )[0]
+		stale = Results()
+		IdentityPlayer.objects.select( stale, i1__gte = 0 )
+
+		a.i1 = 7
+		a.writeToDB()
+		KBEngine.reply( 1, rows = 1 )
+		KBEngine.reply( 0, result = [ row( 1, 5 ) ] )
+		self.assertIsNot( stale.last[1][0], a )
+		self.assertEqual( a.i1, 7 )
+		self.assertFalse( a.is_dirty() )
+		self.assertIs( self.identities.get( 1 ), a )
+
+	def test_select_after_write_is_cached( self ):
+		IdentityPlayer.objects.filter( databaseID = 1 ).update( None, i1 = 9 )
+		KBEngine.reply( rows = 1 )
+		a = self.select( [ row( 1, 9 ) ], i1 = 9 )[0]
+		self.assertIs( self.identities.get( 1 ), a )
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+"""
+iexact生成的sql：LIKE（mysql不支持ILIKE）、转义%和_、None生成IS NULL；查询模板缓存命中与否结果相同
+"""
+import unittest
+
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator.utils.query_utils import Q
+from EntitySimulator import Fields
+
+
+class IexactItem( EntityModel ):
+	class Meta:
+		db_table = "test_iexact_item"
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	name       = Fields.UNICODE( db_column = "sm_name" )
+
+
+class IexactTest(unittest.TestCase):
+	"""
+	"""
+	def where( self, value ):
+		sql = IexactItem.objects.build_select_sql( name__iexact = value )
+		# 不经过查询模板生成的条件必须相同
+		self.assertTrue( sql.endswith( b" WHERE " + Q( name__iexact = value ).as_sql( IexactItem._meta ) ), sql )
+		return sql.split( b" WHERE ", 1 )[1]
+
+	def test_like( self ):
+		self.assertEqual( self.where( "Abc" ), b" ( sm_name LIKE 'Abc' )" )
+		# 第二次使用缓存的查询模板
+		self.assertEqual( self.where( "x" ), b" ( sm_name LIKE 'x' )" )
+
+	def test_wildcards_escaped( self ):
+		self.assertEqual( self.where( "a%b_c\\" ), b" ( sm_name LIKE 'a\\\\%b\\\\_c\\\\\\\\' )" )
+
+	def test_none( self ):
+		self.assertEqual( self.where( None ), b" ( sm_name IS NULL )" )
+
+
+if __name__ == "__main__":
+	unittest.main()
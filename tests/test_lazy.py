@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""
+QuerySet.lazy()：行在第一次访问时才生成实例，字段在第一次访问时才转换；转换结果与立即解码一致
+"""
+import unittest
+
+import KBEngine
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator.Lazy import LazyResult
+from EntitySimulator import Fields
+
+
+class LazyItem( EntityModel ):
+	class Meta:
+		db_table = "test_lazy_item"
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	level      = Fields.INT32()
+	name       = Fields.UNICODE()
+
+
+class MappedItem( EntityModel ):
+	class Meta:
+		db_table = "test_lazy_mapped"
+		identity_map = True
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	level      = Fields.INT32()
+
+
+def row( pk, level, name = "" ):
+	return [ str( pk ).encode(), str( level ).encode(), name.encode( "utf-8" ) ]
+
+
+class Results(object):
+	"""
+	"""
+	def __init__( self ):
+		self.calls = []
+
+	def __call__( self, *args ):
+		self.calls.append( args )
+
+
+class LazyTest(unittest.TestCase):
+	"""
+	"""
+	def select( self, rows, qs = None ):
+		cb = Results()
+		( qs or LazyItem.objects.lazy() ).select( cb, level__gte = 0 )
+		KBEngine.reply( result = rows )
+		self.assertTrue( cb.calls[0][0] )
+		return cb.calls[0][1]
+
+	def test_rows_materialized_on_access( self ):
+		result = self.select( [ row( 1, 5, "a" ), row( 2, 6, "b" ), row( 3, 7, "c" ) ] )
+		self.assertIsInstance( result, LazyResult )
+		self.assertEqual( len( result ), 3 )
+		self.assertEqual( result.models, [None] * 3 )
+		m = result[1]
+		self.assertIs( result[1], m )
+		self.assertEqual( result.models.count( None ), 2 )
+		self.assertEqual( [ x.databaseID for x in result[1:] ], [ 2, 3 ] )
+
+	def test_fields_decoded_on_access( self ):
+		m = self.select( [ row( 1, 5, "名字" ) ] )[0]
+		self.assertNotIn( "level", vars( m ) )
+		self.assertEqual( m.level, 5 )
+		self.assertIn( "level", vars( m ) )
+		self.assertNotIn( "name", vars( m ) )
+		eager = LazyItem.from_db( [ "databaseID", "level", "name" ], row( 1, 5, "名字" ) )
+		self.assertEqual( ( m.databaseID, m.level, m.name ), ( eager.databaseID, eager.level, eager.name ) )
+
+	def test_dirty_and_write( self ):
+		m = self.select( [ row( 1, 5, "a" ) ] )[0]
+		self.assertFalse( m.is_dirty() )
+		m.level = 6
+		self.assertEqual( m.get_dirty_fields(), { "level" : 6 } )
+		cb = Results()
+		m.writeToDB( cb )
+		cmd = KBEngine.reply( rows = 1 )
+		self.assertIn( b"level = 6", cmd )
+		self.assertNotIn( b"name", cmd )
+		self.assertEqual( cb.calls, [ ( True, m ) ] )
+		self.assertFalse( m.is_dirty() )
+
+	def test_with_only( self ):
+		cb = Results()
+		LazyItem.objects.lazy().only( "level" ).select( cb, level__gte = 0 )
+		cmd = KBEngine.reply( result = [ [ b"1", b"5" ] ] )
+		self.assertNotIn( b"name", cmd )
+		m = cb.calls[0][1][0]
+		self.assertEqual( m.level, 5 )
+		with self.assertRaises( AttributeError ):
+			m.name
+
+	def test_identity_map_decodes_fully( self ):
+		cb = Results()
+		MappedItem.objects.lazy().select( cb, level__gte = 0 )
+		KBEngine.reply( result = [ [ b"1", b"5" ] ] )
+		m = cb.calls[0][1][0]
+		self.assertEqual( vars( m ).get( "level" ), 5 )
+		self.assertIs( MappedItem._meta.identities.get( 1 ), m )
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+"""
+BatchLoader：合并同一个tick内的get()、主键值规范化、没有identity map时每个回调得到各自的实例
+"""
+import unittest
+
+import KBEngine
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator import Fields
+
+
+class LoadItem( EntityModel ):
+	class Meta:
+		db_table = "test_load_item"
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	level      = Fields.INT32()
+
+
+class LoadCode( EntityModel ):
+	class Meta:
+		db_table = "test_load_code"
+		identity_map = True
+
+	code  = Fields.UNICODE( primary_key = True )
+	level = Fields.INT32()
+
+
+class Results(object):
+	"""
+	"""
+	def __init__( self ):
+		self.calls = []
+
+	def __call__( self, *args ):
+		self.calls.append( args )
+
+
+class LoaderTest(unittest.TestCase):
+	"""
+	"""
+	def test_merged_into_one_select( self ):
+		a, b = Results(), Results()
+		LoadItem.objects.get( a, 1 )
+		LoadItem.objects.get( b, 2 )
+		self.assertEqual( KBEngine.commands, [] )
+		KBEngine.fire_timers()
+		cmd = KBEngine.reply( result = [ [ b"2", b"20" ] ] )
+		self.assertIn( b"id IN (1, 2)", cmd )
+		self.assertEqual( a.calls, [ ( True, None ) ] )
+		self.assertEqual( b.calls[0][1].level, 20 )
+
+	def test_key_normalized( self ):
+		a, b = Results(), Results()
+		LoadItem.objects.get( a, 5 )
+		LoadItem.objects.get( b, "5" )
+		KBEngine.fire_timers()
+		cmd = KBEngine.reply( result = [ [ b"5", b"50" ] ] )
+		self.assertIn( b"id IN (5)", cmd )
+		self.assertEqual( a.calls[0][1].level, 50 )
+		self.assertEqual( b.calls[0][1].level, 50 )
+
+	def test_separate_instances_without_identity_map( self ):
+		a, b = Results(), Results()
+		LoadItem.objects.get( a, 5 )
+		LoadItem.objects.get( b, 5 )
+		KBEngine.fire_timers()
+		KBEngine.reply( result = [ [ b"5", b"50" ] ] )
+		ma, mb = a.calls[0][1], b.calls[0][1]
+		self.assertIsNot( ma, mb )
+		ma.level = 1
+		self.assertEqual( mb.level, 50 )
+		self.assertFalse( mb.is_dirty() )
+
+	def test_string_keys_and_identity_map( self ):
+		LoadCode._meta.identities.clear()
+		a, b = Results(), Results()
+		LoadCode.objects.get( a, "abc" )
+		LoadCode.objects.get( b, "ABC" )
+		KBEngine.fire_timers()
+		# 按排序规则"ABC"与"abc"是同一条记录
+		KBEngine.reply( result = [ [ b"abc", b"1" ] ] )
+		self.assertIs( a.calls[0][1], b.calls[0][1] )
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+MemoryTable：在内存中计算查询条件，含有NULL的字段、取反条件以及取决于排序规则的字符串条件
+"""
+import unittest
+
+import KBEngine
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator.utils.query_utils import Q
+from EntitySimulator import Fields
+
+
+class ConfigItem( EntityModel ):
+	class Meta:
+		db_table = "test_config_item"
+		preload = True
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	level      = Fields.INT32()
+	weight     = Fields.INT32()
+	name       = Fields.UNICODE()
+
+
+def row( pk, level, weight, name ):
+	encode = lambda v : v if v is None else str( v ).encode()
+	return [ encode( pk ), encode( level ), encode( weight ), encode( name ) ]
+
+
+class MemoryTableTest(unittest.TestCase):
+	"""
+	"""
+	def setUp( self ):
+		self.table = ConfigItem._meta.memory_table
+		self.table.invalidate()
+		self.table.reload()
+		KBEngine.reply( result = [
+			row( 1, 0, 10, "abc" ),
+			row( 2, None, 20, "ABC" ),
+			row( 3, 5, None, "xyz" ),
+			row( 4, 5, 30, "Xyz " ),
+		] )
+		self.assertTrue( self.table.ready )
+
+	def select( self, *args, **kwargs ):
+		"""
+		@return 在内存中计算时返回主键列表，需要访问数据库时返回None
+		"""
+		results = []
+		ConfigItem.objects.select( lambda success, models : results.append( models ), *args, **kwargs )
+		if KBEngine.commands:
+			KBEngine.reset()
+			return None
+		return sorted( m.databaseID for m in results[0] )
+
+	def test_null_columns_not_evaluated( self ):
+		self.assertEqual( self.table.null_attrs, set( [ "level", "weight" ] ) )
+		# NULL在内存中是0，但在数据库中level = 0不成立
+		self.assertIsNone( self.select( level = 0 ) )
+		self.assertIsNone( self.select( ~Q( level = 5 ) ) )
+		self.assertIsNone( self.select( weight__gte = 0 ) )
+		self.assertIsNone( self.table.query( [], ( "weight", ) ) )
+		self.assertEqual( self.select( databaseID__in = [1, 2] ), [1, 2] )
+
+	def test_negation( self ):
+		self.assertEqual( self.select( ~Q( databaseID = 1 ) ), [2, 3, 4] )
+		self.assertEqual( self.select( ~Q( databaseID__gte = 3 ) | Q( databaseID = 4 ) ), [1, 2, 4] )
+		self.assertEqual( self.select( ~Q( name = "zzz" ) ), [1, 2, 3, 4] )
+
+	def test_collation( self ):
+		# 只有大小写或末尾空格不同的值，结果取决于排序规则
+		self.assertIsNone( self.select( name = "abc" ) )
+		self.assertIsNone( self.select( name = "xyz" ) )
+		self.assertIsNone( self.select( name__gt = "a" ) )
+		self.assertEqual( self.select( name = "zzz" ), [] )
+		self.assertIsNone( self.select( name__iexact = "XYZ" ) )
+		self.assertEqual( self.select( name__in = [ "zzz" ] ), [] )
+
+	def test_apply_with_null( self ):
+		self.table.invalidate()
+		self.table.reload()
+		KBEngine.reply( result = [ row( 1, 0, 10, "a" ) ] )
+		self.assertEqual( self.select( level = 0 ), [1] )
+		self.table.apply( { "databaseID" : 2, "level" : 0, "weight" : 0, "name" : "b" }, [ "level" ] )
+		self.assertIsNone( self.select( level = 0 ) )
+		self.assertEqual( self.select( weight = 0 ), [2] )
+
+
+if __name__ == "__main__":
+	unittest.main()
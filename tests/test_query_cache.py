@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+QueryCache：命中时不访问数据库且实例互不影响、写入使整个表的缓存失效、写入之前发出的查询的结果不放入缓存、LRU淘汰
+"""
+import unittest
+
+import KBEngine
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator import Fields
+
+
+class ShopItem( EntityModel ):
+	class Meta:
+		db_table = "test_shop_item"
+		query_cache_ttl = 60
+		query_cache_size = 2
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	price      = Fields.INT32()
+
+
+def row( pk, price ):
+	return [ str( pk ).encode(), str( price ).encode() ]
+
+
+class Results(object):
+	"""
+	"""
+	def __init__( self ):
+		self.calls = []
+
+	def __call__( self, *args ):
+		self.calls.append( args )
+
+	@property
+	def prices( self ):
+		return [ m.price for m in self.calls[-1][1] ]
+
+
+class QueryCacheTest(unittest.TestCase):
+	"""
+	"""
+	def setUp( self ):
+		self.cache = ShopItem._meta.query_cache
+		self.cache.clear()
+
+	def select( self, rows = None, **kwargs ):
+		cb = Results()
+		ShopItem.objects.select( cb, **kwargs )
+		if rows is not None:
+			KBEngine.reply( len( KBEngine.commands ) - 1, result = rows )
+		return cb
+
+	def test_hit( self ):
+		a = self.select( [ row( 1, 10 ) ], price__gte = 0 )
+		b = self.select( price__gte = 0 )
+		self.assertEqual( KBEngine.commands, [] )
+		self.assertEqual( b.prices, [10] )
+		# 每次命中都生成新的实例
+		self.assertIsNot( a.calls[0][1][0], b.calls[0][1][0] )
+		b.calls[0][1][0].price = 99
+		self.assertEqual( self.select( price__gte = 0 ).prices, [10] )
+
+	def test_write_invalidates_table( self ):
+		self.select( [ row( 1, 10 ) ], price__gte = 0 )
+		ShopItem.objects.filter( databaseID = 1 ).update( None, price = 11 )
+		KBEngine.reply( rows = 1 )
+		self.select( price__gte = 0 )
+		self.assertEqual( len( KBEngine.commands ), 1 )
+
+	def test_write_racing_select( self ):
+		stale = self.select( price__gte = 0 )
+		ShopItem.objects.filter( databaseID = 1 ).update( None, price = 11 )
+		KBEngine.reply( 1, rows = 1 )
+		# 修改之前发出的查询在修改完成后才返回：结果交给调用者，但不放入缓存
+		KBEngine.reply( 0, result = [ row( 1, 10 ) ] )
+		self.assertEqual( stale.prices, [10] )
+		self.assertEqual( len( self.cache ), 0 )
+		fresh = self.select( [ row( 1, 11 ) ], price__gte = 0 )
+		self.assertEqual( fresh.prices, [11] )
+		self.assertEqual( self.select( price__gte = 0 ).prices, [11] )
+
+	def test_write_issued_while_select_in_flight( self ):
+		stale = self.select( price__gte = 0 )
+		ShopItem.objects.filter( databaseID = 1 ).update( None, price = 11 )
+		# 修改还没有完成时查询就返回了
+		KBEngine.reply( 0, result = [ row( 1, 10 ) ] )
+		self.assertEqual( len( self.cache ), 0 )
+		KBEngine.reply( rows = 1 )
+		self.assertEqual( len( self.cache ), 0 )
+
+	def test_lru_eviction( self ):
+		for price in ( 1, 2, 3 ):
+			self.select( [ row( price, price ) ], price = price )
+		self.assertEqual( len( self.cache ), 2 )
+		self.assertEqual( self.cache.stats()["evictions"], 1 )
+		self.select( price = 1 )
+		self.assertEqual( len( KBEngine.commands ), 1 )
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+"""
+SaveScheduler：还没有主键的实例分散到各个时间槽、紧急存档期间再次flush_all()
+"""
+import unittest
+
+import KBEngine
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator.SaveScheduler import SaveScheduler
+from EntitySimulator import Fields
+
+
+class SaveItem( EntityModel ):
+	class Meta:
+		db_table = "test_save_item"
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	level      = Fields.INT32()
+
+
+class SaveSchedulerTest(unittest.TestCase):
+	"""
+	"""
+	def test_spread_without_primary_key( self ):
+		scheduler = SaveScheduler( period = 16.0, tick = 1.0 )
+		models = [ SaveItem( level = i ) for i in range( 64 ) ]
+		for m in models:
+			scheduler.register( m )
+		used = [ slot for slot in scheduler.slots if slot ]
+		self.assertGreaterEqual( len( used ), 12 )
+		self.assertLessEqual( max( [ len( slot ) for slot in used ] ), 12 )
+
+	def test_flush_all_twice( self ):
+		scheduler = SaveScheduler( period = 4.0, tick = 1.0 )
+		for pk in ( 1, 2 ):
+			m = SaveItem( databaseID = pk, level = pk )
+			scheduler.register( m )
+		first, second = [], []
+		scheduler.flush_all( lambda *args : first.append( args ) )
+		self.assertEqual( len( KBEngine.commands ), 2 )
+		scheduler.flush_all( lambda *args : second.append( args ) )
+		# 正在存档的实例不会重复写入
+		self.assertEqual( len( KBEngine.commands ), 2 )
+		KBEngine.reply( rows = 1 )
+		KBEngine.reply( rows = 1 )
+		self.assertEqual( first, [ ( True, 2 ) ] )
+		self.assertEqual( second, [ ( True, 2 ) ] )
+		self.assertEqual( KBEngine.timers, {} )
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""
+SharedCache：写入进程与只读进程（同一进程中的两个SharedCache对象模拟）、写入之前发出的查询的结果不写入共享缓存
+"""
+import os, shutil, tempfile, unittest
+
+import KBEngine
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator.SharedCache import SharedCache
+from EntitySimulator import Fields
+
+
+class SharedItem( EntityModel ):
+	class Meta:
+		db_table = "test_shared_item"
+		query_cache_ttl = 60
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	price      = Fields.INT32()
+
+
+def row( pk, price ):
+	return [ str( pk ).encode(), str( price ).encode() ]
+
+
+class SharedCacheTest(unittest.TestCase):
+	"""
+	"""
+	def setUp( self ):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join( self.dir, "item" )
+		self.assertTrue( SharedItem.objects.attach_shared_cache( self.path, writer = True, slots = 64 ) )
+		self.writer = SharedItem._meta.shared_cache
+		self.reader = SharedCache( SharedItem, self.path )
+		SharedItem._meta.query_cache.clear()
+
+	def tearDown( self ):
+		self.reader.close()
+		self.writer.close()
+		SharedItem._meta.shared_cache = None
+		shutil.rmtree( self.dir )
+
+	def test_reader_sees_writer_rows( self ):
+		SharedItem.objects.select( None, price__gte = 0 )
+		KBEngine.reply( result = [ row( 1, 10 ), row( 2, 20 ) ] )
+		hits, missing = self.reader.lookup( [1, 2, 3] )
+		self.assertEqual( sorted( ( m.databaseID, m.price ) for m in hits ), [ ( 1, 10 ), ( 2, 20 ) ] )
+		self.assertEqual( missing, [3] )
+
+	def test_write_removes_row( self ):
+		SharedItem.objects.select( None, price__gte = 0 )
+		KBEngine.reply( result = [ row( 1, 10 ) ] )
+		SharedItem.objects.filter( databaseID = 1 ).update( None, price = 11 )
+		self.assertIsNone( self.reader.get_values( 1 ) )
+
+	def test_stale_select_not_republished( self ):
+		SharedItem.objects.select( None, price__gte = 0 )
+		SharedItem.objects.filter( databaseID = 1 ).update( None, price = 11 )
+		KBEngine.reply( 1, rows = 1 )
+		# 修改之前发出的查询在修改完成后才返回
+		KBEngine.reply( 0, result = [ row( 1, 10 ) ] )
+		self.assertIsNone( self.reader.get_values( 1 ) )
+
+		SharedItem.objects.select( None, price__gte = 0 )
+		KBEngine.reply( result = [ row( 1, 11 ) ] )
+		self.assertEqual( self.reader.get_values( 1 ), { "databaseID" : 1, "price" : 11 } )
+
+	def test_query_cache_replay_not_republished( self ):
+		SharedItem.objects.select( None, price__gte = 0 )
+		KBEngine.reply( result = [ row( 1, 10 ) ] )
+		self.writer.remove( [1] )
+		# 相同的查询从查询结果缓存返回，不再写入共享缓存
+		results = []
+		SharedItem.objects.select( lambda success, models : results.append( models ), price__gte = 0 )
+		self.assertEqual( KBEngine.commands, [] )
+		self.assertEqual( results[0][0].price, 10 )
+		self.assertIsNone( self.reader.get_values( 1 ) )
+
+	def test_reader_skips_own_writes( self ):
+		SharedItem.objects.select( None, price__gte = 0 )
+		KBEngine.reply( result = [ row( 1, 10 ) ] )
+		self.reader.mark_stale( [1] )
+		self.assertIsNone( self.reader.get_values( 1 ) )
+		# 写入进程重新写入之后可以读取
+		self.writer.put( SharedItem.from_values( { "databaseID" : 1, "price" : 12 } ) )
+		self.assertEqual( self.reader.get_values( 1 )["price"], 12 )
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""
+single flight：相同的select在执行期间只发出一次，结果分发给每个等待者各自的实例；写入之后的查询不再等待写入之前发出的查询
+"""
+import unittest
+
+import KBEngine
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator import Fields
+
+
+class RosterItem( EntityModel ):
+	class Meta:
+		db_table = "test_roster_item"
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	rank       = Fields.INT32()
+
+
+class Unshared( EntityModel ):
+	class Meta:
+		db_table = "test_roster_unshared"
+		single_flight = False
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	rank       = Fields.INT32()
+
+
+def row( pk, rank ):
+	return [ str( pk ).encode(), str( rank ).encode() ]
+
+
+class Results(object):
+	"""
+	"""
+	def __init__( self ):
+		self.calls = []
+
+	def __call__( self, *args ):
+		self.calls.append( args )
+
+
+class SingleFlightTest(unittest.TestCase):
+	"""
+	"""
+	def test_fan_out_independent_instances( self ):
+		waiters = [ Results() for i in range( 3 ) ]
+		for cb in waiters:
+			RosterItem.objects.select( cb, rank__gte = 0 )
+		self.assertEqual( len( KBEngine.commands ), 1 )
+		KBEngine.reply( result = [ row( 1, 5 ) ] )
+		models = [ cb.calls[0][1][0] for cb in waiters ]
+		self.assertEqual( len( set( map( id, models ) ) ), 3 )
+		models[0].rank = 9
+		self.assertEqual( [ m.rank for m in models[1:] ], [5, 5] )
+		self.assertFalse( models[1].is_dirty() )
+
+	def test_different_sql_not_merged( self ):
+		RosterItem.objects.select( None, rank__gte = 0 )
+		RosterItem.objects.select( None, rank__gte = 1 )
+		self.assertEqual( len( KBEngine.commands ), 2 )
+
+	def test_no_join_after_write( self ):
+		before, after = Results(), Results()
+		RosterItem.objects.select( before, rank__gte = 0 )
+		RosterItem.objects.filter( databaseID = 1 ).update( None, rank = 7 )
+		RosterItem.objects.select( after, rank__gte = 0 )
+		# 写入之后的查询必须单独发出，不能拿到写入之前的结果
+		self.assertEqual( len( KBEngine.commands ), 3 )
+		KBEngine.reply( 0, result = [ row( 1, 5 ) ] )
+		self.assertEqual( after.calls, [] )
+		KBEngine.reply( 0, rows = 1 )
+		KBEngine.reply( 0, result = [ row( 1, 7 ) ] )
+		self.assertEqual( before.calls[0][1][0].rank, 5 )
+		self.assertEqual( after.calls[0][1][0].rank, 7 )
+
+	def test_error_fans_out( self ):
+		waiters = [ Results() for i in range( 2 ) ]
+		for cb in waiters:
+			RosterItem.objects.select( cb, rank__gte = 0 )
+		KBEngine.reply( error = "Lost connection" )
+		self.assertEqual( [ cb.calls for cb in waiters ], [ [ ( False, None ) ] ] * 2 )
+		# 失败之后的查询重新发出
+		RosterItem.objects.select( None, rank__gte = 0 )
+		self.assertEqual( len( KBEngine.commands ), 1 )
+
+	def test_disabled( self ):
+		Unshared.objects.select( None, rank__gte = 0 )
+		Unshared.objects.select( None, rank__gte = 0 )
+		self.assertEqual( len( KBEngine.commands ), 2 )
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+"""
+UnitOfWork：一条"ROLLBACK; START TRANSACTION; ...; COMMIT; SELECT ..."批量语句、每条语句的结果、失败时回滚
+"""
+import unittest
+
+import KBEngine
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator.UnitOfWork import UnitOfWork
+from EntitySimulator.utils.expressions import F
+from EntitySimulator import Fields
+
+
+class UowPlayer( EntityModel ):
+	class Meta:
+		db_table = "test_uow_player"
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	gold       = Fields.INT32()
+
+
+class UowLog( EntityModel ):
+	class Meta:
+		db_table = "test_uow_log"
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	gold       = Fields.INT32()
+
+
+class UnitOfWorkTest(unittest.TestCase):
+	"""
+	"""
+	def test_batch_and_results( self ):
+		results = []
+		m = UowPlayer( gold = 5 )
+		with UnitOfWork( lambda *args : results.append( args ) ) as uow:
+			uow.save( m )
+			uow.update( UowPlayer.objects.filter( databaseID = 2 ), gold = F( "gold" ) - 10 )
+			uow.insert( UowLog, gold = 10 )
+		self.assertEqual( len( KBEngine.commands ), 1 )
+		cmd = KBEngine.commands[0][0]
+		stmts = cmd.split( b"; " )
+		self.assertEqual( stmts[:2], [ b"ROLLBACK", b"START TRANSACTION" ] )
+		self.assertTrue( stmts[2].startswith( b"INSERT INTO test_uow_player" ) )
+		self.assertEqual( stmts[3], b"SET @es_uow_0 = LAST_INSERT_ID()" )
+		self.assertTrue( stmts[4].startswith( b"UPDATE test_uow_player" ) )
+		self.assertEqual( stmts[5], b"SET @es_uow_1 = ROW_COUNT()" )
+		self.assertEqual( stmts[-2:], [ b"COMMIT", b"SELECT @es_uow_0, @es_uow_1, @es_uow_2" ] )
+
+		KBEngine.reply( result = [ [ b"7", b"1", b"8" ] ] )
+		self.assertEqual( results, [ ( True, [7, 1, 8] ) ] )
+		self.assertEqual( m.databaseID, 7 )
+		self.assertFalse( m.is_dirty() )
+
+	def test_rollback_on_error( self ):
+		results = []
+		with UnitOfWork( lambda *args : results.append( args ), threadID = 3 ) as uow:
+			uow.insert( UowLog, gold = 10 )
+			uow.insert( UowLog, gold = 11 )
+		KBEngine.reply( error = "Duplicate entry" )
+		self.assertEqual( results, [ ( False, [None, None] ) ] )
+		# 事务在同一个dbmgr线程上回滚
+		self.assertEqual( [ ( cmd, threadID ) for cmd, cb, threadID in KBEngine.commands ], [ ( b"ROLLBACK", 3 ) ] )
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+QuerySet.values()、values_list()：只查询指定的字段，结果为dict、tuple或值的列表，不生成实例
+"""
+import unittest
+
+import KBEngine
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator import Fields
+
+
+class ValueItem( EntityModel ):
+	class Meta:
+		db_table = "test_value_item"
+		identity_map = True
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	level      = Fields.INT32( db_column = "lv" )
+	name       = Fields.UNICODE()
+	data       = Fields.BLOB()
+
+
+class Results(object):
+	"""
+	"""
+	def __init__( self ):
+		self.calls = []
+
+	def __call__( self, *args ):
+		self.calls.append( args )
+
+
+class ValuesTest(unittest.TestCase):
+	"""
+	"""
+	def setUp( self ):
+		ValueItem._meta.identities.clear()
+
+	def select( self, qs, rows, **kwargs ):
+		cb = Results()
+		qs.select( cb, **kwargs )
+		cmd = KBEngine.reply( result = rows )
+		self.assertEqual( len( cb.calls ), 1 )
+		self.assertTrue( cb.calls[0][0] )
+		return cmd, cb.calls[0][1]
+
+	def test_dict( self ):
+		cmd, result = self.select( ValueItem.objects.values( "databaseID", "name" ), [ [ b"1", b"a" ], [ b"2", None ] ], level__gte = 0 )
+		self.assertTrue( cmd.startswith( b"SELECT id, name FROM test_value_item" ) )
+		self.assertEqual( result, [ { "databaseID" : 1, "name" : "a" }, { "databaseID" : 2, "name" : "" } ] )
+
+	def test_tuple( self ):
+		cmd, result = self.select( ValueItem.objects.values_list( "name", "level" ), [ [ b"a", b"5" ] ], level__gte = 0 )
+		self.assertTrue( cmd.startswith( b"SELECT name, lv FROM" ) )
+		self.assertEqual( result, [ ( "a", 5 ) ] )
+
+	def test_flat( self ):
+		cmd, result = self.select( ValueItem.objects.values_list( "level", flat = True ), [ [ b"5" ], [ None ] ], level__gte = 0 )
+		self.assertTrue( cmd.startswith( b"SELECT lv FROM" ) )
+		self.assertEqual( result, [ 5, 0 ] )
+
+	def test_all_fields( self ):
+		cmd, result = self.select( ValueItem.objects.values(), [ [ b"1", b"5", b"a", b"\x00" ] ], level__gte = 0 )
+		self.assertTrue( cmd.startswith( b"SELECT id, lv, name, data FROM" ) )
+		self.assertEqual( result, [ { "databaseID" : 1, "level" : 5, "name" : "a", "data" : b"\x00" } ] )
+
+	def test_matches_model_decoding( self ):
+		raw = [ b"7", b"-1", "名字".encode( "utf-8" ), b"x" ]
+		attrs = list( ValueItem._meta.fields )
+		m = ValueItem.from_db( attrs, raw )
+		self.assertEqual( ValueItem.get_values_decoder( "dict", attrs )( raw ), { k : getattr( m, k ) for k in attrs } )
+
+	def test_bypasses_identity_map( self ):
+		m = ValueItem.from_values( { "databaseID" : 1, "level" : 5, "name" : "a", "data" : b"" } )
+		ValueItem._meta.identities.put( m )
+		m.level = 6  # 尚未写入数据库的修改不会出现在结果中
+		cmd, result = self.select( ValueItem.objects.values_list( "level", flat = True ), [ [ b"5" ] ], databaseID = 1 )
+		self.assertEqual( result, [ 5 ] )
+		self.assertEqual( len( ValueItem._meta.identities ), 1 )
+
+	def test_error( self ):
+		cb = Results()
+		ValueItem.objects.values( "name" ).select( cb, level__gte = 0 )
+		KBEngine.reply( error = "Lost connection" )
+		self.assertEqual( cb.calls, [ ( False, None ) ] )
+
+
+if __name__ == "__main__":
+	unittest.main()
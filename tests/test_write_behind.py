@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+"""
+WriteBehindBuffer：合并写入、写入失败时放回缓冲区重试、超过重试次数后回调失败
+"""
+import unittest
+
+import KBEngine
+from EntitySimulator.EntityModel import EntityModel
+from EntitySimulator import Fields, WriteBehind
+
+
+class BehindItem( EntityModel ):
+	class Meta:
+		db_table = "test_behind_item"
+		write_behind = True
+		write_behind_retries = 2
+
+	databaseID = Fields.INT32( db_column = "id", primary_key = True )
+	level      = Fields.INT32()
+	gold       = Fields.INT32()
+
+
+class WriteBehindTest(unittest.TestCase):
+	"""
+	"""
+	def setUp( self ):
+		self.buffer = BehindItem._meta.write_buffer
+		self.buffer.pending.clear()
+		self.buffer.timerID = 0
+		self.m = BehindItem.from_values( { "databaseID" : 1, "level" : 1, "gold" : 10 } )
+		self.results = []
+
+	def write( self, **values ):
+		for k, v in values.items():
+			setattr( self.m, k, v )
+		self.m.writeToDB( lambda *args : self.results.append( args ) )
+
+	def test_merged( self ):
+		self.write( level = 2 )
+		self.write( gold = 20 )
+		self.assertEqual( KBEngine.commands, [] )
+		KBEngine.fire_timers()
+		cmd = KBEngine.reply( rows = 1 )
+		self.assertIn( b"level = 2", cmd )
+		self.assertIn( b"gold = 20", cmd )
+		self.assertEqual( self.results, [ ( True, self.m ), ( True, self.m ) ] )
+		self.assertFalse( self.m.is_dirty() )
+
+	def test_retry_after_failure( self ):
+		self.write( level = 2, gold = 20 )
+		KBEngine.fire_timers()
+		self.write( gold = 30 )  # 失败的写入返回之前又有新的写入
+		KBEngine.reply( error = "Lock wait timeout" )
+		self.assertEqual( self.results, [] )
+		KBEngine.fire_timers()
+		cmd = KBEngine.reply( rows = 1 )
+		self.assertIn( b"level = 2", cmd )
+		self.assertIn( b"gold = 30", cmd )
+		self.assertEqual( len( self.results ), 2 )
+		self.assertTrue( all( success for success, m in self.results ) )
+
+	def test_give_up_after_retries( self ):
+		self.write( level = 2 )
+		for i in range( 3 ):
+			KBEngine.fire_timers()
+			KBEngine.reply( error = "Lock wait timeout" )
+		self.assertEqual( self.results, [ ( False, self.m ) ] )
+		self.assertEqual( len( self.buffer ), 0 )
+		self.assertEqual( KBEngine.timers, {} )
+
+	def test_flush_all( self ):
+		self.write( level = 2 )
+		WriteBehind.flush_all()
+		self.assertEqual( len( KBEngine.commands ), 1 )
+
+
+if __name__ == "__main__":
+	unittest.main()